@@ -1,10 +1,9 @@
 
-
-import json
 from os import listdir
 from os.path import isfile, join
 
-from tqdm import tqdm
+from jupyter import codec
+
 # from dotmap import DotMap
 # from toolbox.util import jsoniter
 
@@ -17,29 +16,41 @@ def get_files_under_dir(path, extension=''):
     return only_files
 
 def num_lines_in_file(filename):
-    return sum(1 for line in open(filename))
+    # from the line index if the file has a fresh one. imported here, since
+    # python -m jupyter.line_index imports this package first
+    from jupyter import line_index
+    return line_index.count(filename, write=False)
 
 def jdumpl(lst, filename):
     with open(filename, 'w') as f:
         for js in lst:
             assert not isinstance(js, str)
-            f.write(json.dumps(js) + '\n')
-
-def jsoniter(filename, lines=None):
-    fobj = open(filename)
-    for i, line in enumerate(fobj):
-        if lines and i == lines:
-            break
-        yield json.loads(line)
+            f.write(codec.dumps(js) + '\n')
+
+def jsoniter(filename, lines=None, start=0, stop=None):
+    '''Yield the records of a jsonl file, at most lines of them. With start or stop only
+    the records start to stop, the file is then seeked to with its line index.'''
+    if start or stop is not None:
+        from jupyter import line_index
+        if lines:
+            stop = start + lines if stop is None else min(stop, start + lines)
+        yield from line_index.jsoniter(filename, start, stop)
+        return
+    with open(filename) as fobj:
+        for i, line in enumerate(fobj):
+            if lines and i == lines:
+                break
+            yield codec.loads(line)
 
 
 def jloadl(filename, lines=-1, dotmap=False, progress=False):
+    from tqdm import tqdm
     with open(filename) as fobj:
         lst = []
         for i, line in tqdm(enumerate(fobj)):
             if i == lines:
                 break
-            js = json.loads(line)
+            js = codec.loads(line)
             lst.append(js)
         return lst
 
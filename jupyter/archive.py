@@ -0,0 +1,118 @@
+''' Reading the notebook corpus straight from the downloaded archive.
+
+An input dir can be a dir inside an archive, e.g. juice_notebooks.zip/nbgrader stands
+for the jsonl files under nbgrader/ of the zip, also under a top-level dir of the zip
+like juice_notebooks/nbgrader/. So the pipelines run on the archive without unpacking
+it first:
+
+    python -m jupyter.run_all -input_dir juice_notebooks.zip -pipeline_dir ...
+
+zip, tar, tar.gz/tgz and tar.zst archives work, zstd needs the zstandard package.
+stage_io reads the members like the unpacked files: the partitions stream their member
+(or blocksize bytes of it) out of the archive in parallel, nothing is written to disk.
+Only a member of a tar, or one stored uncompressed in a zip, can be read at an offset.
+A deflated zip member is decompressed from its start to get to any offset in it, and
+the members of a compressed tar from the start of the archive, so each of those is one
+partition and blocksize is ignored. Prefer tar or zip -0 for runs on many workers.
+'''
+
+import os
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from functools import lru_cache
+from os.path import dirname, getmtime, isfile
+
+from jupyter.compression import open_file
+
+SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.zst')
+
+
+def split_path(path):
+    '''(archive, dir inside the archive) if path is in an archive, otherwise None.'''
+    head = path.rstrip('/')
+    inner = []
+    while head and head not in ('/', '.'):
+        if head.endswith(SUFFIXES) and isfile(head):
+            return head, '/'.join(reversed(inner))
+        head, name = os.path.split(head)
+        inner.append(name)
+    return None
+
+
+def is_archive_path(path):
+    return split_path(path) is not None
+
+
+def _compressed_tar(archive):
+    return archive.endswith(('.tar.gz', '.tgz', '.tar.zst'))
+
+
+@contextmanager
+def _open_tar(archive):
+    if not _compressed_tar(archive):
+        with tarfile.open(archive) as tar:
+            yield tar
+        return
+    # a stream, compressed tars can't seek back
+    with open_file(archive, 'rb', 'gzip' if archive.endswith('.tgz') else None) as f, \
+            tarfile.open(fileobj=f, mode='r|') as tar:
+        yield tar
+
+
+@lru_cache(maxsize=16)
+def _list(archive, mtime):
+    '''(name, size) of the files in the archive, a pass over all of a compressed tar.'''
+    if archive.endswith('.zip'):
+        with zipfile.ZipFile(archive) as z:
+            return [(info.filename, info.file_size) for info in z.infolist() if not info.filename.endswith('/')]
+    with _open_tar(archive) as tar:
+        return [(member.name, member.size) for member in tar if member.isfile()]
+
+
+def members(path, suffix='.jsonl'):
+    '''(name, size) of the files with suffix directly under the dir path inside an
+    archive, sorted by name like the glob of db.read_text.'''
+    archive, inner = split_path(path)
+    files = [(name, size) for name, size in _list(archive, getmtime(archive)) if name.endswith(suffix)]
+    if not inner:
+        return sorted((name, size) for name, size in files if not dirname(name))
+    dirs = set(dirname(name) for name, _ in files
+               if dirname(name) == inner or dirname(name).endswith('/' + inner))
+    if len(dirs) > 1:
+        raise ValueError(f'{path} matches several dirs in {archive}: {", ".join(sorted(dirs))}')
+    return sorted((name, size) for name, size in files if dirname(name) in dirs)
+
+
+@contextmanager
+def open_member(archive, name):
+    '''The member of the archive as a binary file, without extracting it.'''
+    if archive.endswith('.zip'):
+        with zipfile.ZipFile(archive) as z, z.open(name) as f:
+            yield f
+        return
+    with _open_tar(archive) as tar:
+        if not _compressed_tar(archive):
+            yield tar.extractfile(name)
+            return
+        for member in tar:
+            if member.name == name:
+                yield tar.extractfile(member)
+                return
+    raise KeyError(f'{name} is not in {archive}')
+
+
+@lru_cache(maxsize=16)
+def _stored(archive, mtime):
+    '''Names of the members of the zip that are stored uncompressed.'''
+    with zipfile.ZipFile(archive) as z:
+        return frozenset(info.filename for info in z.infolist() if info.compress_type == zipfile.ZIP_STORED)
+
+
+def splittable(archive, name):
+    '''Whether the member can be read from an offset without decompressing what comes
+    before it, true for the members of uncompressed tars and stored zip members.'''
+    if archive.endswith('.zip'):
+        # ZipExtFile.seek of a deflated member decompresses up to the offset
+        return name in _stored(archive, getmtime(archive))
+    return not _compressed_tar(archive)
@@ -0,0 +1,78 @@
+''' Disk, cpu and wall time of the compression codecs on real records.
+
+Writes the records of a stage dir (or of jsonl files) as one shard per codec and
+intermediate format, the way the stages write them, then reads it back. For each it
+reports the bytes on disk and their fraction of uncompressed jsonl, and the wall and
+cpu seconds of writing and reading. Codecs that aren't installed are skipped.
+
+usage:
+python -m jupyter.benchmarks.compression -input {pipeline dir}/nbgrader/cells
+python -m jupyter.benchmarks.compression -input {notebooks dir}/nbgrader -limit 5000
+'''
+
+import argparse
+import tempfile
+import time
+from os.path import getsize, join
+
+from jupyter import codec
+from jupyter import columnar
+from jupyter import stage_io
+from jupyter.benchmarks.json_codec import read_lines
+from jupyter.compression import CODECS, check_installed, open_file
+
+
+def _timed(fn, *args):
+    '''(result, wall seconds, cpu seconds) of fn(*args).'''
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fn(*args)
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def measure(records, fmt, compression, outdir):
+    (shard, _), write_wall, write_cpu = _timed(stage_io.write_shard, records, outdir,
+                                               f'{fmt}-{compression}', fmt, compression)
+    read, read_wall, read_cpu = _timed(_read, join(outdir, shard), fmt)
+    assert read == records, f'{fmt} {compression} read different records'
+    return getsize(join(outdir, shard)), write_wall, write_cpu, read_wall, read_cpu
+
+
+def _read(path, fmt):
+    if fmt == 'columnar':
+        return columnar.read(path)
+    with open_file(path, 'rt') as f:
+        return [codec.loads(line) for line in f]
+
+
+def main(paths, limit, formats, codecs):
+    records = [codec.loads(line) for line in read_lines(paths, limit)]
+    assert records, f'no json lines in {paths}'
+    installed = []
+    for name in codecs:
+        try:
+            check_installed(name)
+            installed.append(name)
+        except ImportError as e:
+            print(f'skipping {name}: {e}')
+
+    with tempfile.TemporaryDirectory() as outdir:
+        rows = [(fmt, name, measure(records, fmt, name, outdir)) for fmt in formats for name in installed]
+    baseline = next((row[0] for fmt, name, row in rows if (fmt, name) == ('jsonl', 'none')), None)
+
+    print(f'{len(records)} records')
+    print(f'{"format":<9} {"codec":<6} {"MB":>8} {"of jsonl":>9} {"write s":>8} {"cpu s":>7} {"read s":>7} {"cpu s":>7}')
+    for fmt, name, (size, write_wall, write_cpu, read_wall, read_cpu) in rows:
+        fraction = f'{size / baseline:9.2f}' if baseline else f'{"":>9}'
+        print(f'{fmt:<9} {name:<6} {size / 2**20:8.2f} {fraction} {write_wall:8.2f} {write_cpu:7.2f} '
+              f'{read_wall:7.2f} {read_cpu:7.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-input', nargs='+', required=True, help='stage dirs or jsonl files')
+    parser.add_argument('-limit', type=int, default=20000, help='records to read')
+    parser.add_argument('-formats', nargs='+', choices=stage_io.FORMATS, default=stage_io.FORMATS)
+    parser.add_argument('-codecs', nargs='+', choices=CODECS, default=CODECS)
+    opts = parser.parse_args()
+
+    main(opts.input, opts.limit, opts.formats, opts.codecs)
@@ -0,0 +1,115 @@
+''' Startup-time budget of the pipeline modules.
+
+Every process based worker and every `python -m jupyter.*` imports the pipeline
+modules, so a heavy dependency imported at module level is paid over and over. This
+imports each module in a fresh interpreter with -X importtime and fails if
+
+- the import takes longer than its budget in import_budget.json times 1 + -tolerance
+- the import pulls in one of the LAZY dependencies, which have to be imported by the
+  functions that use them
+
+usage:
+python -m jupyter.benchmarks.import_time
+python -m jupyter.benchmarks.import_time -update     # after an intended change
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+
+# the entry points and the modules the stages import
+MODULES = [
+    'jupyter.run_all',
+    'jupyter.sharding',
+    'jupyter.incremental',
+    'jupyter.nbgrader.pipeline_nbgrader',
+    'jupyter.new_pipeline.pipeline_train',
+    'jupyter.exercise.pipeline',
+    'jupyter.nbgrader.split',
+    'jupyter.new_pipeline.nb_filter',
+    'jupyter.new_pipeline.to_dataset',
+]
+
+# dependencies only some stages need
+LAZY = ['sklearn', 'pandas', 'numpy', 'nltk', 'polyglot', 'bs4', 'markdown2', 'astor',
+        'datasketch', 'nbconvert', 'nbformat']
+
+BUDGET_FILE = join(dirname(abspath(__file__)), 'import_budget.json')
+REPO_DIR = dirname(dirname(dirname(abspath(__file__))))
+
+
+def _importtime(code):
+    '''[(cumulative microseconds, indentation, module)] python -X importtime reports for code.'''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get('PYTHONPATH', '')]))
+    # an import that writes to the working dir doesn't litter the repo
+    with tempfile.TemporaryDirectory() as cwd:
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                              cwd=cwd, env=env, stderr=subprocess.PIPE, universal_newlines=True)
+    assert proc.returncode == 0, proc.stderr
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        rows.append((int(cumulative), len(name) - len(name.lstrip()), name.strip()))
+    return rows
+
+
+def measure(module, repeat):
+    '''Milliseconds importing module takes (the fastest of repeat runs) and the
+    top-level packages it imports, not counting what the interpreter imports anyway.'''
+    startup = {name for _, _, name in _importtime('pass')}
+    best = None
+    for _ in range(repeat):
+        rows = [r for r in _importtime(f'import {module}') if r[2] not in startup]
+        indent = min(i for _, i, _ in rows)
+        ms = sum(c for c, i, _ in rows if i == indent) / 1000
+        best = ms if best is None else min(best, ms)
+    return best, {name.split('.')[0] for _, _, name in rows}
+
+
+def main(modules, repeat, tolerance, update):
+    if sys.version_info < (3, 7):
+        # older interpreters ignore -X importtime and print nothing to measure
+        sys.exit(f'-X importtime needs python 3.7+, this is {sys.version.split()[0]}')
+
+    with open(BUDGET_FILE) as f:
+        budget = json.load(f)
+
+    failures = []
+    print(f'{"module":<40} {"ms":>8} {"budget":>8}')
+    for module in modules:
+        ms, imported = measure(module, repeat)
+        print(f'{module:<40} {ms:8.1f} {budget.get(module, float("nan")):8.1f}')
+        eager = sorted(imported.intersection(LAZY))
+        if eager:
+            failures.append(f'{module} imports {", ".join(eager)} at module level')
+        if update:
+            budget[module] = round(ms, 1)
+        elif module not in budget:
+            failures.append(f'{module} has no budget, run with -update')
+        elif ms > budget[module] * (1 + tolerance):
+            failures.append(f'{module} takes {ms:.1f}ms to import, budget is {budget[module]}ms')
+
+    if update:
+        with open(BUDGET_FILE, 'w') as f:
+            json.dump(budget, f, indent=1, sort_keys=True)
+    for failure in failures:
+        print(failure)
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-modules', nargs='+', default=MODULES)
+    parser.add_argument('-repeat', type=int, default=5, help='imports of each module, the fastest counts')
+    parser.add_argument('-tolerance', type=float, default=0.5,
+                        help='fraction an import may be slower than its budget, imports are noisy')
+    parser.add_argument('-update', action='store_true', help='write the measured times as the budget')
+    opts = parser.parse_args()
+
+    sys.exit(0 if main(opts.modules, opts.repeat, opts.tolerance, opts.update) else 1)
@@ -0,0 +1,104 @@
+''' Throughput of the json backends of jupyter.codec on real records.
+
+Reads the first -limit lines of the jsonl shards of a stage dir (or of jsonl files)
+and, for each installed backend, times decoding and encoding them. It also checks the
+results against the json module: the decoded values have to be the same, and the
+encoded lines the same bytes for the backend to encode stage outputs. The last
+column is what jupyter.codec uses the backend for.
+
+usage:
+python -m jupyter.benchmarks.json_codec -input {pipeline dir}/nbgrader/cells
+python -m jupyter.benchmarks.json_codec -input {notebooks dir}/nbs.jsonl -limit 500
+'''
+
+import argparse
+import json
+import os
+import time
+from os.path import isdir, join
+
+from jupyter import codec
+
+
+def _encoder(name):
+    '''The backend's own encoder of a value to a json line, as a str.'''
+    if name == 'orjson':
+        import orjson
+        return lambda obj: orjson.dumps(obj).decode('utf8')
+    if name == 'msgspec':
+        import msgspec
+        return lambda obj: msgspec.json.encode(obj).decode('utf8')
+    return codec._dumper(name) or json.dumps
+
+
+def read_lines(paths, limit):
+    files = []
+    for path in paths:
+        if isdir(path):
+            files += sorted(join(path, name) for name in os.listdir(path) if name.endswith('.jsonl'))
+        else:
+            files.append(path)
+    lines = []
+    for path in files:
+        with open(path) as f:
+            for line in f:
+                lines.append(line.rstrip('\n'))
+                if len(lines) == limit:
+                    return lines
+    return lines
+
+
+def _best(fn, values, repeat):
+    '''Seconds of the fastest of repeat runs of fn over values, and its results.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [fn(v) for v in values]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, results
+
+
+def measure(name, lines, repeat):
+    try:
+        decode = codec._loader(name) or json.loads
+        encode = _encoder(name)
+    except ImportError:
+        return None
+    megabytes = sum(len(line.encode('utf8')) for line in lines) / 2**20
+    expected = [json.loads(line) for line in lines]
+
+    decode_s, decoded = _best(codec._with_fallback(decode, json.loads), lines, repeat)
+    same_values = all(codec._same(a, b) for a, b in zip(decoded, expected))
+    encode_s, encoded = _best(codec._with_fallback(encode, json.dumps), expected, repeat)
+    same_bytes = encoded == [json.dumps(js) for js in expected]
+
+    _, loads, dumps = codec._select(name, False)
+    uses = [what for what, fn, slow in [('decode', loads, json.loads), ('encode', dumps, json.dumps)]
+            if fn is not slow]
+    return megabytes / decode_s, same_values, megabytes / encode_s, same_bytes, ', '.join(uses) or '-'
+
+
+def main(paths, limit, repeat):
+    lines = read_lines(paths, limit)
+    assert lines, f'no json lines in {paths}'
+    print(f'{len(lines)} records, {sum(map(len, lines)) / len(lines):.0f} characters on average, '
+          f'the codec selected {codec.backend()}')
+    print(f'{"backend":<10} {"decode MB/s":>12} {"same values":>12} {"encode MB/s":>12} {"same bytes":>11}  codec uses')
+    for name in codec.BACKENDS:
+        row = measure(name, lines, repeat)
+        if row is None:
+            print(f'{name:<10} not installed')
+            continue
+        decode, same_values, encode, same_bytes, uses = row
+        print(f'{name:<10} {decode:12.1f} {str(same_values):>12} {encode:12.1f} {str(same_bytes):>11}  {uses}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-input', nargs='+', required=True, help='stage dirs or jsonl files')
+    parser.add_argument('-limit', type=int, default=2000, help='records to read')
+    parser.add_argument('-repeat', type=int, default=3, help='runs of each backend, the fastest counts')
+    opts = parser.parse_args()
+
+    main(opts.input, opts.limit, opts.repeat)
@@ -0,0 +1,63 @@
+''' The kernel filter decided on the json text (nb_scan) against parsing every notebook.
+
+Reads the first -limit lines of notebooks (or exercise records with -records, their
+notebook is the json text in contents) and runs exercise/filters.is_python both ways:
+on every parsed notebook, and on the text with only the notebooks it can't decide on
+parsed. Exits 1 if the two keep different notebooks.
+
+usage:
+python -m jupyter.benchmarks.pushdown -input {pipeline dir}/nbgrader/nbs
+python -m jupyter.benchmarks.pushdown -input {notebooks dir}/exercise -records
+'''
+
+import argparse
+import sys
+import time
+
+from jupyter import codec
+from jupyter.benchmarks.json_codec import read_lines
+from jupyter.exercise import filters
+
+
+def full_parse(texts):
+    return [filters.is_python(codec.loads(t)) for t in texts]
+
+
+def pushed_down(texts):
+    kept = []
+    for t in texts:
+        keep = filters.is_python_text(t)
+        kept.append(filters.is_python(codec.loads(t)) if keep is None else keep)
+    return kept
+
+
+def main(paths, limit, records):
+    lines = read_lines(paths, limit)
+    assert lines, f'no json lines in {paths}'
+    texts = [codec.loads(line)['contents'] for line in lines] if records else lines
+    decided = sum(filters.is_python_text(t) is not None for t in texts)
+    print(f'{len(texts)} notebooks, {sum(map(len, texts)) / len(texts):.0f} characters on average, '
+          f'{decided / len(texts):.1%} decided on the text')
+
+    results = {}
+    print(f'{"":<12} {"seconds":>8} {"kept":>6}')
+    for name, fn in [('full parse', full_parse), ('pushed down', pushed_down)]:
+        start = time.perf_counter()
+        results[name] = fn(texts)
+        print(f'{name:<12} {time.perf_counter() - start:8.2f} {sum(results[name]):6}')
+
+    different = [i for i, (a, b) in enumerate(zip(results['full parse'], results['pushed down'])) if a != b]
+    if different:
+        print(f'{len(different)} notebooks kept differently, e.g. line {different[0]}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-input', nargs='+', required=True, help='stage dirs or jsonl files')
+    parser.add_argument('-limit', type=int, default=2000, help='notebooks to read')
+    parser.add_argument('-records', action='store_true',
+                        help='the lines are exercise records with the notebook in contents')
+    opts = parser.parse_args()
+
+    main(opts.input, opts.limit, opts.records)
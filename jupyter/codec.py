@@ -0,0 +1,174 @@
+''' The json codec the stages read and write records with.
+
+Parsing and writing json lines is a large part of most stages. loads and dumps use
+the fastest backend that is installed, picked with JUICE_JSON:
+
+    auto       the first of BACKENDS that is installed (the default)
+    stdlib     json.loads and json.dumps
+    orjson, ujson, msgspec
+
+The environment variable reaches the worker processes, so all of them pick the same
+backend. A backend has to give the same results as the json module:
+
+- it decodes only if it reads PROBES back to the same values, and input it rejects
+  (e.g. NaN or lone surrogates) is read by json.loads. orjson reads integers beyond
+  64 bits as floats without an error, so text with 19 digits in a row, which any such
+  integer has, is read by json.loads. Checking for them costs a pass over the text,
+  so auto prefers msgspec, which reads them exactly
+- it encodes only if it writes PROBES byte for byte like json.dumps. Otherwise, and
+  for values it can't write, json.dumps is used, so the files of a stage don't depend
+  on the backend. orjson and msgspec only write compact json, so they only decode.
+
+JUICE_JSON_CHECK=1 compares every value the backend reads or writes with the json
+module and raises on a difference, for trying a new backend on a sample run.
+python -m jupyter.benchmarks.json_codec measures the backends on real records.
+
+Manifests, markers and cache keys keep using the json module.
+'''
+
+import json
+import logging
+import os
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ['msgspec', 'orjson', 'ujson', 'stdlib']
+
+# values where the backends differ from the json module
+PROBES = [
+    {'source': 'print("héllo")\n\t#   \U0001F600 / \\ \x00 \x7f', 'cell_type': 'code',
+     'metadata': {'nb_index': 12, 'tags': [], 'empty': {}}},
+    [0, -1, 2**40, 2**63 - 1, 2**64, 2**70, -2**70, 0.1, 1.5, -0.0, 1e-05, 1e16, 1e22, 5e-324,
+     123456789.123456789, 1.7976931348623157e+308, True, False, None],
+    {'nested': [[[{'a': [1, {'b': 'c'}]}]]], '': '', '1': 1},
+    float('nan'), float('inf'), '\ud800',
+]
+
+
+# every digit to 0, to find runs of digits with bytes.find
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+# integers beyond 64 bits have at least 19 digits, -2**63-1 has 19
+_LONG_NUMBER = b'0' * 19
+
+
+def _may_have_long_int(s):
+    # encoding the ascii json.dumps writes is a fast copy
+    b = s.encode('utf8') if isinstance(s, str) else bytes(s)
+    return b.translate(_DIGITS_TO_ZERO).find(_LONG_NUMBER) >= 0
+
+
+def _orjson_loads(orjson_loads, s):
+    '''orjson.loads, but the json module for text that may have an integer orjson
+    would read as a float.'''
+    if _may_have_long_int(s):
+        return json.loads(s)
+    return orjson_loads(s)
+
+
+def _loader(name):
+    '''The loads of the backend, None for the json module.'''
+    if name == 'orjson':
+        import orjson
+        return partial(_orjson_loads, orjson.loads)
+    if name == 'msgspec':
+        import msgspec
+        return msgspec.json.decode
+    if name == 'ujson':
+        import ujson
+        return ujson.loads
+    return None
+
+
+def _dumper(name):
+    '''The dumps of the backend closest to json.dumps, None if it can't come close.'''
+    if name == 'ujson':
+        import ujson
+        return lambda obj: ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False,
+                                       separators=(', ', ': '))
+    return None
+
+
+def _same(a, b):
+    # repr tells 0.0 from -0.0 and 1 from 1.0, and nan equals nan
+    return repr(a) == repr(b)
+
+
+def _with_fallback(fast, slow):
+    def call(obj):
+        try:
+            return fast(obj)
+        except Exception:
+            return slow(obj)
+    return call
+
+
+def _checked(fast, slow, what):
+    def call(obj):
+        expected = slow(obj)
+        got = fast(obj)
+        if not _same(got, expected):
+            raise ValueError(f'{_backend} {what} {obj!r:.200} differently than the json module')
+        return got
+    return call
+
+
+def _select(requested, check):
+    names = BACKENDS if requested == 'auto' else [requested]
+    if requested not in BACKENDS + ['auto']:
+        raise ValueError(f'unknown JUICE_JSON backend {requested}, use one of auto, {", ".join(BACKENDS)}')
+
+    for name in names:
+        try:
+            fast_loads, fast_dumps = _loader(name), _dumper(name)
+        except ImportError:
+            logger.log(logging.WARNING if requested != 'auto' else logging.DEBUG,
+                       'JUICE_JSON backend %s is not installed', name)
+            continue
+        loads = json.loads if fast_loads is None else _with_fallback(fast_loads, json.loads)
+        if fast_loads and not all(_same(loads(json.dumps(p)), p) for p in PROBES):
+            logger.log(logging.WARNING if requested != 'auto' else logging.DEBUG,
+                       'JUICE_JSON backend %s decodes differently than the json module', name)
+            continue
+        dumps = json.dumps if fast_dumps is None else _with_fallback(fast_dumps, json.dumps)
+        if fast_dumps and not all(dumps(p) == json.dumps(p) for p in PROBES):
+            dumps = json.dumps
+        if check:
+            loads = _checked(loads, json.loads, 'decodes') if loads is not json.loads else loads
+            dumps = _checked(dumps, json.dumps, 'encodes') if dumps is not json.dumps else dumps
+        return name, loads, dumps
+    return 'stdlib', json.loads, json.dumps
+
+
+_backend = _loads = _dumps = None
+
+
+def _use_backend():
+    global _backend, _loads, _dumps
+    # picked on first use, importing the backends takes longer than some modules
+    # using the codec
+    _backend, _loads, _dumps = _select(os.environ.get('JUICE_JSON', 'auto'),
+                                       bool(os.environ.get('JUICE_JSON_CHECK')))
+    logger.debug('Using the %s json backend', _backend)
+
+
+def backend():
+    '''The name of the selected backend.'''
+    if _backend is None:
+        _use_backend()
+    return _backend
+
+
+# module level functions, so dask pickles them by name and every worker selects its own
+def loads(s):
+    '''json.loads(s) with the selected backend.'''
+    if _loads is None:
+        _use_backend()
+    return _loads(s)
+
+
+def dumps(obj):
+    '''json.dumps(obj) with the selected backend.'''
+    if _dumps is None:
+        _use_backend()
+    return _dumps(obj)
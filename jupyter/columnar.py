@@ -0,0 +1,146 @@
+''' Columnar shard files for the intermediate stage directories.
+
+A shard is a sequence of row groups of up to ROW_GROUP_ROWS records. Each row group
+is self contained, so shards can be concatenated like jsonl shards:
+
+    MAGIC, header length (8 bytes), json header, schema ids, one blob per column
+
+The header lists the key orders (schemas) of the records and the size of each blob.
+With a compression (see jupyter.compression) each blob is compressed on its own, the
+header then names the codec and the size of the blobs before compression.
+A column holds the values of one top-level key, pickled as a list, for the records
+that have the key. The schema id of each record is stored only if the records of the
+group differ in their keys. Readers load the blobs of the columns they need and skip
+the others, so e.g. the outputs of code cells are never read by stages that drop them.
+
+Records must be dicts of json-like values. They are read back with the same keys in
+the same order, so the records of a stage don't depend on the format of its input.
+'''
+
+import json
+import pickle
+import struct
+
+from jupyter.compression import compress, decompress
+
+SUFFIX = '.cols'
+MAGIC = b'JCOL\x01'
+ROW_GROUP_ROWS = 1000
+
+_LENGTH = struct.Struct('<Q')
+# the highest protocol python 3.6 reads
+_PROTOCOL = 4
+
+
+def _write_row_group(f, records, compression):
+    schemas = {}
+    ids = []
+    columns = {}
+    for js in records:
+        keys = tuple(js)
+        ids.append(schemas.setdefault(keys, len(schemas)))
+        for k in keys:
+            columns.setdefault(k, []).append(js[k])
+
+    blobs = [pickle.dumps(ids, _PROTOCOL) if len(schemas) > 1 else b'']
+    names = list(columns)
+    blobs += [pickle.dumps(columns[k], _PROTOCOL) for k in names]
+    header = {'rows': len(records),
+              'schemas': [list(keys) for keys in schemas],
+              'columns': names}
+    raw_bytes = sum(len(b) for b in blobs)
+    if compression:
+        header.update(compression=compression, raw_bytes=raw_bytes)
+        blobs = [compress(b, compression) if b else b for b in blobs]
+    header['sizes'] = [len(b) for b in blobs]
+    header = json.dumps(header).encode('utf8')
+    f.write(MAGIC)
+    f.write(_LENGTH.pack(len(header)))
+    f.write(header)
+    for b in blobs:
+        f.write(b)
+    return raw_bytes
+
+
+def write(records, f, compression=None):
+    '''Write the records to the binary file f in row groups, with the blobs compressed
+    with compression if given.
+
+    :return: the bytes of the blobs before compression.
+    '''
+    compression = None if compression == 'none' else compression
+    raw_bytes = 0
+    group = []
+    for js in records:
+        group.append(js)
+        if len(group) == ROW_GROUP_ROWS:
+            raw_bytes += _write_row_group(f, group, compression)
+            group = []
+    if group:
+        raw_bytes += _write_row_group(f, group, compression)
+    return raw_bytes
+
+
+def _read_header(f):
+    magic = f.read(len(MAGIC))
+    if not magic:
+        return None
+    assert magic == MAGIC, f'{f.name} is not a columnar shard'
+    length, = _LENGTH.unpack(f.read(_LENGTH.size))
+    return json.loads(f.read(length).decode('utf8'))
+
+
+def _headers(path):
+    '''(offset, bytes, header) of each row group of the shard.'''
+    with open(path, 'rb') as f:
+        while True:
+            offset = f.tell()
+            header = _read_header(f)
+            if header is None:
+                return
+            f.seek(sum(header['sizes']), 1)
+            yield offset, f.tell() - offset, header
+
+
+def row_groups(path):
+    '''(offset, bytes) of each row group of the shard, bytes before compression.'''
+    return [(offset, header.get('raw_bytes', size)) for offset, size, header in _headers(path)]
+
+
+def count(path):
+    '''Records in the shard, from the row group headers.'''
+    return sum(header['rows'] for _, _, header in _headers(path))
+
+
+def _read_row_group(f, offset, columns):
+    f.seek(offset)
+    header = _read_header(f)
+    schemas = header['schemas']
+    codec = header.get('compression')
+    ids_size, sizes = header['sizes'][0], header['sizes'][1:]
+    ids = pickle.loads(decompress(f.read(ids_size), codec)) if ids_size else [0] * header['rows']
+
+    values = {}
+    for name, size in zip(header['columns'], sizes):
+        if columns is None or name in columns:
+            values[name] = iter(pickle.loads(decompress(f.read(size), codec)))
+        else:
+            f.seek(size, 1)
+
+    # a column only has values for the records with its key, so taking the next
+    # value of each key in the record's schema lines them up again
+    schemas = [[k for k in keys if k in values] for keys in schemas]
+    return [{k: next(values[k]) for k in schemas[i]} for i in ids]
+
+
+def read(path, groups=None, columns=None):
+    '''The records of the given row groups of the shard (default all), with only the
+    given keys (default all).'''
+    if groups is None:
+        groups = row_groups(path)
+    columns = None if columns is None else set(columns)
+    records = []
+    with open(path, 'rb') as f:
+        for offset, _ in groups:
+            records += _read_row_group(f, offset, columns)
+    return records
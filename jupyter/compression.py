@@ -0,0 +1,102 @@
+''' Compression of the intermediate stage dirs.
+
+-compression (or JUICE_COMPRESSION, see execution.py) picks the codec:
+
+    none    the default
+    gzip    in the standard library, so the dirs can be read anywhere
+    zstd    about as small as gzip and several times faster, needs zstandard
+    lz4     the fastest and the largest of the three, needs lz4
+
+jsonl shards are compressed as a whole, e.g. {i}.jsonl.gz. A compressed file can't be
+split, so they are read one partition per shard. Columnar shards compress each column
+blob of a row group instead, so their row groups are still read on their own. The
+compressed files of each codec can be concatenated, which is how shards are compacted.
+
+python -m jupyter.benchmarks.compression measures the codecs on a stage dir.
+'''
+
+import gzip
+import io
+
+CODECS = ['none', 'gzip', 'zstd', 'lz4']
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _module(codec):
+    '''The module of an optional codec, with a hint if it isn't installed.'''
+    try:
+        if codec == 'zstd':
+            import zstandard
+            return zstandard
+        if codec == 'lz4':
+            import lz4.frame
+            return lz4.frame
+    except ImportError:
+        raise ImportError(f'-compression {codec} needs the {"zstandard" if codec == "zstd" else "lz4"} package')
+    return None
+
+
+def check_installed(codec):
+    '''Raise if codec is unknown or not installed.'''
+    if codec not in CODECS:
+        raise ValueError(f'unknown compression {codec}, use one of {", ".join(CODECS)}')
+    _module(codec)
+
+
+def suffix(codec):
+    return SUFFIXES.get(codec, '')
+
+
+def codec_of(path):
+    '''The codec of a file from its suffix, None if it is not compressed.'''
+    for codec, s in SUFFIXES.items():
+        if path.endswith(s):
+            return codec
+    return None
+
+
+def open_file(path, mode='rb', codec=None):
+    '''Open a file compressed with codec (default: from its suffix) like open does.'''
+    codec = codec or codec_of(path)
+    if codec in (None, 'none'):
+        return open(path, mode)
+    binary = mode.replace('t', '') + ('b' if 'b' not in mode else '')
+    if codec == 'gzip':
+        f = gzip.open(path, binary, compresslevel=GZIP_LEVEL)
+    elif codec == 'lz4':
+        f = _module(codec).open(path, binary)
+    else:
+        zstandard = _module(codec)
+        if 'r' in mode:
+            # compacted shards are several frames, buffered for readline
+            f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                                             read_across_frames=True))
+        else:
+            f = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'))
+    if 'b' in mode:
+        return f
+    return io.TextIOWrapper(f, encoding='utf8')
+
+
+def compress(data, codec):
+    '''The bytes data compressed with codec, unchanged for none.'''
+    if codec in (None, 'none'):
+        return data
+    if codec == 'gzip':
+        return gzip.compress(data, GZIP_LEVEL)
+    if codec == 'lz4':
+        return _module(codec).compress(data)
+    return _module(codec).ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def decompress(data, codec):
+    if codec in (None, 'none'):
+        return data
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'lz4':
+        return _module(codec).decompress(data)
+    return _module(codec).ZstdDecompressor().decompress(data)
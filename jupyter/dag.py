@@ -0,0 +1,103 @@
+''' Pipelines as a DAG of stages.
+
+Each pipeline lists its stages with the names of the stages they depend on.
+run_serial keeps the old one-after-another behaviour, run_concurrent starts every
+stage as soon as its dependencies have finished.
+'''
+
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from jupyter import stage_io
+from jupyter import viz_store
+
+logger = logging.getLogger(__name__)
+
+# run is called without arguments, deps are names of other stages, outputs are the
+# dirs/files the stage writes and are only used to measure the stage
+Stage = namedtuple('Stage', ['name', 'run', 'deps', 'outputs'])
+Stage.__new__.__defaults__ = ((),)
+
+
+def prefixed(stages, prefix):
+    '''Namespace the stage names so stages of several pipelines can share a DAG.'''
+    return [Stage(f'{prefix}/{s.name}', s.run, [f'{prefix}/{d}' for d in s.deps], s.outputs)
+            for s in stages]
+
+
+def check(stages):
+    names = set()
+    for s in stages:
+        assert s.name not in names, f'duplicate stage {s.name}'
+        for d in s.deps:
+            assert d in names, f'{s.name} depends on {d} which is not listed before it'
+        names.add(s.name)
+
+
+def _timed(stage, measure=False):
+    logger.info('Starting stage %s', stage.name)
+    start = time.time()
+    stage.run()
+    stats = {'seconds': time.time() - start}
+    measured = stage_io.stage_stats(stage.outputs)
+    if measured:
+        # summed over the partitions, so comparable with the task time, not the stage's
+        stats['io_wait_seconds'] = measured['io_wait_seconds']
+        stats['read_seconds'] = measured['read_seconds']
+        logger.info('Finished stage %s in %.1fs, its tasks waited %.1fs for input that took %.1fs to read',
+                    stage.name, stats['seconds'], stats['io_wait_seconds'], stats['read_seconds'])
+        if measured['counters']['stripped_bytes']:
+            # see jupyter.new_pipeline.ingest
+            stats['stripped_bytes'] = measured['counters']['stripped_bytes']
+            logger.info('Stage %s stripped %.1fMB of outputs and metadata', stage.name, stats['stripped_bytes'] / 2**20)
+    else:
+        logger.info('Finished stage %s in %.1fs', stage.name, stats['seconds'])
+    vizdirs = [path for path in stage.outputs if viz_store.is_store(path)]
+    if vizdirs:
+        stats['viz_deduped_bytes'] = sum(viz_store.deduped_bytes(path) for path in vizdirs)
+        logger.info('Stage %s linked %.1fMB of notebooks it had already dumped', stage.name,
+                    stats['viz_deduped_bytes'] / 2**20)
+    if measure:
+        # measured right away since some outputs are deleted by later stages
+        stats['records'], stats['bytes'] = stage_io.output_stats(stage.outputs)
+    return stats
+
+
+def run_serial(stages, measure=False):
+    '''
+    :return: dict of stage name to its stats, see run_concurrent.
+    '''
+    check(stages)
+    return {s.name: _timed(s, measure) for s in stages}
+
+
+def run_concurrent(stages, max_parallel, measure=False):
+    '''Run stages on max_parallel threads, each as soon as its deps are done.
+    The heavy lifting happens in the dask workers, so the threads mostly wait.
+
+    :param measure: also count the records and bytes of each stage's outputs.
+    :return: dict of stage name to a dict with the seconds it took, the seconds its
+    tasks waited for and spent reading their input, the bytes it stripped and the bytes
+    of notebooks it linked instead of dumping again if its outputs recorded them, and if
+    measured the records and bytes it wrote.
+    '''
+    check(stages)
+    pending = list(stages)
+    done = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while pending or running:
+            for s in [s for s in pending if all(d in done for d in s.deps)]:
+                if len(running) == max_parallel:
+                    break
+                pending.remove(s)
+                running[executor.submit(_timed, s, measure)] = s
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                s = running.pop(future)
+                # raises the stage's exception, the executor waits for running stages
+                done[s.name] = future.result()
+    return done
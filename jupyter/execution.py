@@ -0,0 +1,243 @@
+''' Where the dask computations of the pipeline stages run.
+
+All pipelines take the same flags, their defaults can be set with environment
+variables, e.g. JUICE_SCHEDULER=distributed JUICE_NUM_WORKERS=64:
+
+    -scheduler processes      a pool of -num_workers processes shared by all stages
+    -scheduler threads        -num_workers threads, the nltk/tokenize work holds the GIL
+    -scheduler sync           everything in the main thread, for profiling and pdb
+    -scheduler distributed    a dask.distributed LocalCluster with -num_workers workers
+
+Without a scheduler dask's defaults are kept: processes for bags and threads for
+dataframes.
+
+The workers load the NLP models (see jupyter.nlp_models) when they start, and the
+time this saved over fresh processes for every compute is logged at the end.
+
+-memory_limit (or JUICE_MEMORY_LIMIT) bounds the memory of the whole run. Stage inputs
+are then read in partitions small enough for each worker's share, merges and
+group-bys shuffle through -spill_dir on disk, dedup_get_solution groups bucket by
+bucket, and distributed workers spill to disk when they reach their share. The run
+gets slower instead of running out of memory.
+
+-intermediate_format columnar (or JUICE_INTERMEDIATE_FORMAT) writes the intermediate
+stage dirs in the columnar format of jupyter.columnar instead of jsonl, see stage_io.
+-compression gzip, zstd or lz4 (or JUICE_COMPRESSION) compresses them, see
+jupyter.compression.
+
+-read_ahead (or JUICE_READ_AHEAD) is how many chunks of their input the partitions read
+ahead on a thread, see jupyter.reader. 0 reads only when the stage needs the records.
+
+The stages show their progress with the ProgressBar of this module. Under one of these
+schedulers it only counts the tasks of the stage that entered it, so the stages run_all
+runs at the same time each get their own bar.
+'''
+
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import dask
+import dask.local
+import dask.multiprocessing
+import dask.threaded
+from dask import diagnostics
+from dask.utils import parse_bytes
+
+from jupyter import nlp_models
+from jupyter import reader
+from jupyter import stage_io
+from jupyter.compression import CODECS, check_installed
+
+logger = logging.getLogger(__name__)
+
+SCHEDULERS = ['processes', 'threads', 'sync', 'distributed']
+
+# records take several times their json size as python objects and a merge holds
+# both sides, so partitions are kept well below a worker's share of the memory
+MEMORY_PER_INPUT_BYTE = 20
+
+
+def add_arguments(parser, default_scheduler=None):
+    parser.add_argument('-scheduler', choices=SCHEDULERS,
+                        default=os.environ.get('JUICE_SCHEDULER', default_scheduler),
+                        help='dask scheduler for all stages, defaults to $JUICE_SCHEDULER')
+    parser.add_argument('-num_workers', type=int,
+                        default=int(os.environ.get('JUICE_NUM_WORKERS', multiprocessing.cpu_count())),
+                        help='workers of the scheduler, defaults to $JUICE_NUM_WORKERS or the number of cpus')
+    parser.add_argument('-memory_limit', default=os.environ.get('JUICE_MEMORY_LIMIT'),
+                        help='memory of the whole run, e.g. 16GB. defaults to $JUICE_MEMORY_LIMIT')
+    parser.add_argument('-spill_dir', default=os.environ.get('JUICE_SPILL_DIR'),
+                        help='local dir for data spilled under -memory_limit, defaults to $JUICE_SPILL_DIR '
+                             'or the temp dir')
+    parser.add_argument('-intermediate_format', choices=stage_io.FORMATS,
+                        default=os.environ.get('JUICE_INTERMEDIATE_FORMAT', 'jsonl'),
+                        help='format of the intermediate stage dirs, defaults to $JUICE_INTERMEDIATE_FORMAT '
+                             'or jsonl. the datasets are always jsonl')
+    parser.add_argument('-compression', choices=CODECS,
+                        default=os.environ.get('JUICE_COMPRESSION', 'none'),
+                        help='codec of the intermediate stage dirs, defaults to $JUICE_COMPRESSION or none. '
+                             'zstd and lz4 need the zstandard and lz4 packages')
+    parser.add_argument('-read_ahead', type=int,
+                        default=int(os.environ.get('JUICE_READ_AHEAD', reader.READ_AHEAD)),
+                        help=f'chunks of {reader.CHUNK_LINES} records each partition reads ahead of the stage, '
+                             f'defaults to $JUICE_READ_AHEAD or {reader.READ_AHEAD}. 0 to not read ahead')
+
+
+# the ProgressBar of the stage running on this thread
+_stage = threading.local()
+
+
+class ProgressBar(diagnostics.ProgressBar):
+    '''dask's ProgressBar, for the computes of the stage that enters it.
+
+    dask's registers a global callback, so every compute running while it's entered
+    moves its bar, and each compute takes the global callbacks away from the computes
+    starting while it runs. Under a scheduler of this module the bar is only handed to
+    the computes started on the thread that entered it.
+    '''
+
+    def __enter__(self):
+        self._per_stage = dask.config.get('juice.stage_progress', False)
+        if not self._per_stage:
+            return super().__enter__()
+        self._outer = getattr(_stage, 'progress', None)
+        _stage.progress = self
+        return self
+
+    def __exit__(self, *args):
+        if not self._per_stage:
+            return super().__exit__(*args)
+        _stage.progress = self._outer
+
+
+def _with_progress(get):
+    '''get, showing the computes of a stage on its ProgressBar.'''
+    def get_with_progress(*args, **kwargs):
+        progress = getattr(_stage, 'progress', None)
+        if progress is not None:
+            # the scheduler then leaves the global callbacks alone
+            kwargs.setdefault('callbacks', [progress._callback])
+        return get(*args, **kwargs)
+    return get_with_progress
+
+
+def memory_limit():
+    '''Bytes the run may use, None if there is no limit.'''
+    return dask.config.get('juice.memory_limit', None)
+
+
+def spill_dir():
+    return dask.config.get('temporary_directory', None) or tempfile.gettempdir()
+
+
+def from_opts(opts):
+    return context(opts.scheduler, opts.num_workers, opts.memory_limit, opts.spill_dir, opts.intermediate_format,
+                   opts.compression, opts.read_ahead)
+
+
+@contextmanager
+def context(scheduler, num_workers, memory_limit=None, spill_dir=None, intermediate_format=None,
+            compression=None, read_ahead=None):
+    '''Run the computations started inside on the given scheduler, within memory_limit.'''
+    config = {}
+    if read_ahead is not None:
+        config['juice.read_ahead'] = read_ahead
+    if intermediate_format:
+        config['juice.intermediate_format'] = intermediate_format
+    if compression:
+        # fail before the first stage, not in the middle of the run
+        check_installed(compression)
+        config['juice.compression'] = compression
+    if not memory_limit:
+        with dask.config.set(config):
+            with _scheduler(scheduler, num_workers):
+                yield
+        return
+
+    limit = parse_bytes(memory_limit) if isinstance(memory_limit, str) else memory_limit
+    blocksize = max(2**20, min(stage_io.BLOCKSIZE, limit // (num_workers * MEMORY_PER_INPUT_BYTE)))
+    logger.info('Memory limited to %s, reading partitions of %s bytes, spilling to %s',
+                memory_limit, blocksize, spill_dir or tempfile.gettempdir())
+    config.update({'juice.memory_limit': limit,
+                   'juice.blocksize': blocksize,
+                   'temporary_directory': spill_dir,
+                   # the disk shuffle needs all workers on one filesystem, the distributed
+                   # workers spill on their own
+                   'shuffle': 'tasks' if scheduler == 'distributed' else 'disk'})
+    with dask.config.set(config):
+        with _scheduler(scheduler, num_workers, limit, spill_dir):
+            yield
+
+
+def _init_worker(warmup_times):
+    dask.multiprocessing.initialize_worker_process()
+    warmup_times.put(nlp_models.warm_up())
+
+
+def _drain(q):
+    items = []
+    while True:
+        try:
+            items.append(q.get(timeout=1))
+        except queue.Empty:
+            return items
+
+
+@contextmanager
+def _scheduler(scheduler, num_workers, memory_limit=None, spill_dir=None):
+    if scheduler is None:
+        yield
+        return
+
+    logger.info('Running on the %s scheduler with %s workers', scheduler, num_workers)
+    if scheduler == 'processes':
+        # one pool for all computations instead of dask starting one per compute, so
+        # concurrent stages don't oversubscribe the machine
+        warmup_times = multiprocessing.Queue()
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(warmup_times,))
+        computes = []
+
+        def get(*args, **kwargs):
+            # dask's own get starts a new pool for every compute
+            computes.append(1)
+            return dask.multiprocessing.get(*args, pool=pool, **kwargs)
+
+        try:
+            with dask.config.set({'scheduler': _with_progress(get), 'juice.stage_progress': True}):
+                yield
+        finally:
+            pool.close()
+            pool.join()
+            nlp_models.log_saved(_drain(warmup_times), len(computes))
+    elif scheduler == 'threads':
+        nlp_models.log_saved([nlp_models.warm_up()])
+        with dask.config.set({'scheduler': _with_progress(dask.threaded.get), 'num_workers': num_workers,
+                              'juice.stage_progress': True}):
+            yield
+    elif scheduler == 'sync':
+        nlp_models.log_saved([nlp_models.warm_up()])
+        with dask.config.set({'scheduler': _with_progress(dask.local.get_sync), 'juice.stage_progress': True}):
+            yield
+    elif scheduler == 'distributed':
+        # only needed for this scheduler
+        from dask.distributed import Client, LocalCluster
+        worker_kwargs = {}
+        if memory_limit:
+            worker_kwargs['memory_limit'] = memory_limit // num_workers
+        if spill_dir:
+            worker_kwargs['local_dir'] = spill_dir
+        with LocalCluster(n_workers=num_workers, threads_per_worker=1, **worker_kwargs) as cluster, \
+                Client(cluster) as client:
+            logger.info('Dashboard at %s', client.dashboard_link)
+            # workers started later by the cluster warm up too
+            client.register_worker_callbacks(nlp_models.warm_up)
+            nlp_models.log_saved(list(client.run(nlp_models.warm_up).values()))
+            # the client sets itself as the default scheduler
+            yield
+    else:
+        raise ValueError(f'unknown scheduler {scheduler}')
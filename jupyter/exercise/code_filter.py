@@ -3,15 +3,16 @@
 
 import ast
 import logging
-import json
 import random
 import shutil
 from pathlib import Path
 
-import dask.bag as db
-from dask.diagnostics import ProgressBar
 from dotmap import DotMap
 
+from jupyter import predicates
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
 from jupyter.nbgrader.checksum_util import compute_checksum
 from jupyter.preprocess.tokenize_utils import tokenize_and_templatize, gen_api_seq
 
@@ -74,24 +75,27 @@ def temp(c):
         raise ValueError
     return c
 
+def parseable_predicates(code_key):
+    return [predicates.Predicate('parses', lambda cell: cell and does_parse(cell[code_key]))]
+
+
 def filter_parseable_code_cells(cells_indir, cells_outdir, code_key='source'):
     shutil.rmtree(cells_outdir, ignore_errors=True)
     Path(cells_outdir).mkdir(exist_ok=True)
 
-    logger.info('num cells before filtering parseable %s', db.read_text(cells_indir+'/*.jsonl').count().compute())
-
     with ProgressBar(minimum=15):
-        (db.read_text(cells_indir+'/*.jsonl', blocksize='180mib').map(json.loads)
+        cells = stage_io.read_records(cells_indir, blocksize='180mib')
+        counts = stage_io.write_textfiles(cells
     # .map(temp)
      # .filter(lambda cell: is_code(cell))
 
     # todo add these in later
     #  .map(lambda cell: remove_magic_inline(cell, code_key))
     #  .map(lambda cell: rajas_print_fix(cell, code_key))
-     .filter(lambda cell: cell and does_parse(cell[code_key]))
-     .map(json.dumps).to_textfiles(cells_outdir+'/*.jsonl'))
+     .filter(lambda cell: cell and does_parse(cell[code_key])), cells_outdir, source=cells)
 
-    logger.info('num cells after filtering parseable %s', db.read_text(cells_outdir+'/*.jsonl').count().compute())
+    logger.info('num cells before filtering parseable %s', counts['in'])
+    logger.info('num cells after filtering parseable %s', counts['out'])
     # exit('yo')
 
 def grading_type(cell):
@@ -140,23 +144,44 @@ def logic_type(cell, max_api_seq_len, min_api_seq_len, key):
         return 'pure logic'
 
 
-def one_func_max_api_seq(cells_indir, cells_outdir, max_api_seq_len, min_api_seq_len, code_key):
-    # assert '/scratch/jupyter-pipeline' in cells_outdir or cells_outdir.startswith('/tmp')
-    shutil.rmtree(cells_outdir, ignore_errors=True)
-    Path(cells_outdir).mkdir(exist_ok=True)
-
+def logic_type_predicates(max_api_seq_len, min_api_seq_len, code_key):
+    def kept_logic_type(cell):
+        return logic_type(cell, max_api_seq_len, min_api_seq_len, code_key) in ['1 function', 'pure logic', 'boilerplate']
+    # records that are None are only dropped by parses
+    return [predicates.Predicate('kept_logic_type', kept_logic_type, after=('parses',))]
 
-    bag=db.read_text(cells_indir +'/*.jsonl').map(json.loads)
-    kernel_type = \
-        bag.map(lambda cell: logic_type(cell, max_api_seq_len, min_api_seq_len, code_key)) \
-            .frequencies() \
-            .topk(k=50, key=lambda tup: tup[1])
 
-    logger.info('Counts of function/class type %s', kernel_type.compute())
+def one_func_max_api_seq(cells_indir, cells_outdir, max_api_seq_len, min_api_seq_len, code_key):
+    '''Filter cells with more than 1 function or long api sequence.'''
+    run_key = stage_cache.stage_key(one_func_max_api_seq, [cells_indir],
+                                    dict(max_api_seq_len=max_api_seq_len, min_api_seq_len=min_api_seq_len,
+                                         code_key=code_key))
 
     with ProgressBar(minimum=15):
-        db.read_text(cells_indir +'/*.jsonl').map(json.loads) \
-        .filter(lambda cell: logic_type(cell, max_api_seq_len, min_api_seq_len, code_key) in ['1 function', 'pure logic', 'boilerplate']) \
-        .map(json.dumps).to_textfiles(cells_outdir+'/*.jsonl')
+        # the counts are taken while filtering, so each cell is tokenized once. A shard
+        # per input shard like before, dedup groups them by partition
+        counts = stage_io.write_records(stage_io.read_shards(cells_indir), cells_outdir, run_key, shard_bytes=None,
+                                        category=lambda cell: logic_type(cell, max_api_seq_len, min_api_seq_len,
+                                                                         code_key),
+                                        kept=['1 function', 'pure logic', 'boilerplate'])
+
+    logger.info('Counts of function/class type %s', counts['categories'].most_common(50))
+
 
+def filter_code_cells(cells_indir, cells_outdir, max_api_seq_len, min_api_seq_len, code_key):
+    '''filter_parseable_code_cells and one_func_max_api_seq in one pass, without writing
+    the parseable cells.'''
+    shutil.rmtree(cells_outdir, ignore_errors=True)
+    Path(cells_outdir).mkdir(exist_ok=True)
 
+    with ProgressBar(minimum=15):
+        cells = stage_io.read_records(cells_indir, blocksize='180mib')
+        counts = stage_io.write_textfiles(
+            predicates.apply_filters('filter_code_cells',
+                                     parseable_predicates(code_key)
+                                     + logic_type_predicates(max_api_seq_len, min_api_seq_len, code_key),
+                                     cells),
+            cells_outdir, source=cells)
+
+    logger.info('num cells before filtering %s', counts['in'])
+    logger.info('num cells after filtering %s', counts['out'])
@@ -1,12 +1,10 @@
 import copy
-import json
 import logging
 from collections import Counter
 
-import dask.bag as db
-from dask.diagnostics import ProgressBar
-
 from jupyter import jdumpl
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import is_markdown
 from jupyter.new_pipeline.to_dataset import replace_newlines_indents
 from jupyter.preprocess.tokenize_utils import tokenize_and_templatize
@@ -85,7 +83,7 @@ def add_keys(c):
 def main(cell_indir, dataset_outfile, max_tokens):
     logger.info('')
     with ProgressBar(minimum=15):
-        cell_df = db.read_text(cell_indir +'/*.jsonl').map(json.loads).map(add_keys).to_dataframe()
+        cell_df = stage_io.read_shards(cell_indir).map(add_keys).to_dataframe()
 
         dataset = cell_df.groupby('groupbykey').apply((lambda group: get_solution_new(group)),
                                                       meta=object).compute()
@@ -3,16 +3,14 @@ usage:
 
 '''
 
-import json
 import logging
 from os.path import basename, dirname, join, abspath
 from pathlib import Path
 
-import dask.bag as db
-from dask.diagnostics import ProgressBar
-from datasketch import MinHash, MinHashLSH
-
-from jupyter import jdumpl
+from jupyter import codec
+from jupyter import stage_io
+from jupyter import viz_store
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import is_code, get_url
 from jupyter.new_pipeline.to_dataset import compute_dataset_record_helper
 
@@ -20,12 +18,14 @@ logger = logging.getLogger(__name__)
 
 
 def compute_minhash(lst):
+    from datasketch import MinHash
     m1 = MinHash(num_perm=128)
     for d in set(lst):
         m1.update(d.encode('utf8'))
     return m1
 
 def create_minhashlsh(minhashes):
+    from datasketch import MinHashLSH
     lsh = MinHashLSH(threshold=0.5, num_perm=128)
     for i, hashe in enumerate(minhashes):
         lsh.insert(i, hashe)
@@ -55,9 +55,8 @@ def dump_nb(outdir, row, cell_index):
     filepath = join(filedir, filebase)
 
     Path(filedir).mkdir(exist_ok=True, parents=True)
-    with open(filepath, 'w') as outfile:
-        outfile.write(row.contents.strip())
-        return filepath
+    # the same notebook for each of its cells, stored once
+    return viz_store.write(outdir, filepath, row.contents.strip())
 
 def compute_problem_cells(row_sol, row_sub, nb_vizdir, context_len):
     ''' We compare each cell between exercise and solution notebook
@@ -65,8 +64,8 @@ def compute_problem_cells(row_sol, row_sub, nb_vizdir, context_len):
     cells = []
 
     # load em both, see if same num cells, try to diff.
-    nb_sol = json.loads(row_sol.contents)
-    nb_sub = json.loads(row_sub.contents)
+    nb_sol = codec.loads(row_sol.contents)
+    nb_sub = codec.loads(row_sub.contents)
     # we require solution and submission to have same number of cells so we
     # can identify problem cells automatically.
     if len(nb_sol['cells']) != len(nb_sub['cells']):
@@ -97,14 +96,14 @@ def compute_problem_cells(row_sol, row_sub, nb_vizdir, context_len):
     return cells
 
 def load_nb(group, i):
-    return json.loads(group.iloc[i].contents)
+    return codec.loads(group.iloc[i].contents)
 def get_solution_cells(group, nb_vizdir, context_len):
     '''Hash each notebook within repo to find notebooks with 50% of cells overlapping.
     '''
     cells = []
 
     # dump all nbs into lsh
-    hashes = [get_nb_minhash(json.loads(row.contents)) for _, row in group.iterrows()]
+    hashes = [get_nb_minhash(codec.loads(row.contents)) for _, row in group.iterrows()]
     lsh = create_minhashlsh(hashes)
 
     solution_paths = set()
@@ -131,12 +130,11 @@ def extract(indir, outdir, nb_vizdir, context_len):
     '''Get all dataset records from solution cells.'''
     logger.info('')
     def nb_to_rec_format(nb):
-        return {'contents': json.dumps(nb),
+        return {'contents': codec.dumps(nb),
                 'repo': nb['metadata']['repo'],
                 'path': nb['metadata']['path']}
 
-    nbs = (db.read_text(indir+'/*.jsonl', blocksize='120mib').
-           map(json.loads).
+    nbs = (stage_io.read_records(indir, blocksize='120mib').
            # for compatibility with extraction code above change back to rec format, so
            # we can group by repo
            map(nb_to_rec_format)
@@ -152,6 +150,7 @@ def extract(indir, outdir, nb_vizdir, context_len):
     nb_cells = nb_cells.tolist()
     cells = [c for n in nb_cells for c in n if n and c]
     logger.info('num extracted solution cells %s', len(cells))
-    jdumpl(cells, outdir + '/cells.jsonl')
+    stage_io.write_shard(cells, outdir, stage_io.shard_name(0, 1), stage_io.intermediate_format(),
+                         stage_io.intermediate_compression())
 
 
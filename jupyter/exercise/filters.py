@@ -1,14 +1,15 @@
-import json
 import logging
 import shutil
 from pathlib import Path
 
-import dask.bag as db
-from polyglot.detect import Detector
-
+from jupyter import codec
+from jupyter import nb_scan
+from jupyter import nlp_models
+from jupyter import predicates
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import is_markdown
 
-from dask.diagnostics import ProgressBar
 logger = logging.getLogger(__name__)
 
 def log_delete_indir(func):
@@ -21,7 +22,7 @@ def log_delete_indir(func):
     return wrapper
 
 def count_num_recs_total(indir):
-    return db.read_text(indir+'/*.jsonl').count().compute()
+    return stage_io.count_records(indir)
 
 
 def get_kernel_name(nb):
@@ -35,6 +36,16 @@ def get_kernel_name(nb):
     else:
         return 'no kernel specified'
 
+def is_python(nb):
+    return get_kernel_name(nb) in ['python', 'python2']
+
+
+def is_python_text(nb_text):
+    '''is_python of the notebook json text, from its metadata alone. None if nb_scan
+    can't find the metadata.'''
+    return nb_scan.metadata_keeps(is_python, nb_text)
+
+
 def filter_for_python(nbs_indir, nbs_outdir):
     # assert '/scratch/nbgrader-pipeline/dask-gen' in nbs_outdir
     assert '/tmp' in nbs_outdir
@@ -50,39 +61,37 @@ def filter_for_python(nbs_indir, nbs_outdir):
     # pprint(kernel_type.compute())
 
     with ProgressBar(15):
-        db.read_text(nbs_indir +'/*.jsonl').map(json.loads) \
-        .filter(lambda nb: get_kernel_name(nb) in ['python', 'python2']) \
-        .map(json.dumps).to_textfiles(nbs_outdir+'/*.jsonl')
+        if stage_io.dir_format(nbs_indir) == 'jsonl':
+            # only the notebooks whose kernel isn't known to be another language are parsed
+            lines = stage_io.read_lines(nbs_indir)
+            python = predicates.Predicate('is_python', is_python, raw=is_python_text)
+            nbs = predicates.pushdown('filter_for_python', [python], lines, codec.loads)
+            counts = stage_io.write_textfiles(nbs, nbs_outdir, source=lines)
+        else:
+            nbs = stage_io.read_shards(nbs_indir)
+            counts = stage_io.write_textfiles(nbs.filter(is_python), nbs_outdir, source=nbs)
 
-    logger.info('num after python filter %s', count_num_recs_total(nbs_outdir))
+    logger.info('num after python filter %s', counts['out'])
 
     # assert '/scratch/jupyter-pipeline' in nbs_indir
     # shutil.rmtree(nbs_indir, ignore_errors=True)
 
 def get_markdown_language(nb):
-    def get_language(string):
-        logging.getLogger("polyglot").setLevel(logging.CRITICAL)
-        try:
-            d = Detector(string, quiet=True)
-            if d.reliable:
-                return d.language.name
-            else:
-                return d.languages[0].name
-        except:
-            # detector breaks on weird ascii chars, seems like
-            # they come from english
-            return 'failed'
-
     nl = ""
     for cell in nb['cells']:
         if is_markdown(cell) and 'source' in cell and cell['source']:
             nl += cell['source'] + ' '
-    lang = get_language(nl)
+    lang = nlp_models.detect_language(nl)
     # if lang == 'Italian':
     #     print('==========\n', nl)
     #     pass
     return lang
 
+def is_english(nb):
+    # un language means no nl, for these likely its all in the comments
+    return get_markdown_language(nb) in ['English', 'un']
+
+
 def filter_for_english(nbs_indir, nbs_outdir):
     # assert '/scratch/nbgrader-pipeline/dask-gen' in nbs_outdir
     assert '/tmp' in nbs_outdir
@@ -99,11 +108,9 @@ def filter_for_english(nbs_indir, nbs_outdir):
 
     # todo deal with un! aka get the comments
     with ProgressBar(15):
-        (db.read_text(nbs_indir +'/*.jsonl').map(json.loads)
-     # un language means no nl, for these likely its all in the comments
-     .filter(lambda nb: get_markdown_language(nb) in ['English', 'un'])
-     .map(json.dumps).to_textfiles(nbs_outdir+'/*.jsonl'))
-    logger.info('num after english filter %s', count_num_recs_total(nbs_outdir))
+        nbs = stage_io.read_shards(nbs_indir)
+        counts = stage_io.write_textfiles(nbs.filter(is_english), nbs_outdir, source=nbs)
+    logger.info('num after english filter %s', counts['out'])
 
 
     # assert '/scratch/jupyter-pipeline' in nbs_indir
@@ -1,102 +1,191 @@
 '''Generates dataset from exercise notebooks.
 '''
 import argparse
-import json
 import logging
 import shutil
 import tempfile
+from functools import partial
 from pathlib import Path
 
-import dask.bag as db
-
+from jupyter import codec
+from jupyter import execution
+from jupyter import predicates
+from jupyter import sampling
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter.dag import Stage, run_serial
 from jupyter.exercise import code_filter
 from jupyter.exercise import dedup
 from jupyter.exercise import extraction
 from jupyter.exercise import filters
 from jupyter.nbgrader.split import split_simple
 
-format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
-logging.basicConfig(
-    level=logging.INFO,
-    datefmt='%I:%M:%S %p',
-    format=format,
-    handlers=[
-        logging.FileHandler("exercise.log", mode='w'),
-        logging.StreamHandler()
-    ])
 logger = logging.getLogger(__name__)
 
 
-parser = argparse.ArgumentParser(description='')
-parser.add_argument('-input_nbs_dir', required=True)
-parser.add_argument("-pipeline_dir", required=True)
-args = parser.parse_args()
+def update_notebook_metadata(rec, nb_index=None):
+    nb = codec.loads(rec['contents'])
+    nb['metadata']['repo'] = rec['repo']
+    nb['metadata']['path'] = rec['path']
+    nb['metadata']['nb_index'] = nb_index
+    # nb['metadata']['local_path'] = abspath(join(outdir, f'{nb_index}.ipynb'))
+    nb['metadata']['celltoolbar'] = 'Create Assignment'
+    return nb
 
-Path(args.pipeline_dir).mkdir(parents=True, exist_ok=True)
-raw_dump = f'{args.pipeline_dir}/raw-dump'
-dataset_dir = f'{args.pipeline_dir}/dataset'
-nb_vizdir = f'{args.pipeline_dir}/nbviz'
-extracted_dir = f'{args.pipeline_dir}/extracted'
-parseable_dir = f'{args.pipeline_dir}/parseable'
-onefuncmax_dir = f'{args.pipeline_dir}/onefuncmax'
 
-dev_file = f'{dataset_dir}/dev.jsonl'
-test_file = f'{dataset_dir}/test.jsonl'
+def read_recs(indir):
+    '''The non nbgrader records, their notebooks still json text.'''
+    return (stage_io.read_lines(indir).
+            filter(lambda rec_string: 'nbgrader' not in rec_string).
+            map(codec.loads))
 
-def beginning_logic(input_nbs_dir):
-    Path(dataset_dir).mkdir(exist_ok=True)
-    shutil.rmtree(nb_vizdir, ignore_errors=True)
-    shutil.rmtree(extracted_dir, ignore_errors=True)
-    Path(extracted_dir).mkdir(exist_ok=True)
-    Path(nb_vizdir).mkdir()
 
-    def recs_to_nb(indir, outdir):
-        '''Add necessary metadata and filter nbgrader nbs'''
-        def update_notebook_metadata(line, nb_index=None):
-            rec = json.loads(line)
-            nb = json.loads(rec['contents'])
-            nb['metadata']['repo'] = rec['repo']
-            nb['metadata']['path'] = rec['path']
-            nb['metadata']['nb_index'] = nb_index
-            # nb['metadata']['local_path'] = abspath(join(outdir, f'{nb_index}.ipynb'))
-            nb['metadata']['celltoolbar'] = 'Create Assignment'
-            return nb
+def read_nbs(indir):
+    '''The non nbgrader notebooks of the records with the necessary metadata.'''
+    return (read_recs(indir).
+            map(update_notebook_metadata).
+            # when we use full dataset there is invalid json nb
+            filter(lambda nb: nb is not None))
 
-        (db.read_text(indir+'/*.jsonl').
-             filter(lambda rec_string: 'nbgrader' not in rec_string).
-             map(update_notebook_metadata).
-             # when we use full dataset there is invalid json nb
-             filter(lambda nb: nb is not None).
-             map(json.dumps).to_textfiles(outdir+'/*.jsonl'))
 
+def recs_to_nb(indir, outdir):
+    '''Add necessary metadata and filter nbgrader nbs'''
+    counts = stage_io.write_textfiles(read_nbs(indir), outdir, source=stage_io.read_lines(indir))
 
-        logger.info('num nbs to start %s', db.read_text(indir+'/*.jsonl').count().compute())
+    logger.info('num nbs to start %s', counts['in'])
 
-    out = tempfile.mkdtemp(suffix='extract')
-    recs_to_nb(input_nbs_dir, out)
 
-    out3 = tempfile.mkdtemp(suffix='extract')
-    filters.filter_for_python(out, out3)
-    shutil.rmtree(out)
+def rec_is_python(rec):
+    return filters.is_python_text(rec['contents'])
 
-    out2 = tempfile.mkdtemp(suffix='extract')
-    filters.filter_for_english(out3, out2)
-    shutil.rmtree(out3)
-    return out2
 
-logger.info('start')
-out2 = beginning_logic(args.input_nbs_dir)
-extraction.extract(indir=out2, outdir=extracted_dir, nb_vizdir=nb_vizdir, context_len=11111)
-shutil.rmtree(out2)
+def recs_to_filtered_nbs(indir, outdir):
+    '''recs_to_nb, filter_for_python and filter_for_english in one pass. Only the
+    notebooks whose kernel isn't known to be another language are parsed.'''
+    nb_predicates = [predicates.Predicate('is_python', filters.is_python, raw=rec_is_python),
+                     predicates.Predicate('is_english', filters.is_english)]
+    nbs = predicates.pushdown('recs_to_filtered_nbs', nb_predicates, read_recs(indir), update_notebook_metadata)
+    counts = stage_io.write_textfiles(nbs, outdir, source=stage_io.read_lines(indir))
+
+    logger.info('num nbs to start %s', counts['in'])
+    logger.info('num nbs after python and english filters %s', counts['out'])
 
-code_filter.filter_parseable_code_cells(extracted_dir, parseable_dir, code_key='code')
 
-code_filter.one_func_max_api_seq(parseable_dir, onefuncmax_dir, max_api_seq_len=15, min_api_seq_len=0, code_key='code')
+def then_delete(func, indir, *args, **kwargs):
+    '''Run a stage, then delete its temporary input dir.'''
+    func(indir, *args, **kwargs)
+    shutil.rmtree(indir)
 
 
-dedup_nl_boilerextract_dataset =  dataset_dir+'/nldedup_boilerplateextract.jsonl'
-dedup.main(onefuncmax_dir, dedup_nl_boilerextract_dataset, max_tokens=120)#, key='code_tokens', key2='nl')
+def notebook_stages(opts):
+    '''The stages that handle each notebook on its own, they can run on any subset of
+    the input. Returns them with the dir the last one writes.'''
+    Path(opts.pipeline_dir).mkdir(parents=True, exist_ok=True)
+    nb_vizdir = f'{opts.pipeline_dir}/nbviz'
+    extracted_dir = f'{opts.pipeline_dir}/extracted'
+    parseable_dir = f'{opts.pipeline_dir}/parseable'
+    onefuncmax_dir = f'{opts.pipeline_dir}/onefuncmax'
 
-split_simple(dedup_nl_boilerextract_dataset, dev_file=dev_file, test_file=test_file,
-             test_size=.55)
+    shutil.rmtree(nb_vizdir, ignore_errors=True)
+    shutil.rmtree(extracted_dir, ignore_errors=True)
+    Path(extracted_dir).mkdir(exist_ok=True)
+    Path(nb_vizdir).mkdir()
+
+    # the notebook filters only write under /tmp
+    out = tempfile.mkdtemp(suffix='extract')
+    out3 = tempfile.mkdtemp(suffix='extract')
+    out2 = tempfile.mkdtemp(suffix='extract')
 
+    lst = []
+    input_nbs_dir = opts.input_nbs_dir
+    if opts.sample > 0:
+        # exercise records only get an nb_index in recs_to_nb, so sample by repo and path
+        sample_dir = f'{opts.pipeline_dir}/nbs-sample'
+        lst.append(Stage('sample_nbs', partial(
+            stage_cache.run_stage, sampling.sample_nbs, inputs=[input_nbs_dir], outputs=[sample_dir],
+            nbs_dir=input_nbs_dir, outdir=sample_dir, fraction=opts.sample, key='repo_path'),
+            deps=[], outputs=[sample_dir]))
+        input_nbs_dir = sample_dir
+
+    if not opts.debug_intermediates:
+        return lst + [
+            Stage('recs_to_filtered_nbs', partial(recs_to_filtered_nbs, input_nbs_dir, out2),
+                  deps=[s.name for s in lst], outputs=[out2]),
+            Stage('extract', partial(then_delete, extraction.extract, out2, outdir=extracted_dir,
+                                     nb_vizdir=nb_vizdir, context_len=11111),
+                  deps=['recs_to_filtered_nbs'], outputs=[extracted_dir, nb_vizdir]),
+            Stage('filter_code_cells', partial(code_filter.filter_code_cells, extracted_dir, onefuncmax_dir,
+                                               max_api_seq_len=15, min_api_seq_len=0, code_key='code'),
+                  deps=['extract'], outputs=[onefuncmax_dir]),
+        ], onefuncmax_dir
+
+    return lst + [
+        Stage('recs_to_nb', partial(recs_to_nb, input_nbs_dir, out), deps=[s.name for s in lst],
+              outputs=[out]),
+        Stage('filter_for_python', partial(then_delete, filters.filter_for_python, out, out3),
+              deps=['recs_to_nb'], outputs=[out3]),
+        Stage('filter_for_english', partial(then_delete, filters.filter_for_english, out3, out2),
+              deps=['filter_for_python'], outputs=[out2]),
+        Stage('extract', partial(then_delete, extraction.extract, out2, outdir=extracted_dir,
+                                 nb_vizdir=nb_vizdir, context_len=11111),
+              deps=['filter_for_english'], outputs=[extracted_dir, nb_vizdir]),
+        Stage('filter_parseable_code_cells', partial(code_filter.filter_parseable_code_cells,
+                                                     extracted_dir, parseable_dir, code_key='code'),
+              deps=['extract'], outputs=[parseable_dir]),
+        Stage('one_func_max_api_seq', partial(code_filter.one_func_max_api_seq, parseable_dir, onefuncmax_dir,
+                                              max_api_seq_len=15, min_api_seq_len=0, code_key='code'),
+              deps=['filter_parseable_code_cells'], outputs=[onefuncmax_dir]),
+    ], onefuncmax_dir
+
+
+def global_stages(opts, onefuncmax_dir, deps):
+    '''The stages that need all records at once, starting after the stages in deps.'''
+    dataset_dir = f'{opts.pipeline_dir}/dataset'
+    dev_file = f'{dataset_dir}/dev.jsonl'
+    test_file = f'{dataset_dir}/test.jsonl'
+    Path(dataset_dir).mkdir(parents=True, exist_ok=True)
+
+    dedup_nl_boilerextract_dataset =  dataset_dir+'/nldedup_boilerplateextract.jsonl'
+
+    return [
+        Stage('dedup', partial(dedup.main, onefuncmax_dir, dedup_nl_boilerextract_dataset, max_tokens=120),#, key='code_tokens', key2='nl')
+              deps=deps, outputs=[dedup_nl_boilerextract_dataset]),
+        Stage('split', partial(split_simple, dedup_nl_boilerextract_dataset, dev_file=dev_file,
+                               test_file=test_file, test_size=.55),
+              deps=['dedup'], outputs=[dev_file, test_file]),
+    ]
+
+
+def stages(opts):
+    lst, onefuncmax_dir = notebook_stages(opts)
+    return lst + global_stages(opts, onefuncmax_dir, deps=[lst[-1].name])
+
+
+def run_pipeline(opts):
+    logger.info('start')
+    run_serial(stages(opts))
+
+
+if __name__ == '__main__':
+    format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format=format,
+        handlers=[
+            logging.FileHandler("exercise.log", mode='w'),
+            logging.StreamHandler()
+        ])
+
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-input_nbs_dir', required=True)
+    parser.add_argument("-pipeline_dir", required=True)
+    parser.add_argument('-sample', type=float, default=-1,
+                        help='only process this fraction of the records, picked by repo and path')
+    parser.add_argument('-debug_intermediates', action='store_true',
+                        help='write the output of every filter instead of filtering in one pass')
+    execution.add_arguments(parser)
+    opts = parser.parse_args()
+
+    with execution.from_opts(opts):
+        run_pipeline(opts)
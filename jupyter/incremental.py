@@ -0,0 +1,248 @@
+''' Delta mode: only notebooks not seen by an earlier run go through the pipeline.
+
+Notebooks are identified by the md5 of their line in the input jsonl. Each run that
+finds new notebooks writes them to a new batch under the state dir and runs the
+shared pipeline on just that batch, so the per notebook stage outputs of earlier
+runs are kept in their batch dirs. Notebooks that disappeared from (or changed in)
+the input are dropped from the state. The dedup state of the train pipeline
+(split.dedup_dump) and the grouping of the nbgrader pipeline
+(dedup_get_solution.groupem) are updated from the added and removed records only.
+
+state dir layout:
+    index.json          nb hash -> [batch, nb_index]
+    batches/{batch}/    nbs/ with the batch's notebooks and the shared pipeline dirs
+    dedup.json          train dedup state
+    groups.json         nbgrader groups and their results
+'''
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from os.path import exists, join
+from pathlib import Path
+
+import dask.bag as db
+
+from jupyter import codec
+from jupyter import jsoniter
+from jupyter import stage_io
+from jupyter.nbgrader import dedup_get_solution
+from jupyter.new_pipeline import filter
+from jupyter.new_pipeline import shared_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+def nb_hash(line):
+    return hashlib.md5(line.rstrip('\n').encode('utf8')).hexdigest()
+
+
+def _load(path, default):
+    if not exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save(obj, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(path + '.tmp', path)
+
+
+def iter_batch_records(state_dir, batch, index, stage_dir='cells6-dataset'):
+    '''Yield (rec_id, nb_hash, record) for a batch's stage output. Record ids sort in
+    the order the records were ingested.'''
+    nb_index2hash = {nb_index: h for h, (b, nb_index) in index.items() if b == batch}
+    for shard_i, path in enumerate(stage_io.shard_paths(join(state_dir, 'batches', batch, stage_dir))):
+        for line_i, js in enumerate(jsoniter(path)):
+            h = nb_index2hash.get(js['metadata']['nb_index'])
+            if h:
+                yield f'{batch}:{shard_i:06d}:{line_i:09d}', h, js
+
+
+def ingest(input_nbs_dir, state_dir, **shared_kwargs):
+    '''Run the shared pipeline on the notebooks that are new since the last run.
+
+    :return: the new batch name (None if nothing is new) and the set of hashes of
+    notebooks that are not in the input anymore.
+    '''
+    Path(state_dir, 'batches').mkdir(parents=True, exist_ok=True)
+    index_path = join(state_dir, 'index.json')
+    index = _load(index_path, {})
+
+    current = set(stage_io.read_lines(input_nbs_dir).map(nb_hash).compute())
+    new = current - set(index)
+    removed = set(index) - current
+    logger.info('%s notebooks in input, %s new, %s removed since last run',
+                len(current), len(new), len(removed))
+
+    batch = None
+    if new:
+        batch = '%06d' % len(os.listdir(join(state_dir, 'batches')))
+        batch_dir = join(state_dir, 'batches', batch)
+        batch_nbs = join(batch_dir, 'nbs')
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        Path(batch_nbs).mkdir(parents=True)
+
+        (stage_io.read_lines(input_nbs_dir)
+         .filter(lambda line: nb_hash(line) in new)
+         .map(lambda line: line.rstrip('\n'))
+         .to_textfiles(batch_nbs+'/*.jsonl'))
+        nb_indices = (db.read_text(batch_nbs+'/*.jsonl')
+                      .map(lambda line: (nb_hash(line), codec.loads(line)['metadata']['nb_index']))
+                      .compute())
+
+        shared_pipeline.main(input_nbs_dir=batch_nbs, pipeline_outdir=batch_dir, **shared_kwargs)
+        for h, nb_index in nb_indices:
+            index[h] = [batch, nb_index]
+
+    for h in removed:
+        del index[h]
+    _save(index, index_path)
+    return batch, removed, index
+
+
+def _val(js, key):
+    '''Hash of the dedup value, None if the record can't be deduped on key.'''
+    if key not in js or not js[key]:
+        return None
+    return hashlib.md5(json.dumps(js[key]).encode('utf8')).hexdigest()
+
+
+def update_dedup(state_dir, batch, removed, index, deduped_code_dir, deduped_nl_dir):
+    '''Incremental version of deduping on code tokens and then on nl with split.dedup_dump.
+
+    Of all records with the same code, the one with the smallest record id is kept,
+    and of those with the same nl again the smallest id. Records of a new batch
+    have larger ids than all earlier ones, so adding a batch never changes which
+    records were kept before and the new ones are appended to the outputs. Only
+    removing notebooks requires the outputs to be rewritten.
+    '''
+    state_path = join(state_dir, 'dedup.json')
+    state = _load(state_path, {'recs': {}, 'code': {}, 'nl': {}})
+    # rec id -> [nb hash, code val, nl val]
+    recs = state['recs']
+    # code val -> ids of records with that code, the winner first
+    code = state['code']
+    # nl val -> ids of code winners with that nl, the winner first
+    nl = state['nl']
+
+    def promote(rec_id):
+        nl_val = recs[rec_id][2]
+        if nl_val:
+            nl.setdefault(nl_val, []).append(rec_id)
+            nl[nl_val].sort()
+
+    def demote(rec_id):
+        nl_val = recs[rec_id][2]
+        if nl_val:
+            nl[nl_val].remove(rec_id)
+            if not nl[nl_val]:
+                del nl[nl_val]
+
+    # drop records of removed notebooks, promoting the next record with the same code
+    removed_ids = [rec_id for rec_id, (h, _, _) in recs.items() if h in removed]
+    for rec_id in sorted(removed_ids):
+        code_val = recs[rec_id][1]
+        holders = code[code_val]
+        if holders[0] == rec_id:
+            demote(rec_id)
+            holders.pop(0)
+            if holders:
+                promote(holders[0])
+        else:
+            holders.remove(rec_id)
+        if not holders:
+            del code[code_val]
+        del recs[rec_id]
+
+    if batch:
+        for rec_id, h, js in iter_batch_records(state_dir, batch, index):
+            code_val = _val(js, 'code_tokens')
+            if not code_val:
+                continue
+            recs[rec_id] = [h, code_val, _val(js, 'nl')]
+            if code_val in code:
+                code[code_val].append(rec_id)
+            else:
+                code[code_val] = [rec_id]
+                promote(rec_id)
+    _save(state, state_path)
+
+    code_winners = set(holders[0] for holders in code.values())
+    nl_winners = set(holders[0] for holders in nl.values())
+    logger.info('Num after deduping on code_tokens %s', len(code_winners))
+    logger.info('Num after deduping on nl %s', len(nl_winners))
+
+    code_file = join(deduped_code_dir, 'deduped_code_tokens.jsonl')
+    nl_file = join(deduped_nl_dir, 'deduped_nl.jsonl')
+    if removed_ids or not exists(code_file) or not exists(nl_file):
+        # rewrite from all stored batches, no stage has to be rerun for this
+        batches = sorted(set(b for b, _ in index.values()))
+        mode, todo = 'w', batches
+    else:
+        mode, todo = 'a', [batch] if batch else []
+
+    with open(code_file, mode) as code_out, open(nl_file, mode) as nl_out:
+        for b in todo:
+            for rec_id, _, js in iter_batch_records(state_dir, b, index):
+                if rec_id in code_winners:
+                    code_out.write(codec.dumps(js) + '\n')
+                if rec_id in nl_winners:
+                    nl_out.write(codec.dumps(js) + '\n')
+
+
+def update_groups(state_dir, batch, removed, index, dataset_outfile, max_tokens=120):
+    '''Incremental version of dedup_get_solution.main. Only groups that gained or lost
+    cells are recomputed, plus the groups that depend on the global boilerplate set
+    if it changed.'''
+    import pandas as pd
+    state_path = join(state_dir, 'groups.json')
+    state = _load(state_path, {'groups': {}, 'results': {}, 'boilers': []})
+    # groupbykey -> [nb hash, cell] of the cells in the group
+    groups = state['groups']
+    results = state['results']
+
+    touched = set()
+    for key, cells in groups.items():
+        kept = [(h, c) for h, c in cells if h not in removed]
+        if len(kept) != len(cells):
+            groups[key] = kept
+            touched.add(key)
+
+    if batch:
+        batch_dir = join(state_dir, 'batches', batch)
+        filter.filter_graded_code_cells(join(batch_dir, 'cells6-dataset'), join(batch_dir, 'cells7-autograded'))
+        for _, h, c in iter_batch_records(state_dir, batch, index, stage_dir='cells7-autograded'):
+            key = dedup_get_solution.add_keys(dict(c))['groupbykey']
+            groups.setdefault(key, []).append((h, c))
+            touched.add(key)
+
+    for key in [k for k, cells in groups.items() if not cells]:
+        del groups[key]
+        results.pop(key, None)
+        touched.discard(key)
+
+    boilers = sorted(set(c['code'] for cells in groups.values() for _, c in cells
+                         if c['metadata']['nbgrader']['is_boilerplate']))
+    if boilers != state['boilers']:
+        # groups without their own boilerplate look it up in the set of all boilerplates
+        touched.update(key for key, cells in groups.items()
+                       if not any(c['metadata']['nbgrader']['is_boilerplate'] for _, c in cells))
+        state['boilers'] = boilers
+    logger.info('Recomputing %s of %s groups', len(touched), len(groups))
+
+    boiler_set = set(boilers)
+    for key in touched:
+        # add_keys mutates the cell so the stored cells are copied
+        cells = [dedup_get_solution.add_keys(codec.loads(codec.dumps(c))) for _, c in groups[key]]
+        results[key] = dedup_get_solution.dedup_boiler_extract(pd.DataFrame(cells), boiler_set)
+    _save(state, state_path)
+
+    # groupby hands groups over sorted by key, keep that order for the split
+    dataset = [results[key] for key in sorted(results) if isinstance(results[key], dict)]
+    logger.info('len cells after filtering failed %s', len(dataset))
+    dedup_get_solution.finalize(dataset, dataset_outfile, max_tokens)
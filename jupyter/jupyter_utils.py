@@ -1,8 +1,10 @@
 import json
 from io import StringIO
 
-from nbformat import reads, write, read, writes
-from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
+from jupyter import codec
+
+# nbformat is imported by the functions that use it, the pipeline stages only need
+# the cell helpers
 
 def _cells(nb):
     """Yield all cells in an nbformat-insensitive manner"""
@@ -25,6 +27,7 @@ def dump_nb_string_to_file(nb_string, file):
     dump_nb_to_file(nb, file)
 
 def dump_nb_to_file(nb, file):
+    from nbformat import write
     try:
         write(nb, file, version=4)
     except:
@@ -39,19 +42,22 @@ def dump_nb_to_file_jsonlib(nb, file):
 # metadata we add later in the pipeline. thus better to avoid
 # this library
 def dump_nb_to_string_jsonlib(nb):
-    return json.dumps(nb)
+    return codec.dumps(nb)
 def dump_nb_to_string(nb):
+    from nbformat import writes
     return writes(nb, version=4)
 
 
 def load_nb_file(file):
+    from nbformat import read
     # return read(StringIO(nb_string), as_version=4)
     return read(file, as_version=4)
 def load_nb_string(nb_string):
+    from nbformat import reads
     # return read(StringIO(nb_string), as_version=4)
     return reads(nb_string, as_version=4)
 def load_nb_string_jsonlib(nb_string):
-    return json.loads(nb_string)
+    return codec.loads(nb_string)
 
 def is_valid_cell(cell):
     return cell and 'source' in cell and cell['source'] and 'cell_type' in cell
@@ -0,0 +1,187 @@
+''' Line index of jsonl files, for record counts and random access without a scan.
+
+The index of {path} is {path}.idx: a header with the size and modification time of
+the file it was built from and its number of lines, then the byte offset where each
+line starts and the size of the file, as native 8 byte integers. It is built with
+one scan of the memory mapped file and rebuilt when the file changed, so it works
+for any jsonl file: stage shards, the notebook input and the datasets.
+
+    count(path)                 records in the file, from the header
+    record(path, k)             record k, one seek
+    jsoniter(path, start, stop) records start to stop, e.g. for parallel readers
+    read_bag(paths)             a dask bag of slices of about the same number of records
+
+count builds the index if there is none, count(path, write=False) counts the lines
+without writing one, e.g. for files in dirs that are shipped.
+
+usage, to build the indexes of stage dirs or jsonl files ahead of time:
+python -m jupyter.line_index {pipeline dir}/nbgrader/cells6-dataset ...
+'''
+
+import argparse
+import mmap
+import os
+import struct
+from array import array
+from functools import partial
+from os.path import isdir, join
+
+from jupyter import codec
+
+SUFFIX = '.idx'
+MAGIC = b'JIDX\x01\x00\x00\x00'
+
+# magic, size and mtime of the indexed file, lines
+_HEADER = struct.Struct('=8sQQQ')
+_OFFSET = struct.Struct('=Q')
+
+# records per partition of read_bag
+PARTITION_RECORDS = 10000
+
+
+def index_path(path):
+    return path + SUFFIX
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _count_if_fresh(path):
+    '''The number of lines from the index of path, None if it is missing or stale.'''
+    try:
+        with open(index_path(path), 'rb') as f:
+            magic, size, mtime, lines = _HEADER.unpack(f.read(_HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or (size, mtime) != _stat(path):
+        return None
+    return lines
+
+
+def build(path):
+    '''Write the index of the jsonl file path.
+
+    :return: the number of lines.
+    '''
+    size, mtime = _stat(path)
+    offsets = array('Q', [0])
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = mm.find(b'\n')
+            while end != -1:
+                offsets.append(end + 1)
+                end = mm.find(b'\n', end + 1)
+        if offsets[-1] != size:
+            # the last line has no newline
+            offsets.append(size)
+    lines = len(offsets) - 1
+
+    # workers may index the same file at once, each writes its own tmp file
+    tmp_path = f'{index_path(path)}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, size, mtime, lines))
+        f.write(offsets.tobytes())
+    os.replace(tmp_path, index_path(path))
+    return lines
+
+
+def _count_lines(path):
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for chunk in iter(partial(f.read, 2**24), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    return lines + (last != b'\n')
+
+
+def count(path, write=True):
+    '''Records in the jsonl file path. With write=False a missing or stale index is not
+    (re)built, the lines are counted instead.'''
+    lines = _count_if_fresh(path)
+    if lines is not None:
+        return lines
+    return build(path) if write else _count_lines(path)
+
+
+def _offsets(path, k, n):
+    '''Offsets of lines k to k + n - 1 of path, from its fresh index.'''
+    with open(index_path(path), 'rb') as f:
+        f.seek(_HEADER.size + k * _OFFSET.size)
+        return array('Q', f.read(n * _OFFSET.size))
+
+
+def line(path, k):
+    '''Line k of path, without the newline.'''
+    lines = count(path)
+    if not 0 <= k < lines:
+        raise IndexError(f'line {k} of {path} with {lines} lines')
+    start, end = _offsets(path, k, 2)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf8').rstrip('\n')
+
+
+def record(path, k):
+    '''Record k of the jsonl file path.'''
+    return codec.loads(line(path, k))
+
+
+def jsoniter(path, start=0, stop=None):
+    '''Yield the records start to stop (default the end) of the jsonl file path.'''
+    lines = count(path)
+    stop = lines if stop is None else min(stop, lines)
+    if start >= stop:
+        return
+    with open(path, 'rb') as f:
+        f.seek(_offsets(path, start, 1)[0])
+        for _ in range(stop - start):
+            yield codec.loads(f.readline().decode('utf8'))
+
+
+def _read_slice(path, start, stop):
+    return list(jsoniter(path, start, stop))
+
+
+def jsonl_paths(paths):
+    '''The jsonl files of the given dirs and files, shards of a stage dir in order.'''
+    files = []
+    for path in paths:
+        if isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.endswith('.jsonl'))
+            if all(name.split('.')[0].isdigit() for name in names):
+                # shards of a stage dir
+                names.sort(key=lambda name: int(name.split('.')[0]))
+            files += [join(path, name) for name in names]
+        else:
+            files.append(path)
+    return files
+
+
+def slices(paths, records=PARTITION_RECORDS):
+    '''(path, start, stop) of slices of at most records records of the jsonl files.'''
+    return [(path, start, min(start + records, lines))
+            for path, lines in ((path, count(path)) for path in jsonl_paths(paths))
+            for start in range(0, lines, records)]
+
+
+def read_bag(paths, records=PARTITION_RECORDS):
+    '''A bag of the records of the jsonl files or dirs, a partition per slice of
+    records records. Unlike db.read_text, partitions don't depend on the size of
+    the records.'''
+    # dask is only needed here, the index itself is used by light entry points
+    import dask
+    import dask.bag as db
+    parts = [dask.delayed(_read_slice)(*s) for s in slices(paths, records)]
+    return db.from_delayed(parts) if parts else db.from_sequence([], npartitions=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('paths', nargs='+', help='stage dirs or jsonl files')
+    opts = parser.parse_args()
+
+    for path in jsonl_paths(opts.paths):
+        print(f'{path}: {count(path)} records')
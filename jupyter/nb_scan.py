@@ -0,0 +1,77 @@
+''' Notebook level fields read off the json text of a notebook without parsing it.
+
+The notebook filters that only look at the notebook metadata (the kernel language,
+see exercise/filters.is_python) don't need the cells, which are most of the text.
+nbformat 4 writes the metadata after the cells, followed by nothing but nbformat and
+nbformat_minor:
+
+    {"cells": [...], "metadata": {"kernelspec": {...}}, "nbformat": 4, "nbformat_minor": 2}
+
+so metadata finds the last "metadata" key followed by just that and parses only its
+value. When a notebook is laid out differently (nbformat 3 puts the worksheets last,
+other tools sort the keys) it returns None and the caller parses the notebook.
+'''
+
+import json
+import re
+
+# what can follow the top level metadata up to the end of the notebook
+_TAIL = re.compile(r'\s*(?:,\s*"nbformat(?:_minor)?"\s*:\s*\d+\s*)*\}\s*$')
+_KEY = '"metadata"'
+_SPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+def _value_start(text, i):
+    '''Where the value of the key at i starts, None if i isn't a "metadata" key.'''
+    # a quote in a string is escaped, a key follows { or ,
+    if i and text[i - 1] == '\\':
+        return None
+    k = i - 1
+    while k >= 0 and text[k] in _SPACE:
+        k -= 1
+    if k < 0 or text[k] not in '{,':
+        return None
+    j = i + len(_KEY)
+    while j < len(text) and text[j] in _SPACE:
+        j += 1
+    if text[j:j + 1] != ':':
+        return None
+    j += 1
+    while j < len(text) and text[j] in _SPACE:
+        j += 1
+    return j
+
+
+def metadata(text):
+    '''The top level metadata of the notebook json text, parsing only that value.
+
+    :return: the metadata, or None if text isn't laid out like nbformat 4 writes it.
+    '''
+    end = len(text)
+    while True:
+        i = text.rfind(_KEY, 0, end)
+        if i < 0:
+            return None
+        end = i
+        # "metadata" strings in the metadata aren't keys
+        start = _value_start(text, i)
+        if start is None:
+            continue
+        try:
+            value, stop = _decoder.raw_decode(text, start)
+        except ValueError:
+            return None
+        # otherwise it is a key in the top level metadata, or of a cell if the layout
+        # differs, and the cells are parsed anyway
+        return value if _TAIL.match(text, stop) else None
+
+
+def metadata_keeps(keep, text):
+    '''keep of the notebook json text, decided on its metadata alone, so keep must only
+    read nb['metadata']. None if metadata can't find it.'''
+    md = metadata(text)
+    if md is None:
+        return None
+    return bool(keep({'metadata': md}))
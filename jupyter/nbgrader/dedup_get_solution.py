@@ -4,15 +4,20 @@ and dedups the nbgrader dataset.
 
 import copy
 import difflib
+import hashlib
 import logging
+import math
+import os
 import random
+import tempfile
 from collections import defaultdict, Counter
+from os.path import getsize
 
-import numpy as np
-import pandas as pd
 from dotmap import DotMap
 from tqdm import tqdm
 
+from jupyter import codec
+from jupyter import execution
 from jupyter import jdumpl, get_files_under_dir, jloadl
 from jupyter.jupyter_utils import is_markdown
 from jupyter.nbgrader.checksum_util import compute_checksum
@@ -37,6 +42,7 @@ def extract_target_code(boilerplate, solution):
     :param solution: The code cell after student modifications.
     :return: The lines of code the student added.
     '''
+    import numpy as np
     d = difflib.Differ()
     diff = d.compare(boilerplate.splitlines(),
                      solution.splitlines())
@@ -300,6 +306,9 @@ def find_boilerplate_for_checksum(boilerplate_set, cell):
 
 
 def groupem(cells):
+    # pandas is imported where it's used, so the pipelines that import this module
+    # start without it
+    import pandas as pd
     cell_df = pd.DataFrame(cells)
 
     # Get all possible boilerplates so we can try these for cells without boilerplates.
@@ -315,17 +324,64 @@ def groupem(cells):
     return cells
 
 
-def add_keys(c):
-    c.update(c['metadata']['nbgrader'])
-    c['target_cell'] = copy.deepcopy(c)
+def _bucket(key, num_buckets):
+    return int(hashlib.md5(key.encode('utf8')).hexdigest(), 16) % num_buckets
 
-    if 'checksum' not in c['metadata']['nbgrader']:
-        c['checksum'] = 'dummy-checksum'
-    if 'points' not in c['metadata']['nbgrader']:
-        c['points'] = 'dummy-checksum'
-    if 'grade_id' not in c['metadata']['nbgrader']:
-        c['grade_id'] = 'dummy-checksum'
 
+def groupem_spilled(paths, num_buckets, spill_dir):
+    '''groupem for cells that don't fit in memory at once.
+
+    The cells are first written to num_buckets files by a hash of their groupbykey,
+    then each bucket is grouped on its own. Only the boilerplates and the records
+    kept are held across buckets. Gives the same records in the same order as groupem.
+    '''
+    import pandas as pd
+    boiler_set = set()
+    with tempfile.TemporaryDirectory(dir=spill_dir) as bucket_dir:
+        buckets = [open(f'{bucket_dir}/{i}.jsonl', 'w') for i in range(num_buckets)]
+        for path in tqdm(paths):
+            with open(path) as f:
+                for line in f:
+                    # only the key and the boilerplate are needed here, the cells are
+                    # copied into target_cell once their bucket is grouped
+                    c = codec.loads(line)
+                    if _field(c, 'is_boilerplate'):
+                        boiler_set.add(_field(c, 'code'))
+                    buckets[_bucket(group_key(c), num_buckets)].write(line if line.endswith('\n') else line + '\n')
+        for f in buckets:
+            f.close()
+        logger.info('num unique boilers %s', len(boiler_set))
+
+        failures = Counter()
+        kept = []
+        for i in tqdm(range(num_buckets)):
+            cells = [add_keys(c) for c in jloadl(f'{bucket_dir}/{i}.jsonl')]
+            if not cells:
+                continue
+            outs = pd.DataFrame(cells).groupby('groupbykey').apply(lambda group: dedup_boiler_extract(group, boiler_set))
+            del cells
+            for key, o in outs.items():
+                if isinstance(o, str):
+                    failures[o] += 1
+                elif isinstance(o, dict):
+                    kept.append((key, o))
+            os.remove(f'{bucket_dir}/{i}.jsonl')
+
+    logger.info('Failure cause counts %s', failures.most_common(11))
+    # groupby sorts by key, so sorting the buckets' records gives groupem's order
+    cells = [c for _, c in sorted(kept, key=lambda t: t[0])]
+    logger.info('len cells after filtering failed %s', len(cells))
+    return cells
+
+
+def _field(c, key):
+    '''c[key] as add_keys sets it, which copies the nbgrader metadata into the cell.'''
+    nbgrader = c['metadata']['nbgrader']
+    return nbgrader[key] if key in nbgrader else c[key]
+
+
+def group_key(c):
+    '''The groupbykey add_keys gives the cell, without changing it.'''
     nl = ' '.join(c['nl'])
     dist = [x['distance_target'] for x in c['context'] if is_markdown(x)]
     dist = dist[0]
@@ -334,21 +390,25 @@ def add_keys(c):
     # entered nl will cause a lot of false collisions. We factor distance since same
     # nl could be used for multiple targets or if they occur consecutively under the
     # same nl.
-    c['groupbykey'] = nl + str(dist) + c['checksum']
-    return c
+    return nl + str(dist) + c['metadata']['nbgrader'].get('checksum', 'dummy-checksum')
 
-def main(cell_indir, dataset_outfile, max_tokens=120):
-    cells = []
-    # way faster than a bag load
-    for path in tqdm(get_files_under_dir(cell_indir, '.jsonl')):
-        cells.extend(jloadl(path))
-    logger.info('Num cells %s', len(cells))
 
-    # getting our groupbykey and target cell
-    cells = list(map(add_keys, cells))
+def add_keys(c):
+    c.update(c['metadata']['nbgrader'])
+    c['target_cell'] = copy.deepcopy(c)
 
-    dataset = groupem(cells)
+    if 'checksum' not in c['metadata']['nbgrader']:
+        c['checksum'] = 'dummy-checksum'
+    if 'points' not in c['metadata']['nbgrader']:
+        c['points'] = 'dummy-checksum'
+    if 'grade_id' not in c['metadata']['nbgrader']:
+        c['grade_id'] = 'dummy-checksum'
+
+    c['groupbykey'] = group_key(c)
+    return c
 
+def finalize(dataset, dataset_outfile, max_tokens):
+    '''Drop records with empty or too long extracted code and dump the rest.'''
     # if it doesn't have code tokens, it means the code was likely a comment
     dataset = [j for j in dataset if j['code_tokens_clean']]
     # dataset = [j for j in dataset if j['extracted_code_tokens']]
@@ -371,3 +431,28 @@ def main(cell_indir, dataset_outfile, max_tokens=120):
         code_set.add(tuple(js['code_tokens_clean']))
     logger.info('num unique code in nbgrader dataset %s', len(code_set))
 
+def main(cell_indir, dataset_outfile, max_tokens=120):
+    paths = get_files_under_dir(cell_indir, '.jsonl')
+    memory_limit = execution.memory_limit()
+    if memory_limit:
+        # the cells, their target_cell copies and the dataframe hold several copies of the input
+        needed = sum(getsize(p) for p in paths) * execution.MEMORY_PER_INPUT_BYTE
+        if needed > memory_limit:
+            num_buckets = math.ceil(needed / memory_limit)
+            logger.info('Grouping in %s buckets to stay under the memory limit', num_buckets)
+            dataset = groupem_spilled(paths, num_buckets, execution.spill_dir())
+            finalize(dataset, dataset_outfile, max_tokens)
+            return
+
+    cells = []
+    # way faster than a bag load
+    for path in tqdm(paths):
+        cells.extend(jloadl(path))
+    logger.info('Num cells %s', len(cells))
+
+    # getting our groupbykey and target cell
+    cells = list(map(add_keys, cells))
+
+    dataset = groupem(cells)
+
+    finalize(dataset, dataset_outfile, max_tokens)
@@ -2,24 +2,37 @@
 '''
 import argparse
 import logging
+from functools import partial
 from pathlib import Path
 
+from jupyter import execution
+from jupyter import incremental
+from jupyter.dag import Stage, run_serial
 from jupyter.nbgrader import dedup_get_solution
 from jupyter.nbgrader import split
+from jupyter.new_pipeline import fanout
 from jupyter.new_pipeline import filter
 from jupyter.new_pipeline import shared_pipeline
 
-format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
-logging.basicConfig(
-    level=logging.INFO,
-    datefmt='%I:%M:%S %p',
-    format=format,
-    handlers=[
-        logging.FileHandler("nbgrader.log", mode='w'),
-        logging.StreamHandler()
-    ])
 
-def run_pipeline(opts):
+def notebook_stages(opts):
+    '''The stages that handle each notebook on its own, they can run on any subset of
+    the input. Returns them with the dir the last one writes.'''
+    Path(opts.pipeline_outdir).mkdir(exist_ok=True, parents=True)
+    return shared_pipeline.stages(input_nbs_dir=opts.input_nbs_dir,
+                                  pipeline_outdir=opts.pipeline_outdir,
+                                  max_nl_distance=opts.max_nl_distance,
+                                  context_len=opts.context_len,
+                                  max_api_seq_len=opts.max_api_seq_len,
+                                  min_api_seq_len=opts.min_api_seq_len,
+                                  is_nbgrader=True,
+                                  use_cache=not opts.no_cache,
+                                  sample=opts.sample,
+                                  debug_intermediates=opts.debug_intermediates)
+
+
+def global_stages(opts, dataset_dir, deps):
+    '''The stages that need all records at once, starting after the stages in deps.'''
     pipeline_outdir = f'{opts.pipeline_outdir}'
     # this one we split into train/dev/test so we can fine tune on train
     dataset_outdir = f'{pipeline_outdir}/dataset'
@@ -36,26 +49,104 @@ def run_pipeline(opts):
     dev_file_eval = f'{dataset_outdir_eval}/dev.jsonl'
     test_file_eval = f'{dataset_outdir_eval}/test.jsonl'
 
+    lst = []
+    lst.append(Stage('filter_graded_code_cells',
+                     partial(filter.filter_graded_code_cells, dataset_dir, dataset_outdir7),
+                     deps=deps, outputs=[dataset_outdir7]))
+
+    lst.append(Stage('dedup_get_solution',
+                     partial(dedup_get_solution.main, dataset_outdir7, nbgrader_dataset, max_tokens=120),
+                     deps=['filter_graded_code_cells'], outputs=[nbgrader_dataset]))
 
-    dataset_dir = shared_pipeline.main(input_nbs_dir=opts.input_nbs_dir,
-                                        pipeline_outdir=pipeline_outdir,
-                                        max_nl_distance=opts.max_nl_distance,
-                                        context_len=opts.context_len,
-                                        max_api_seq_len=opts.max_api_seq_len,
-                                        min_api_seq_len=opts.min_api_seq_len,
-                                        is_nbgrader=True)
+    # for only dev/test eval split
+    lst.append(Stage('split', partial(split.split_simple, nbgrader_dataset,
+                                      dev_file=dev_file_eval, test_file=test_file_eval,
+                                      test_size=.55),
+                     deps=['dedup_get_solution'], outputs=[dev_file_eval, test_file_eval]))
+    return lst
 
-    filter.filter_graded_code_cells(dataset_dir, dataset_outdir7)
 
-    dedup_get_solution.main(dataset_outdir7, nbgrader_dataset, max_tokens=120)
+def stages(opts):
+    lst, dataset_dir = notebook_stages(opts)
+    return lst + global_stages(opts, dataset_dir, deps=[lst[-1].name])
 
 
-    # for only dev/test eval split
-    split.split_simple(nbgrader_dataset, dev_file=dev_file_eval, test_file=test_file_eval,
-                test_size=.55)
+def fanout_stages(opts):
+    '''One dataset per config in opts.configs, see jupyter.new_pipeline.fanout.'''
+    Path(opts.pipeline_outdir).mkdir(exist_ok=True, parents=True)
+    configs = fanout.load_configs(opts.configs,
+                                  max_api_seq_len=opts.max_api_seq_len,
+                                  min_api_seq_len=opts.min_api_seq_len,
+                                  max_nl_distance=opts.max_nl_distance,
+                                  context_len=opts.context_len,
+                                  max_tokens=1111111)
+    lst, dataset_dirs = fanout.stages(opts.input_nbs_dir, opts.pipeline_outdir, configs,
+                                      is_nbgrader=True, use_cache=not opts.no_cache, sample=opts.sample)
+
+    for config in configs:
+        name = config['name']
+        config_dir = fanout.config_dir(opts.pipeline_outdir, config)
+        dataset_outdir7 = f'{config_dir}/cells7-autograded'
+        nbgrader_dataset = f'{config_dir}/dataset/nbgrader_dataset.jsonl'
+        dataset_outdir_eval = f'{config_dir}/dataset-evalonly'
+        Path(config_dir, 'dataset').mkdir(parents=True, exist_ok=True)
+        Path(dataset_outdir_eval).mkdir(exist_ok=True)
+
+        lst.append(Stage(f'{name}/filter_graded_code_cells',
+                         partial(filter.filter_graded_code_cells, dataset_dirs[name], dataset_outdir7),
+                         deps=[f'{name}/select_config'], outputs=[dataset_outdir7]))
+        lst.append(Stage(f'{name}/dedup_get_solution',
+                         partial(dedup_get_solution.main, dataset_outdir7, nbgrader_dataset, max_tokens=120),
+                         deps=[f'{name}/filter_graded_code_cells'], outputs=[nbgrader_dataset]))
+        lst.append(Stage(f'{name}/split', partial(split.split_simple, nbgrader_dataset,
+                                                  dev_file=f'{dataset_outdir_eval}/dev.jsonl',
+                                                  test_file=f'{dataset_outdir_eval}/test.jsonl',
+                                                  test_size=.55),
+                         deps=[f'{name}/dedup_get_solution'],
+                         outputs=[f'{dataset_outdir_eval}/dev.jsonl', f'{dataset_outdir_eval}/test.jsonl']))
+    return lst
+
+
+def run_incremental(opts):
+    '''Only runs the shared pipeline on notebooks not seen before, see jupyter.incremental.'''
+    state_dir = f'{opts.pipeline_outdir}/incremental'
+    dataset_outdir_eval = f'{opts.pipeline_outdir}/dataset-evalonly'
+    nbgrader_dataset = f'{opts.pipeline_outdir}/dataset/nbgrader_dataset.jsonl'
+    Path(dataset_outdir_eval).mkdir(parents=True, exist_ok=True)
+    Path(opts.pipeline_outdir, 'dataset').mkdir(exist_ok=True)
+
+    batch, removed, index = incremental.ingest(opts.input_nbs_dir, state_dir,
+                                               max_nl_distance=opts.max_nl_distance,
+                                               context_len=opts.context_len,
+                                               max_api_seq_len=opts.max_api_seq_len,
+                                               min_api_seq_len=opts.min_api_seq_len,
+                                               is_nbgrader=True)
+    incremental.update_groups(state_dir, batch, removed, index, nbgrader_dataset, max_tokens=120)
+
+    split.split_simple(nbgrader_dataset, dev_file=f'{dataset_outdir_eval}/dev.jsonl',
+                       test_file=f'{dataset_outdir_eval}/test.jsonl', test_size=.55)
+
+
+def run_pipeline(opts):
+    if opts.incremental:
+        run_incremental(opts)
+    elif opts.configs:
+        run_serial(fanout_stages(opts))
+    else:
+        run_serial(stages(opts))
 
 
 if __name__ == '__main__':
+    format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format=format,
+        handlers=[
+            logging.FileHandler("nbgrader.log", mode='w'),
+            logging.StreamHandler()
+        ])
+
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-input_nbs_dir')
     parser.add_argument('-large')
@@ -64,7 +155,18 @@ if __name__ == '__main__':
     parser.add_argument('-max_api_seq_len', type=int, default=15)
     parser.add_argument('-min_api_seq_len', type=int, default=0)
     parser.add_argument('-context_len', type=int)
+    parser.add_argument('-no_cache', action='store_true', help='rerun stages even if cached')
+    parser.add_argument('-debug_intermediates', action='store_true',
+                        help='write the output of every filter instead of filtering in one pass')
+    parser.add_argument('-sample', type=float, default=-1,
+                        help='only process this fraction of the notebooks, picked by nb_index')
+    parser.add_argument('-incremental', action='store_true',
+                        help='only process notebooks that are new since the last incremental run')
+    parser.add_argument('-configs', help='json file with a list of parameter settings, each gets its '
+                                         'own dataset under {pipeline_outdir}/configs/{name}')
+    execution.add_arguments(parser)
     opts = parser.parse_args()
 
-    assert opts.max_nl_distance <= opts.context_len
-    run_pipeline(opts)
+    assert opts.configs or opts.max_nl_distance <= opts.context_len
+    with execution.from_opts(opts):
+        run_pipeline(opts)
@@ -1,7 +1,5 @@
 import logging
 
-from sklearn.model_selection import train_test_split
-
 from jupyter import jloadl, jdumpl
 
 logger = logging.getLogger(__name__)
@@ -9,6 +7,8 @@ logger = logging.getLogger(__name__)
 
 def split_simple(dataset_file, dev_file, test_file, test_size, use_context=False):
     '''Split intio dev/test, if any test code in dev, move it to dev.'''
+    # scikit-learn takes longer to import than most stages take to start
+    from sklearn.model_selection import train_test_split
     logger.info('')
 
     # data = db.read_text([dataset_file]).map(json.loads).compute()
@@ -0,0 +1,202 @@
+''' Builds the dataset for several parameter settings in one pass.
+
+The stages up to the parseable cells don't depend on the settings and run once. The
+api sequence length and kind of each cell are then computed once, and the records are
+built with the largest context and no token cap. Each configuration only selects from
+these records: the logic_type thresholds, the nl distance (nbgrader), the context
+length and max_tokens are cheap to apply to a finished record.
+
+A configs file is a json list like
+    [{"name": "ctx12", "context_len": 12, "max_tokens": 120},
+     {"max_api_seq_len": 10, "context_len": 3}]
+missing keys default to the command line values and a name is made up if not given.
+'''
+
+import json
+import logging
+from functools import partial
+
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter.dag import Stage
+from jupyter.execution import ProgressBar
+from jupyter.jupyter_utils import is_markdown
+from jupyter.new_pipeline import filter
+from jupyter.new_pipeline import shared_pipeline
+from jupyter.new_pipeline import to_dataset
+
+logger = logging.getLogger(__name__)
+
+PARAMS = ['max_api_seq_len', 'min_api_seq_len', 'max_nl_distance', 'context_len', 'max_tokens']
+
+# logic types one_func_max_api_seq keeps
+KEPT_KINDS = ['1 function', 'pure logic', 'boilerplate']
+
+
+def config_name(config):
+    return 'api{min_api_seq_len}-{max_api_seq_len}_nl{max_nl_distance}_ctx{context_len}_tok{max_tokens}'.format(**config)
+
+
+def load_configs(path, **defaults):
+    '''Read the configs file, filling in missing parameters from defaults.'''
+    with open(path) as f:
+        configs = json.load(f)
+
+    out = []
+    for config in configs:
+        unknown = set(config) - set(PARAMS) - {'name'}
+        assert not unknown, f'unknown config keys {unknown}'
+        full = dict(defaults)
+        full.update(config)
+        missing = [p for p in PARAMS if full.get(p) is None]
+        assert not missing, f'config {config} is missing {missing}'
+        assert full['max_nl_distance'] <= full['context_len']
+        full.setdefault('name', config_name(full))
+        out.append(full)
+
+    names = [c['name'] for c in out]
+    assert len(names) == len(set(names)), f'duplicate config names {names}'
+    return out
+
+
+def add_logic_features(cells_indir, cells_outdir, max_api_seq_len, min_api_seq_len):
+    '''Store the api sequence length and kind in each cell that some config keeps.
+
+    :param max_api_seq_len, min_api_seq_len: the loosest thresholds of all configs.
+    '''
+    run_key = stage_cache.stage_key(add_logic_features, [cells_indir],
+                                    dict(max_api_seq_len=max_api_seq_len, min_api_seq_len=min_api_seq_len))
+
+    def add_features(cell):
+        cell['metadata']['logic_features'] = filter.logic_features(cell)
+        return cell
+
+    def kept(cell):
+        api_seq_len, kind = cell['metadata']['logic_features']
+        return filter.logic_type_from_features(api_seq_len, kind, max_api_seq_len, min_api_seq_len) in KEPT_KINDS
+
+    with ProgressBar(minimum=15):
+        bag = stage_io.read_records(cells_indir).map(add_features).filter(kept)
+        stage_io.write_records(bag, cells_outdir, run_key)
+
+
+def nl_distance(nb_cells, cell_index):
+    '''Distance to the closest markdown cell above, None if there is none.'''
+    for i, c in enumerate(reversed(nb_cells[:cell_index])):
+        if is_markdown(c):
+            return i+1
+    return None
+
+
+def compute_superset_record(row, context_len):
+    js = to_dataset.compute_dataset_record(row, context_len, max_tokens=float('inf'))
+    if js:
+        api_seq_len, kind = js['metadata'].pop('logic_features')
+        js['fanout'] = {
+            'api_seq_len': api_seq_len,
+            'kind': kind,
+            'nl_distance': nl_distance(row.cells, row.metadata_cell['cell_index']),
+        }
+    return js
+
+
+def get_superset_records(cells_indir, cells_outdir, nbs_indir, context_len):
+    '''get_code_context_records with the largest context of all configs and no token cap.'''
+    logger.info('')
+    run_key = stage_cache.stage_key(get_superset_records, [cells_indir, nbs_indir],
+                                    dict(context_len=context_len))
+
+    with ProgressBar(minimum=15):
+        bag = (to_dataset.join_cells_with_nbs(stage_io.read_records(cells_indir, columns=to_dataset.DATASET_CELL_COLUMNS),
+                                              nbs_indir)
+     .apply(compute_superset_record, context_len=context_len, meta=object, axis=1).to_bag()
+     .filter(lambda js: js and js['code_tokens']))
+        stage_io.write_records(bag, cells_outdir, run_key)
+
+
+def select_record(js, config, is_nbgrader):
+    '''The record as the single config pipeline would have written it, None if it
+    would have been filtered.'''
+    features = js.pop('fanout')
+    kind = filter.logic_type_from_features(features['api_seq_len'], features['kind'],
+                                           config['max_api_seq_len'], config['min_api_seq_len'])
+    if kind not in KEPT_KINDS:
+        return None
+    # for noisy train the markdown above is already ensured by dump_cells
+    if is_nbgrader and (features['nl_distance'] is None or features['nl_distance'] > config['max_nl_distance']):
+        return None
+    if len(js['code_tokens_clean']) > config['max_tokens']:
+        return None
+
+    # the context is ordered by distance so truncating gives the shorter context
+    js['context'] = [c for c in js['context'] if c['distance_target'] <= config['context_len']]
+    js.pop('nl', None)
+    for c in js['context']:
+        if 'nl' in c:
+            js['nl'] = c['nl']
+            break
+    return js
+
+
+def select_config(cells_indir, cells_outdir, config, is_nbgrader):
+    run_key = stage_cache.stage_key(select_config, [cells_indir],
+                                    dict(config=config, is_nbgrader=is_nbgrader))
+
+    bag = (stage_io.read_records(cells_indir)
+           .map(select_record, config=config, is_nbgrader=is_nbgrader)
+           .filter(lambda js: js is not None))
+    stage_io.write_records(bag, cells_outdir, run_key, export=True)
+
+
+def config_dir(pipeline_outdir, config):
+    return f'{pipeline_outdir}/configs/{config["name"]}'
+
+
+def stages(input_nbs_dir, pipeline_outdir, configs, is_nbgrader=False, use_cache=True, sample=-1):
+    '''Shared stages followed by one select_config stage per config.
+
+    :return: the stages and for each config name the dir its dataset is written to.
+    The select stage of a config is named {name}/select_config.
+    '''
+    dataset_outdir2 = f'{pipeline_outdir}/cells2-parseable'
+    dataset_outdir4 = f'{pipeline_outdir}/cells4-fanout'
+    dataset_outdir6 = f'{pipeline_outdir}/cells6-fanout'
+
+    run_stage = partial(stage_cache.run_stage, use_cache=use_cache)
+    lst, dataset_outdir, stripped_nbs_dir = shared_pipeline.ingest_stages(input_nbs_dir, pipeline_outdir, is_nbgrader,
+                                                                          use_cache, sample)
+
+    lst.append(Stage('filter_parseable_code_cells', partial(
+        run_stage, filter.filter_parseable_code_cells, inputs=[dataset_outdir],
+        outputs=[dataset_outdir2],
+        cells_indir=dataset_outdir, cells_outdir=dataset_outdir2,
+        isnbgrader_logic=is_nbgrader), deps=['dump_cells'], outputs=[dataset_outdir2]))
+
+    lst.append(Stage('add_logic_features', partial(
+        run_stage, add_logic_features, inputs=[dataset_outdir2],
+        outputs=[dataset_outdir4],
+        cells_indir=dataset_outdir2, cells_outdir=dataset_outdir4,
+        max_api_seq_len=max(c['max_api_seq_len'] for c in configs),
+        min_api_seq_len=min(c['min_api_seq_len'] for c in configs)),
+        deps=['filter_parseable_code_cells'], outputs=[dataset_outdir4]))
+
+    lst.append(Stage('get_superset_records', partial(
+        run_stage, get_superset_records,
+        inputs=[dataset_outdir4, stripped_nbs_dir],
+        outputs=[dataset_outdir6],
+        cells_indir=dataset_outdir4, cells_outdir=dataset_outdir6,
+        nbs_indir=stripped_nbs_dir, context_len=max(c['context_len'] for c in configs)),
+        deps=['add_logic_features', 'strip_nbs'], outputs=[dataset_outdir6]))
+
+    dataset_dirs = {}
+    for config in configs:
+        outdir = f'{config_dir(pipeline_outdir, config)}/cells6-dataset'
+        lst.append(Stage(f'{config["name"]}/select_config', partial(
+            run_stage, select_config, inputs=[dataset_outdir6],
+            outputs=[outdir],
+            cells_indir=dataset_outdir6, cells_outdir=outdir,
+            config=config, is_nbgrader=is_nbgrader),
+            deps=['get_superset_records'], outputs=[outdir]))
+        dataset_dirs[config['name']] = outdir
+
+    return lst, dataset_dirs
@@ -4,15 +4,14 @@ usage:
 
 import ast
 import copy
-import json
 import random
-import shutil
-from pathlib import Path
 
-import dask.bag as db
-from dask.diagnostics import ProgressBar
 from dotmap import DotMap
 
+from jupyter import predicates
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import is_code, is_markdown
 from jupyter.nbgrader.checksum_util import compute_checksum
 from jupyter.preprocess.tokenize_utils import tokenize_and_templatize, gen_api_seq
@@ -124,37 +123,42 @@ def mark_cell_boilerplate_solution(cell):
     return cell
 
 
-def filter_parseable_code_cells(cells_indir, cells_outdir, isnbgrader_logic, key='source'):
-    '''Filter out cells that dont parse. Preprocess code by converting python2 to 3 and
-    removing ipython inline statements to increase odds of parsing. '''
+def parses_or_boilerplate(cell):
+    cell = mark_cell_boilerplate_solution(cell)
+    cell = python2_print_fix(remove_magic_inline(cell))
+    # boilerplate cells don't have to parse
+    return does_parse(cell['source'], cell['metadata']['nb_orig_url']) or cell['metadata']['nbgrader']['is_boilerplate']
 
-    shutil.rmtree(cells_outdir, ignore_errors=True)
-    Path(cells_outdir).mkdir(exist_ok=True)
 
-    logger.info('Num cells before %s', db.read_text(cells_indir+'/*.jsonl').count().compute())
+def parses(cell):
+    cell = remove_magic_inline(cell)
+    return does_parse(cell['source'])
 
+
+def parseable_predicates(isnbgrader_logic):
     if isnbgrader_logic:
         # nbgrader we want to keep unparseable cells if they're boilerplate which may not parse,
         #  so we have a slightly modified version
-        with ProgressBar(minimum=15):
-            (db.read_text(cells_indir+'/*.jsonl').map(json.loads)
-            .map(mark_cell_boilerplate_solution)
-            .filter(lambda cell: is_code(cell))
-            .map(lambda cell: remove_magic_inline(cell))
-
-            .map(lambda cell: python2_print_fix(cell))
-            # boilerplate cells don't have to parse
-            .filter(lambda cell: does_parse(cell['source'], cell['metadata']['nb_orig_url']) or cell['metadata']['nbgrader']['is_boilerplate'])
-            .map(json.dumps).to_textfiles(cells_outdir+'/*.jsonl'))
-    else:
-        with ProgressBar(minimum=15):
-            (db.read_text(cells_indir+'/*.jsonl').map(json.loads)
-         .filter(lambda cell: is_code(cell))
-         .map(lambda cell: remove_magic_inline(cell))
-         .filter(lambda cell: does_parse(cell['source']))
-         .map(json.dumps).to_textfiles(cells_outdir+'/*.jsonl'))
+        return [predicates.Predicate('is_code', is_code),
+                predicates.Predicate('parses_or_boilerplate', parses_or_boilerplate)]
+    return [predicates.Predicate('is_code', is_code),
+            predicates.Predicate('parses', parses)]
+
+
+def filter_parseable_code_cells(cells_indir, cells_outdir, isnbgrader_logic, key='source'):
+    '''Filter out cells that dont parse. Preprocess code by converting python2 to 3 and
+    removing ipython inline statements to increase odds of parsing. '''
+    run_key = stage_cache.stage_key(filter_parseable_code_cells, [cells_indir],
+                                    dict(isnbgrader_logic=isnbgrader_logic, key=key))
+
+    with ProgressBar(minimum=15):
+        bag = stage_io.read_records(cells_indir)
+        counts = stage_io.write_records(bag, cells_outdir, run_key,
+                                        select=predicates.plan_filter('filter_parseable_code_cells',
+                                                                      parseable_predicates(isnbgrader_logic)))
 
-    logger.info('Num cells after %s', db.read_text(cells_outdir+'/*.jsonl').count().compute())
+    logger.info('Num cells before %s', counts['in'])
+    logger.info('Num cells after %s', counts['out'])
 
 def grading_type(cell):
     if 'nbgrader' in cell['metadata']:
@@ -179,30 +183,25 @@ def grading_type(cell):
 def filter_graded_code_cells(cells_indir, cells_outdir):
     '''Keep only autograded code cells since they are high quality.'''
     # assert '/scratch/jupyter-pipeline' in cells_outdir
-    shutil.rmtree(cells_outdir, ignore_errors=True)
-    Path(cells_outdir).mkdir(exist_ok=True)
-
-    bag = db.read_text(cells_indir +'/*.jsonl').map(json.loads)
-    lst = \
-        bag.map(lambda cell: grading_type(cell)) \
-            .frequencies() \
-            .topk(k=50, key=lambda tup: tup[1])
-
-    logger.info('Counts of grading types of code cells %s', lst.compute())
+    run_key = stage_cache.stage_key(filter_graded_code_cells, [cells_indir], {})
 
     with ProgressBar(minimum=15):
-        db.read_text(cells_indir +'/*.jsonl').map(json.loads) \
-        .filter(lambda cell: grading_type(cell) in ['autograded code']) \
-        .map(json.dumps).to_textfiles(cells_outdir+'/*.jsonl')
+        # the counts are taken while filtering, in the same pass
+        counts = stage_io.write_records(stage_io.read_records(cells_indir), cells_outdir, run_key,
+                                        category=grading_type, kept=['autograded code'], export=True)
+
+    logger.info('Counts of grading types of code cells %s', counts['categories'].most_common(50))
 
 
 def is_boilerplate(cell):
     return 'nbgrader' in cell['metadata'] and cell['metadata']['nbgrader']['is_boilerplate']
 
-def logic_type(cell, max_api_seq_len, min_api_seq_len):
+def logic_features(cell):
+    '''The api sequence length and the kind of code in the cell, logic_type applies
+    the length thresholds on these.'''
     if is_boilerplate(cell):
         # boilerplate may not tokenize so leave it
-        return 'boilerplate'
+        return None, 'boilerplate'
 
     try:
         toks, types = tokenize_and_templatize(cell['source'])
@@ -212,43 +211,61 @@ def logic_type(cell, max_api_seq_len, min_api_seq_len):
         # return 'untokenizeable'
 
     api_seq = gen_api_seq(toks, types)
-    if len(api_seq) > max_api_seq_len:
-        return f'api seq longer than {max_api_seq_len}'
-
-    if len(api_seq) < min_api_seq_len:
-        return f'api seq shorter than {min_api_seq_len}'
-
 
     if 'class' in toks:
-        return 'class'
+        return len(api_seq), 'class'
     elif toks.count('def') > 1:
-        return 'more than 1 function'
+        return len(api_seq), 'more than 1 function'
     elif toks.count('def') == 1:
-        return '1 function'
+        return len(api_seq), '1 function'
     else:
-        return 'pure logic'
+        return len(api_seq), 'pure logic'
 
+def logic_type_from_features(api_seq_len, kind, max_api_seq_len, min_api_seq_len):
+    if kind == 'boilerplate':
+        return kind
 
-def one_func_max_api_seq(cells_indir, cells_outdir, max_api_seq_len, min_api_seq_len):
-    '''Filter cells with more than 1 function or long api sequence.'''
-    shutil.rmtree(cells_outdir, ignore_errors=True)
-    Path(cells_outdir).mkdir(exist_ok=True)
+    if api_seq_len > max_api_seq_len:
+        return f'api seq longer than {max_api_seq_len}'
 
+    if api_seq_len < min_api_seq_len:
+        return f'api seq shorter than {min_api_seq_len}'
 
-    bag=db.read_text(cells_indir +'/*.jsonl').map(json.loads)
-    kernel_type = \
-        bag.map(lambda cell: logic_type(cell, max_api_seq_len, min_api_seq_len)) \
-            .frequencies() \
-            .topk(k=50, key=lambda tup: tup[1])
+    return kind
 
-    logger.info('Counts of function/class types')
-    logger.info('%s', kernel_type.compute())
+def logic_type(cell, max_api_seq_len, min_api_seq_len):
+    api_seq_len, kind = logic_features(cell)
+    return logic_type_from_features(api_seq_len, kind, max_api_seq_len, min_api_seq_len)
+
+
+def logic_type_predicates(max_api_seq_len, min_api_seq_len):
+    def kept_logic_type(cell):
+        return logic_type(cell, max_api_seq_len, min_api_seq_len) in ['1 function', 'pure logic', 'boilerplate']
+    # logic_type only tokenizes cleaned up code cells that parse, boilerplate is
+    # marked by parses_or_boilerplate
+    return [predicates.Predicate('kept_logic_type', kept_logic_type,
+                                 after=('is_code', 'parses', 'parses_or_boilerplate'))]
+
+
+def code_cell_predicates(isnbgrader_logic, max_api_seq_len, min_api_seq_len):
+    '''The predicates of filter_parseable_code_cells and one_func_max_api_seq, planned together.'''
+    return parseable_predicates(isnbgrader_logic) + logic_type_predicates(max_api_seq_len, min_api_seq_len)
+
+
+def one_func_max_api_seq(cells_indir, cells_outdir, max_api_seq_len, min_api_seq_len):
+    '''Filter cells with more than 1 function or long api sequence.'''
+    run_key = stage_cache.stage_key(one_func_max_api_seq, [cells_indir],
+                                    dict(max_api_seq_len=max_api_seq_len, min_api_seq_len=min_api_seq_len))
 
 
     with ProgressBar(minimum=15):
-        db.read_text(cells_indir +'/*.jsonl').map(json.loads) \
-        .filter(lambda cell: logic_type(cell, max_api_seq_len, min_api_seq_len) in ['1 function', 'pure logic', 'boilerplate']) \
-        .map(json.dumps).to_textfiles(cells_outdir+'/*.jsonl')
+        # the counts are taken while filtering, so each cell is tokenized once
+        counts = stage_io.write_records(stage_io.read_records(cells_indir), cells_outdir, run_key,
+                                        category=lambda cell: logic_type(cell, max_api_seq_len, min_api_seq_len),
+                                        kept=['1 function', 'pure logic', 'boilerplate'])
+
+    logger.info('Counts of function/class types')
+    logger.info('%s', counts['categories'].most_common(50))
 
 def add_key(js, cell=False):
     assert 'nb_index' in js['metadata']
@@ -264,14 +281,8 @@ def add_key(js, cell=False):
     js['nb_index'] = js['metadata']['nb_index']
     return js
 
-def filter_cells_nl_above_dataframe(cells_indir, cells_outdir, nbs_indir, max_dist):
-    '''Filter cells if markdown is more than max_dist away.'''
-    shutil.rmtree(cells_outdir, ignore_errors=True)
-    Path(cells_outdir).mkdir(exist_ok=True)
-
-    logging.info(f'Num cells before nl dist %s filter %s', max_dist, db.read_text(cells_indir+'/*.jsonl').count().compute())
-
-
+def cells_nl_above(cells, nbs_indir, max_dist):
+    '''The cells of the bag with markdown at most max_dist cells above.'''
     # this is required by dask
     cells_meta= {'cell_type': str,
                  'execution_count': int,
@@ -284,8 +295,9 @@ def filter_cells_nl_above_dataframe(cells_indir, cells_outdir, nbs_indir, max_di
     nb_meta= {'cells': object, 'metadata': object, 'nbformat': int, 'nbformat_minor': int,
               'nb_index': int}
 
-    cells_df = db.read_text(cells_indir +'/*.jsonl').map(json.loads).map(lambda js: add_key(js,cell=True)).to_dataframe(meta=cells_meta)
-    nbs_df = db.read_text(nbs_indir +'/*.jsonl').map(json.loads).map(lambda js: add_key(js)).to_dataframe(meta=nb_meta)
+    cells_df = cells.map(lambda js: add_key(js,cell=True)).to_dataframe(meta=cells_meta)
+    nbs_df = (stage_io.read_records(nbs_indir, columns=[k for k in nb_meta if k != 'nb_index'])
+              .map(lambda js: add_key(js)).to_dataframe(meta=nb_meta))
 
     def get_cell(row):
         '''if not nl above return high int representing infinite distance'''
@@ -299,14 +311,22 @@ def filter_cells_nl_above_dataframe(cells_indir, cells_outdir, nbs_indir, max_di
         # print(row.og_cell['metadata']['nb_orig_url'])
         return {}
 
+    return (cells_df.merge(nbs_df, on='nb_index', suffixes=['_cell', '_nb'])
+     .apply(get_cell, meta=object, axis=1).to_bag()
+     .filter(lambda js: 'source' in js))
 
 
-    with ProgressBar(minimum=15):
-        (cells_df.merge(nbs_df, on='nb_index', suffixes=['_cell', '_nb'])
-     .apply(get_cell, meta=object, axis=1).to_bag()
-     .filter(lambda js: 'source' in js)
-     .map(json.dumps).to_textfiles(cells_outdir + '/*.jsonl'))
+def filter_cells_nl_above_dataframe(cells_indir, cells_outdir, nbs_indir, max_dist):
+    '''Filter cells if markdown is more than max_dist away.'''
+    run_key = stage_cache.stage_key(filter_cells_nl_above_dataframe, [cells_indir, nbs_indir],
+                                    dict(max_dist=max_dist))
 
+    logging.info(f'Num cells before nl dist %s filter %s', max_dist, stage_io.count_records(cells_indir))
 
+    with ProgressBar(minimum=15):
+        # partitions of the join output are deterministic for the same inputs, so
+        # a restarted run only applies get_cell to the missing ones
+        bag = cells_nl_above(stage_io.read_records(cells_indir), nbs_indir, max_dist)
+        counts = stage_io.write_records(bag, cells_outdir, run_key)
 
-    logging.info(f'Num cells after nl dist %s filter %s', max_dist, db.read_text(cells_outdir+'/*.jsonl').count().compute())
+    logging.info(f'Num cells after nl dist %s filter %s', max_dist, counts['out'])
@@ -0,0 +1,80 @@
+''' Notebooks and cells without the outputs and metadata the stages don't read.
+
+The scraped notebooks carry large outputs (base64 images, dataframes) and arbitrary
+metadata. Only dump_cells reads the full notebooks: it dumps them for visualization
+and computes the flags of the nbgrader cells that depend on outputs
+(from_output_nb, test_below_passed). The cells it writes then have no outputs, see
+strip_outputs.
+
+The stages that join the cells with their notebooks (filter_cells_nl_above_dataframe,
+get_code_context_records, get_superset_records) only look at the type, source and
+nbgrader metadata of the cells above a cell. strip_nbs writes the notebooks with just
+that, so the joins don't load and shuffle the outputs.
+
+Both count the bytes they remove as 'stripped_bytes', dag logs them for each stage.
+'''
+
+import logging
+
+from jupyter import codec
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
+
+logger = logging.getLogger(__name__)
+
+# the keys of the notebooks the joins read, see filter.cells_nl_above
+NB_KEYS = ['cells', 'metadata', 'nbformat', 'nbformat_minor']
+NB_METADATA_KEYS = ['nb_index']
+CELL_KEYS = ['cell_type', 'source', 'metadata']
+CELL_METADATA_KEYS = ['nbgrader']
+
+
+def strip_outputs(cell):
+    '''Empty the outputs of the cell, once the flags that need them are computed.'''
+    if cell['outputs']:
+        # "outputs": [] is what is left
+        stage_io.add_to_counter('stripped_bytes', len(codec.dumps(cell['outputs'])) - 2)
+        cell['outputs'] = []
+    return cell
+
+
+def _pick(js, keys):
+    return {k: js[k] for k in keys if k in js}
+
+
+def strip_cell(cell):
+    stripped = _pick(cell, CELL_KEYS)
+    # is_valid_cell and grading_type also see metadata that isn't a dict
+    if isinstance(stripped.get('metadata'), dict):
+        stripped['metadata'] = _pick(stripped['metadata'], CELL_METADATA_KEYS)
+    return stripped
+
+
+def strip_nb(nb):
+    '''The notebook with only what the joins with its cells read.'''
+    stripped = _pick(nb, NB_KEYS)
+    stripped['metadata'] = _pick(nb['metadata'], NB_METADATA_KEYS)
+    stripped['cells'] = [strip_cell(c) for c in nb['cells']]
+    return stripped
+
+
+def _strip_line(line):
+    stripped = strip_nb(codec.loads(line))
+    # lines end with a newline, the written records too
+    stage_io.add_to_counter('stripped_bytes', len(line) - len(codec.dumps(stripped)) - 1)
+    return stripped
+
+
+def strip_nbs(nbs_dir, outdir):
+    '''Write the notebooks of nbs_dir as strip_nb leaves them to outdir.'''
+    logger.info('')
+    run_key = stage_cache.stage_key(strip_nbs, [nbs_dir], {})
+
+    with ProgressBar(minimum=15):
+        # not compacted, so the joins read the notebooks in the partitions they read
+        # nbs_dir in, which keeps the order of the joined records
+        counts = stage_io.write_records(stage_io.read_lines(nbs_dir, stage_io.read_blocksize()).map(_strip_line),
+                                        outdir, run_key, shard_bytes=None)
+
+    logger.info('Stripped %.1fMB off %s notebooks', counts['counters']['stripped_bytes'] / 2**20, counts['out'])
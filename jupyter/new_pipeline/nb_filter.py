@@ -2,44 +2,28 @@
 usage:
 '''
 
-import json
-import logging
 import random
 import shutil
 from pathlib import Path
 
 import dask.bag as db
-from dask.diagnostics import ProgressBar
-from polyglot.detect import Detector
 
+from jupyter import codec
+from jupyter import nlp_models
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import is_markdown
 from jupyter.new_pipeline.nl_parse import is_code_tag_in_nl
 
 random.seed(1123)
 
-pbar = ProgressBar()
-pbar.register()
-
 
 def get_markdown_language(nb):
-    def get_language(string):
-        logging.getLogger("polyglot").setLevel(logging.CRITICAL)
-        try:
-            d = Detector(string, quiet=True)
-            if d.reliable:
-                return d.language.name
-            else:
-                return d.languages[0].name
-        except:
-            # detector breaks on weird ascii chars, seems like
-            # they come from english
-            return 'failed'
-
     nl = ""
     for cell in nb['cells']:
         if is_markdown(cell) and 'source' in cell and cell['source']:
             nl += cell['source'] + ' '
-    lang = get_language(nl)
+    lang = nlp_models.detect_language(nl)
     # if lang == 'Italian':
     #     print('==========\n', nl)
     #     pass
@@ -51,7 +35,7 @@ def filter_for_english(nbs_indir, nbs_outdir):
     shutil.rmtree(nbs_outdir, ignore_errors=True)
     Path(nbs_outdir).mkdir(exist_ok=True)
 
-    # bag=db.read_text(nbs_indir +'/*.jsonl').map(json.loads)
+    # bag=db.read_text(nbs_indir +'/*.jsonl').map(codec.loads)
     # kernel_type = \
     #     bag.map(lambda nb: get_markdown_language(nb)) \
     #         .frequencies() \
@@ -60,10 +44,11 @@ def filter_for_english(nbs_indir, nbs_outdir):
     # pprint(kernel_type.compute())
 
     # todo deal with un! aka get the comments
-    (db.read_text(nbs_indir +'/*.jsonl').map(json.loads)
-        # un language means no nl, for these likely its all in the comments
-        .filter(lambda nb: get_markdown_language(nb) in ['English', 'un'])
-        .map(json.dumps).to_textfiles(nbs_outdir+'/*.jsonl'))
+    with ProgressBar(minimum=15):
+        (db.read_text(nbs_indir +'/*.jsonl').map(codec.loads)
+            # un language means no nl, for these likely its all in the comments
+            .filter(lambda nb: get_markdown_language(nb) in ['English', 'un'])
+            .map(codec.dumps).to_textfiles(nbs_outdir+'/*.jsonl'))
     print('num after english filter', count_num_recs_total(nbs_outdir))
 
 
@@ -72,11 +57,12 @@ def filter_for_english(nbs_indir, nbs_outdir):
 
 
 def filter_on_condition(indir, outdir, func):
-    (db.read_text(indir +'/*.jsonl').map(json.loads)
-     .filter(lambda js: func(js))
-     .map(json.dumps).to_textfiles(outdir+'/*.jsonl'))
+    with ProgressBar(minimum=15):
+        (db.read_text(indir +'/*.jsonl').map(codec.loads)
+         .filter(lambda js: func(js))
+         .map(codec.dumps).to_textfiles(outdir+'/*.jsonl'))
 def count_num_recs_total(indir):
-    return db.read_text(indir+'/*.jsonl').count().compute()
+    return stage_io.count_records(indir)
 def delete_create_dir(outdir):
     assert '/scratch/jupyter-pipeline' in outdir
     shutil.rmtree(outdir, ignore_errors=True)
@@ -116,7 +102,7 @@ def filter_for_python(nbs_indir, nbs_outdir):
     shutil.rmtree(nbs_outdir, ignore_errors=True)
     Path(nbs_outdir).mkdir(exist_ok=True)
 
-    # bag=db.read_text(nbs_indir +'/*.jsonl').map(json.loads)
+    # bag=db.read_text(nbs_indir +'/*.jsonl').map(codec.loads)
     # kernel_type = \
     #      bag.map(lambda nb: get_kernel_name(nb)) \
     #         .frequencies() \
@@ -124,9 +110,10 @@ def filter_for_python(nbs_indir, nbs_outdir):
     # print('Counts of languages used for kernel===========')
     # pprint(kernel_type.compute())
 
-    db.read_text(nbs_indir +'/*.jsonl').map(json.loads) \
-      .filter(lambda nb: get_kernel_name(nb) in ['python', 'python2']) \
-      .map(json.dumps).to_textfiles(nbs_outdir+'/*.jsonl')
+    with ProgressBar(minimum=15):
+        db.read_text(nbs_indir +'/*.jsonl').map(codec.loads) \
+          .filter(lambda nb: get_kernel_name(nb) in ['python', 'python2']) \
+          .map(codec.dumps).to_textfiles(nbs_outdir+'/*.jsonl')
 
     print('num after python filter', count_num_recs_total(nbs_outdir))
 
@@ -5,14 +5,12 @@ usage:
 
 import re
 
-import markdown2
-from bs4 import BeautifulSoup
-from nltk import word_tokenize
+from jupyter import nlp_models
 
 def is_code_tag_in_nl(nl):
-    html = markdown2.markdown(nl)
+    html = nlp_models.markdown(nl)
     try:
-        bs = BeautifulSoup(html, "html.parser")
+        bs = nlp_models.soup(html)
     except:
         return False
     if bs.find_all('code'):
@@ -20,8 +18,8 @@ def is_code_tag_in_nl(nl):
     return False
 
 def normalize_nl_leave_code_tokenize(nl):
-    html = markdown2.markdown(nl)
-    bs = BeautifulSoup(html, "html.parser")
+    html = nlp_models.markdown(nl)
+    bs = nlp_models.soup(html)
 
     # print(bs)
 
@@ -35,7 +33,7 @@ def normalize_nl_leave_code_tokenize(nl):
     p = re.compile(r'<.*?>')
     bs_string = p.sub('', bs_string)
     # print(bs_string)
-    return word_tokenize(bs_string)
+    return nlp_models.word_tokenize(bs_string)
 
 
 def unwrap_nested(tag):
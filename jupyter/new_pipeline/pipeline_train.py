@@ -3,25 +3,36 @@ nbgrader and exercise notebooks.
 '''
 import argparse
 import logging
+from functools import partial
 from pathlib import Path
 
+from jupyter import execution
+from jupyter import incremental
+from jupyter.dag import Stage, run_serial
+from jupyter.new_pipeline import fanout
 from jupyter.new_pipeline import shared_pipeline
 from jupyter.new_pipeline import split
 
 
-format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
-logging.basicConfig(
-    level=logging.INFO,
-    datefmt='%I:%M:%S %p',
-    format=format,
-    handlers=[
-        logging.FileHandler("train.log", mode='w'),
-        logging.StreamHandler()
-    ])
+def notebook_stages(opts):
+    '''The stages that handle each notebook on its own, they can run on any subset of
+    the input. Returns them with the dir the last one writes.'''
+    Path(opts.pipeline_outdir).mkdir(exist_ok=True, parents=True)
+    return shared_pipeline.stages(input_nbs_dir=opts.input_nbs_dir,
+                                  pipeline_outdir=opts.pipeline_outdir,
+                                  max_nl_distance=opts.max_nl_distance,
+                                  context_len=opts.context_len,
+                                  max_api_seq_len=opts.max_api_seq_len,
+                                  min_api_seq_len=opts.min_api_seq_len,
+                                  max_tokens=opts.max_tokens,
+                                  use_cache=not opts.no_cache,
+                                  sample=opts.sample,
+                                  debug_intermediates=opts.debug_intermediates)
 
 
-def run_pipeline(opts):
-    Path(opts.pipeline_outdir).mkdir(exist_ok=True)
+def global_stages(opts, dumped_rec_dir, deps):
+    '''The stages that need all records at once, starting after the stages in deps.'''
+    Path(opts.pipeline_outdir).mkdir(exist_ok=True, parents=True)
     dataset_dir = f'{opts.pipeline_outdir}/datasets'
     Path(dataset_dir).mkdir(exist_ok=True)
 
@@ -33,24 +44,84 @@ def run_pipeline(opts):
     dataset_strict_dir = f'{opts.pipeline_outdir}/datasets-strict'
     Path(dataset_strict_dir).mkdir(exist_ok=True)
 
+    lst = []
+    # we dedup on code, than a strict one on the nl
+    lst.append(Stage('dedup_code', partial(split.dedup_dump, dumped_rec_dir, deduped_code_dir, 'code_tokens'),
+                     deps=deps, outputs=[deduped_code_dir]))
+    lst.append(Stage('dedup_nl', partial(split.dedup_dump, deduped_code_dir, deduped_nl_dir, 'nl'),
+                     deps=['dedup_code'], outputs=[deduped_nl_dir]))
+    return lst
 
-    dumped_rec_dir = shared_pipeline.main(input_nbs_dir=opts.input_nbs_dir,
-                                                pipeline_outdir=opts.pipeline_outdir,
-                                                max_nl_distance=opts.max_nl_distance,
-                                                context_len=opts.context_len,
-                                                max_api_seq_len=opts.max_api_seq_len,
-                                                min_api_seq_len=opts.min_api_seq_len,
-                                                downsample=opts.downsample,
-                                                min_markdown_ratio=opts.min_markdown_ratio,
-                                                max_tokens=opts.max_tokens)
 
+def stages(opts):
+    lst, dumped_rec_dir = notebook_stages(opts)
+    return lst + global_stages(opts, dumped_rec_dir, deps=[lst[-1].name])
+
+
+def fanout_stages(opts):
+    '''One dataset per config in opts.configs, see jupyter.new_pipeline.fanout.'''
+    Path(opts.pipeline_outdir).mkdir(exist_ok=True)
+    configs = fanout.load_configs(opts.configs,
+                                  max_api_seq_len=opts.max_api_seq_len,
+                                  min_api_seq_len=opts.min_api_seq_len,
+                                  max_nl_distance=opts.max_nl_distance,
+                                  context_len=opts.context_len,
+                                  max_tokens=opts.max_tokens)
+    lst, dataset_dirs = fanout.stages(opts.input_nbs_dir, opts.pipeline_outdir, configs,
+                                      use_cache=not opts.no_cache, sample=opts.sample)
+
+    for config in configs:
+        name = config['name']
+        config_dir = fanout.config_dir(opts.pipeline_outdir, config)
+        deduped_code_dir = f'{config_dir}/deduped-code'
+        Path(deduped_code_dir).mkdir(parents=True, exist_ok=True)
+        deduped_nl_dir = f'{config_dir}/deduped-nl'
+        Path(deduped_nl_dir).mkdir(exist_ok=True)
+
+        lst.append(Stage(f'{name}/dedup_code', partial(split.dedup_dump, dataset_dirs[name], deduped_code_dir, 'code_tokens'),
+                         deps=[f'{name}/select_config'], outputs=[deduped_code_dir]))
+        lst.append(Stage(f'{name}/dedup_nl', partial(split.dedup_dump, deduped_code_dir, deduped_nl_dir, 'nl'),
+                         deps=[f'{name}/dedup_code'], outputs=[deduped_nl_dir]))
+    return lst
 
-    # we dedup on code, than a strict one on the nl
-    split.dedup_dump(dumped_rec_dir, deduped_code_dir, 'code_tokens')
-    split.dedup_dump(deduped_code_dir, deduped_nl_dir, 'nl')
+
+def run_incremental(opts):
+    '''Only runs the shared pipeline on notebooks not seen before, see jupyter.incremental.'''
+    state_dir = f'{opts.pipeline_outdir}/incremental'
+    deduped_code_dir = f'{opts.pipeline_outdir}/deduped-code'
+    deduped_nl_dir = f'{opts.pipeline_outdir}/deduped-nl'
+    Path(deduped_code_dir).mkdir(parents=True, exist_ok=True)
+    Path(deduped_nl_dir).mkdir(exist_ok=True)
+
+    batch, removed, index = incremental.ingest(opts.input_nbs_dir, state_dir,
+                                               max_nl_distance=opts.max_nl_distance,
+                                               context_len=opts.context_len,
+                                               max_api_seq_len=opts.max_api_seq_len,
+                                               min_api_seq_len=opts.min_api_seq_len,
+                                               max_tokens=opts.max_tokens)
+    incremental.update_dedup(state_dir, batch, removed, index, deduped_code_dir, deduped_nl_dir)
+
+
+def run_pipeline(opts):
+    if opts.incremental:
+        run_incremental(opts)
+    elif opts.configs:
+        run_serial(fanout_stages(opts))
+    else:
+        run_serial(stages(opts))
 
 
 if __name__ == '__main__':
+    format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format=format,
+        handlers=[
+            logging.FileHandler("train.log", mode='w'),
+            logging.StreamHandler()
+        ])
+
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-input_nbs_dir', required=True)
     parser.add_argument('-pipeline_outdir', required=True)
@@ -58,11 +129,21 @@ if __name__ == '__main__':
     parser.add_argument('-min_api_seq_len', type=int, default=0)
     parser.add_argument('-max_nl_distance', type=int)
     parser.add_argument('-context_len', type=int)
-    parser.add_argument('-downsample', type=float, default=-1)
+    parser.add_argument('-sample', '-downsample', type=float, default=-1,
+                        help='only process this fraction of the notebooks, picked by nb_index')
     parser.add_argument('-min_markdown_ratio', type=float)
     parser.add_argument('-max_tokens', type=int)
+    parser.add_argument('-no_cache', action='store_true', help='rerun stages even if cached')
+    parser.add_argument('-debug_intermediates', action='store_true',
+                        help='write the output of every filter instead of filtering in one pass')
+    parser.add_argument('-incremental', action='store_true',
+                        help='only process notebooks that are new since the last incremental run')
+    parser.add_argument('-configs', help='json file with a list of parameter settings, each gets its '
+                                         'own dataset under {pipeline_outdir}/configs/{name}')
+    execution.add_arguments(parser)
     opts = parser.parse_args()
 
-    assert opts.max_nl_distance <= opts.context_len
+    assert opts.configs or opts.max_nl_distance <= opts.context_len
 
-    run_pipeline(opts)
+    with execution.from_opts(opts):
+        run_pipeline(opts)
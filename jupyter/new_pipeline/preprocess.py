@@ -1,16 +1,17 @@
-import copy
-import json
 import logging
 import random
 import shutil
 from os.path import abspath
 from pathlib import Path
 
-import dask.bag as db
-from dask.diagnostics import ProgressBar
-
+from jupyter import codec
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter import viz_store
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import get_url, is_code, is_markdown
 from jupyter.new_pipeline.filter import grading_type
+from jupyter.new_pipeline.ingest import strip_outputs
 
 logger = logging.getLogger()
 
@@ -84,7 +85,8 @@ def process_dump_get_cells(nb, nb_vizdir, write_cells=False):
     :return:
     '''
 
-    nb_to_dump = copy.deepcopy(nb)
+    # the dumps show the notebook as it was scraped, the cells are changed below
+    nb_to_dump = codec.dumps(nb)
 
     # cell quality control here, non null source, cell type, etc.
     cells = nb['cells']
@@ -128,10 +130,9 @@ def process_dump_get_cells(nb, nb_vizdir, write_cells=False):
             c['metadata']['nb_orig_url'] = get_url(file_path)
 
         # dump the whole notebook to see the ctx with cell
-        with open(file_path, 'w') as outfile:
-            json.dump(nb_to_dump, outfile)
+        viz_store.write(nb_vizdir, file_path, nb_to_dump)
 
-        return new_cells
+        return [strip_outputs(c) for c in new_cells]
     else:
 
         found_test = False
@@ -170,30 +171,29 @@ def process_dump_get_cells(nb, nb_vizdir, write_cells=False):
                 # add nb and location to c for later visualization
                 c['metadata']['nb_orig_url'] = get_url(file_path)
 
-                # dump the whole notebook to see the ctx with c
-                with open(file_path, 'w') as outfile:
-                    json.dump(nb_to_dump, outfile)
+                # dump the whole notebook to see the ctx with c, stored once for all its cells
+                viz_store.write(nb_vizdir, file_path, nb_to_dump)
 
                 nbgrader_cells.append(c)
 
-        return nbgrader_cells
+        # the flags above were the last use of the outputs
+        return [strip_outputs(c) for c in nbgrader_cells]
 
 def dump_cells(nbs_dir, dataset_outdir, viz_outdir, write_cells=False):
-    shutil.rmtree(dataset_outdir, ignore_errors=True)
-    shutil.rmtree(viz_outdir, ignore_errors=True)
-    Path(dataset_outdir).mkdir(exist_ok=True)
+    run_key = stage_cache.stage_key(dump_cells, [nbs_dir], dict(write_cells=write_cells))
+    if stage_io.prepare_outdir(dataset_outdir, run_key):
+        # a resumed run keeps the notebooks dumped by the partitions already written
+        shutil.rmtree(viz_outdir, ignore_errors=True)
     Path(viz_outdir).mkdir(exist_ok=True)
 
     logger.info('')
 
     with ProgressBar(minimum=15):
-        (db.read_text(nbs_dir+'/*.jsonl')
-            # todo-release delete this
-            # .random_sample(.0001, random_state=1)
-            .map(json.loads).
+        # sampling is done by jupyter.sampling before this stage
+        bag = (stage_io.read_records(nbs_dir).
             map(process_dump_get_cells, nb_vizdir=viz_outdir, write_cells=write_cells).
-            flatten().
-            map(json.dumps).to_textfiles(dataset_outdir+'/*.jsonl'))
+            flatten())
+        counts = stage_io.write_records(bag, dataset_outdir, run_key)
 
-    logger.info('Num total cells %s', db.read_text(dataset_outdir+'/*.jsonl').count().compute())
+    logger.info('Num total cells %s', counts['out'])
 
@@ -1,57 +1,166 @@
 ''' This script filters code cells and outputs the dataset.
 '''
 
+from functools import partial
+
+from jupyter import sampling
+from jupyter import stage_cache
+from jupyter.dag import Stage, run_serial
 from jupyter.new_pipeline import filter
+from jupyter.new_pipeline import ingest
 from jupyter.new_pipeline import to_dataset
 from jupyter.new_pipeline.preprocess import dump_cells
 
 
-def main(input_nbs_dir,
-         pipeline_outdir,
-         max_nl_distance,
-         context_len,
-         max_api_seq_len,
-         min_api_seq_len,
-         is_nbgrader=False,
-         downsample=-1,
-         min_markdown_ratio=-1,
-         filter_code_tags=False,
-         filter_docstring=False,
-         exclusion_path_recs='',
-         max_tokens=1111111
-         ):
-
-    # Each preprocessing steps caches outputs into these directories.
+def ingest_stages(input_nbs_dir, pipeline_outdir, is_nbgrader=False, use_cache=True, sample=-1):
+    '''The stages that read the notebooks: sample_nbs if sample is positive, dump_cells
+    and strip_nbs. Returns them with the dirs of the cells and of the stripped
+    notebooks.'''
     dataset_outdir = f'{pipeline_outdir}/cells'
+    datasetviz_outdir = f'{pipeline_outdir}/cells-viz'
+    stripped_nbs_dir = f'{pipeline_outdir}/nbs-stripped'
+
+    run_stage = partial(stage_cache.run_stage, use_cache=use_cache)
+    lst = []
+
+    if sample > 0:
+        sample_outdir = f'{pipeline_outdir}/nbs-sample'
+        lst.append(Stage('sample_nbs', partial(
+            run_stage, sampling.sample_nbs, inputs=[input_nbs_dir],
+            outputs=[sample_outdir],
+            nbs_dir=input_nbs_dir, outdir=sample_outdir, fraction=sample),
+            deps=[], outputs=[sample_outdir]))
+        input_nbs_dir = sample_outdir
+    nbs_deps = [s.name for s in lst]
+
+    lst.append(Stage('dump_cells', partial(
+        run_stage, dump_cells, inputs=[input_nbs_dir],
+        outputs=[dataset_outdir, datasetviz_outdir],
+        nbs_dir=input_nbs_dir,
+        dataset_outdir=dataset_outdir,
+        viz_outdir=datasetviz_outdir,
+        write_cells=is_nbgrader), deps=nbs_deps,
+        outputs=[dataset_outdir, datasetviz_outdir]))
+
+    # the joins with the notebooks read them without outputs
+    lst.append(Stage('strip_nbs', partial(
+        run_stage, ingest.strip_nbs, inputs=[input_nbs_dir],
+        outputs=[stripped_nbs_dir],
+        nbs_dir=input_nbs_dir, outdir=stripped_nbs_dir), deps=nbs_deps,
+        outputs=[stripped_nbs_dir]))
+
+    return lst, dataset_outdir, stripped_nbs_dir
+
+
+def stages(input_nbs_dir,
+           pipeline_outdir,
+           max_nl_distance,
+           context_len,
+           max_api_seq_len,
+           min_api_seq_len,
+           is_nbgrader=False,
+           max_tokens=1111111,
+           use_cache=True,
+           sample=-1,
+           debug_intermediates=False):
+    '''The stages of main, returns them with the dir the last one writes.
+
+    :param sample: if positive, only this fraction of the notebooks is processed, see
+    jupyter.sampling.
+    :param debug_intermediates: run the filters and get_code_context_records as
+    separate stages that each write their output. Otherwise they run in one pass over
+    the cells and only the dataset records are written.
+    '''
+
+    # Each preprocessing steps caches outputs into these directories. A step is
+    # skipped if its inputs, parameters and code are unchanged since the last run.
     dataset_outdir2 = f'{pipeline_outdir}/cells2-parseable'
     dataset_outdir4 = f'{pipeline_outdir}/cells4-onefuncmaxapi'
     dataset_outdir5 = f'{pipeline_outdir}/cells5-nl{max_nl_distance}distaway'
     dataset_outdir6 = f'{pipeline_outdir}/cells6-dataset'
-    datasetviz_outdir = f'{pipeline_outdir}/cells-viz'
 
-    dump_cells(nbs_dir=input_nbs_dir,
-                   dataset_outdir=dataset_outdir,
-                   viz_outdir=datasetviz_outdir,
-                   write_cells=is_nbgrader)
+    run_stage = partial(stage_cache.run_stage, use_cache=use_cache)
+    lst, dataset_outdir, stripped_nbs_dir = ingest_stages(input_nbs_dir, pipeline_outdir, is_nbgrader,
+                                                          use_cache, sample)
+
+    if not debug_intermediates:
+        lst.append(Stage('get_filtered_code_context_records', partial(
+            run_stage, to_dataset.get_filtered_code_context_records,
+            inputs=[dataset_outdir, stripped_nbs_dir],
+            outputs=[dataset_outdir6],
+            cells_indir=dataset_outdir, cells_outdir=dataset_outdir6,
+            nbs_indir=stripped_nbs_dir, isnbgrader_logic=is_nbgrader,
+            max_api_seq_len=max_api_seq_len, min_api_seq_len=min_api_seq_len,
+            max_nl_distance=max_nl_distance, context_len=context_len, max_tokens=max_tokens),
+            deps=['dump_cells', 'strip_nbs'], outputs=[dataset_outdir6]))
+        return lst, dataset_outdir6
 
-    filter.filter_parseable_code_cells(dataset_outdir, dataset_outdir2, is_nbgrader)
+    lst.append(Stage('filter_parseable_code_cells', partial(
+        run_stage, filter.filter_parseable_code_cells, inputs=[dataset_outdir],
+        outputs=[dataset_outdir2],
+        cells_indir=dataset_outdir, cells_outdir=dataset_outdir2,
+        isnbgrader_logic=is_nbgrader), deps=['dump_cells'], outputs=[dataset_outdir2]))
 
-    filter.one_func_max_api_seq(dataset_outdir2, dataset_outdir4, max_api_seq_len=max_api_seq_len,
-                                min_api_seq_len=min_api_seq_len)
+    lst.append(Stage('one_func_max_api_seq', partial(
+        run_stage, filter.one_func_max_api_seq, inputs=[dataset_outdir2],
+        outputs=[dataset_outdir4],
+        cells_indir=dataset_outdir2, cells_outdir=dataset_outdir4,
+        max_api_seq_len=max_api_seq_len, min_api_seq_len=min_api_seq_len),
+        deps=['filter_parseable_code_cells'], outputs=[dataset_outdir4]))
 
     if is_nbgrader:
         # there is scope to increase size of nbgrader dataset. here we filter to cells with markdown
         # above but there are some good target cells which have a comment target nl. not very frequent
-        filter.filter_cells_nl_above_dataframe(dataset_outdir4, dataset_outdir5,
-                                           nbs_indir=input_nbs_dir, max_dist=max_nl_distance)
+        lst.append(Stage('filter_cells_nl_above_dataframe', partial(
+            run_stage, filter.filter_cells_nl_above_dataframe,
+            inputs=[dataset_outdir4, stripped_nbs_dir],
+            outputs=[dataset_outdir5],
+            cells_indir=dataset_outdir4, cells_outdir=dataset_outdir5,
+            nbs_indir=stripped_nbs_dir, max_dist=max_nl_distance),
+            deps=['one_func_max_api_seq', 'strip_nbs'], outputs=[dataset_outdir5]))
     else:
         # for noisy train we already make sure markdown above in the dump_cells method
         # since the join is expensive
         dataset_outdir5 = dataset_outdir4
 
+    lst.append(Stage('get_code_context_records', partial(
+        run_stage, to_dataset.get_code_context_records,
+        inputs=[dataset_outdir5, stripped_nbs_dir],
+        outputs=[dataset_outdir6],
+        cells_indir=dataset_outdir5, cells_outdir=dataset_outdir6,
+        nbs_indir=stripped_nbs_dir, context_len=context_len, max_tokens=max_tokens),
+        deps=[lst[-1].name, 'strip_nbs'], outputs=[dataset_outdir6]))
 
-    to_dataset.get_code_context_records(dataset_outdir5, dataset_outdir6, input_nbs_dir,
-                                        context_len=context_len, max_tokens=max_tokens)
+    return lst, dataset_outdir6
 
-    return dataset_outdir6
 
+def main(input_nbs_dir,
+         pipeline_outdir,
+         max_nl_distance,
+         context_len,
+         max_api_seq_len,
+         min_api_seq_len,
+         is_nbgrader=False,
+         downsample=-1,
+         min_markdown_ratio=-1,
+         filter_code_tags=False,
+         filter_docstring=False,
+         exclusion_path_recs='',
+         max_tokens=1111111,
+         use_cache=True,
+         debug_intermediates=False
+         ):
+
+    lst, dataset_outdir6 = stages(input_nbs_dir, pipeline_outdir,
+                                  max_nl_distance=max_nl_distance,
+                                  context_len=context_len,
+                                  max_api_seq_len=max_api_seq_len,
+                                  min_api_seq_len=min_api_seq_len,
+                                  is_nbgrader=is_nbgrader,
+                                  max_tokens=max_tokens,
+                                  use_cache=use_cache,
+                                  sample=downsample,
+                                  debug_intermediates=debug_intermediates)
+    run_serial(lst)
+
+    return dataset_outdir6
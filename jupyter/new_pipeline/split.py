@@ -1,8 +1,8 @@
-import json
 import logging
 
 from tqdm import tqdm
 
+from jupyter import codec
 from jupyter import get_files_under_dir
 
 logger = logging.getLogger(__name__)
@@ -18,7 +18,7 @@ def dedup_dump(cells_indir, outfile_dir, key, key2=None):
         for path in tqdm(get_files_under_dir(cells_indir, '.jsonl')):
             for line in tqdm(open(path)):
                 total += 1
-                js = json.loads(line)
+                js = codec.loads(line)
                 if key not in js:
                     num_wo_key += 1
                     continue
@@ -30,7 +30,7 @@ def dedup_dump(cells_indir, outfile_dir, key, key2=None):
                         val = tuple(js[key])
 
                     if val not in seen:
-                        outfile.write(json.dumps(js)+'\n')
+                        outfile.write(codec.dumps(js)+'\n')
                         seen.add(val)
 
     logger.info('num wo key %s', num_wo_key)
@@ -1,15 +1,14 @@
 import ast
-import json
 import logging
 import re
-import shutil
-from pathlib import Path
-
-import astor
-import dask.bag as db
-from dask.diagnostics import ProgressBar
+from functools import lru_cache
 
+from jupyter import predicates
+from jupyter import stage_cache
+from jupyter import stage_io
+from jupyter.execution import ProgressBar
 from jupyter.jupyter_utils import is_code, is_markdown, is_valid_cell
+from jupyter.new_pipeline import filter
 from jupyter.new_pipeline.filter import add_key
 from jupyter.new_pipeline.filter import grading_type
 from jupyter.new_pipeline.nl_parse import normalize_nl_leave_code_tokenize
@@ -18,6 +17,10 @@ from jupyter.preprocess.visitor import normalize_code
 
 logger = logging.getLogger(__name__)
 
+# the keys of the cells the dataset records are built from, add_key resets the
+# outputs and execution_count anyway
+DATASET_CELL_COLUMNS = ['cell_type', 'metadata', 'source']
+
 
 def ignore_this_source(code):
     if code == 'd1000 = 7316717653133062491922511967442657474235534919493496983520312774506326239578318016984801869478851843858615607891129494954595017379583319528532088055111254069874715852386305071569329096329522744304355766896648950445244523161731856403098711121722383113622298934233803081353362766142828064444866452387493035890729629049156044077239071381051585930796086670172427121883998797908792274921901699720888093776657273330010533678812202354218097512545405947522435258490771167055601360483958644670632441572215539753697817977846174064955149290862569321978468622482839722413756570560574902614079729686524145351004748216637048440319989000889524345065854122758866688116427171479924442928230863465674813919123162824586178664583591245665294765456828489128831426076900422421902267105562632111110937054421750694165896040807198403850962455444362981230987879927244284909188845801561660979191338754992005240636899125607176060588611646710940507754100225698315520005593572972571636269561882670428252483600823257530420752963450':
@@ -118,6 +121,14 @@ def get_imports(nb_cells, cell_index):
         import_toks = [t for t in import_toks if t.strip()]
     return import_toks
 
+@lru_cache(maxsize=None)
+def _astor():
+    '''astor, imported by the first record that needs it rather than by every process
+    importing this module.'''
+    import astor
+    return astor
+
+
 def take_single_function(code):
     tree = ast.parse(code)
     new_body = []
@@ -129,14 +140,14 @@ def take_single_function(code):
             if isinstance(n.body[0], ast.Expr) and isinstance(n.body[0].value, ast.Str):
                 n.body = n.body[1:]
             tree.body = [n]
-            return astor.to_source(tree)
+            return _astor().to_source(tree)
 
         # filter imports
         if not isinstance(n, ast.Import):
             new_body.append(n)
 
     tree.body = new_body
-    return astor.to_source(tree)
+    return _astor().to_source(tree)
 
 
 def replace_newlines_indents(toks, types, newline_tok='NEWLINE', enable_assert=True, strings=False, comments=False):
@@ -173,7 +184,7 @@ def get_all_code_process(code, allow_api_declarations=False):
 
         # full code, with no extraneous newlines, and normalized strings. i plan to use this for
         # context and target code!
-        clean_code = astor.to_source(ast.parse(code))
+        clean_code = _astor().to_source(ast.parse(code))
         clean_code_toks, clean_code_types = tokenize_and_templatize(clean_code)
         clean_code_toks = replace_newlines_indents(clean_code_toks, clean_code_types, strings=True, enable_assert=False)
 
@@ -300,14 +311,8 @@ def compute_dataset_record(row, context_len, max_tokens):
     return compute_dataset_record_helper(cell, nb_cells, cell_index, context_len, max_tokens)
 
 
-def get_code_context_records(cells_indir, cells_outdir, nbs_indir, context_len, max_tokens):
-    '''Convert cells into the dataset format where each record will store the
-    context/code pairs.'''
-    logger.info('')
-    shutil.rmtree(cells_outdir, ignore_errors=True)
-    Path(cells_outdir).mkdir(exist_ok=True)
-
-
+def join_cells_with_nbs(cells, nbs_indir):
+    '''Dataframe with a row per cell of the bag, holding the cell and the cells of its notebook.'''
     # this is required by dask
     cells_meta= {'cell_type': str,
                  'execution_count': int,
@@ -322,15 +327,53 @@ def get_code_context_records(cells_indir, cells_outdir, nbs_indir, context_len,
 
 
     # add nb_index key first to be able to join
-    cells_df = db.read_text(cells_indir +'/*.jsonl').map(json.loads).map(lambda js: add_key(js,cell=True)).to_dataframe(meta=cells_meta)
-    nbs_df = db.read_text(nbs_indir +'/*.jsonl').map(json.loads).map(lambda js: add_key(js)).to_dataframe(meta=nb_meta)
+    cells_df = cells.map(lambda js: add_key(js,cell=True)).to_dataframe(meta=cells_meta)
+    nbs_df = (stage_io.read_records(nbs_indir, columns=[k for k in nb_meta if k != 'nb_index'])
+              .map(lambda js: add_key(js)).to_dataframe(meta=nb_meta))
 
+    return cells_df.merge(nbs_df, on='nb_index', suffixes=['_cell', '_nb'])
 
-    with ProgressBar(minimum=15):
-        # join each cell with nb to compute dataset record
-        (cells_df.merge(nbs_df, on='nb_index', suffixes=['_cell', '_nb'])
+
+def code_context_records(cells, nbs_indir, context_len, max_tokens):
+    '''The dataset records of the cells in the bag.'''
+    # join each cell with nb to compute dataset record
+    return (join_cells_with_nbs(cells, nbs_indir)
      .apply(compute_dataset_record, context_len=context_len, max_tokens=max_tokens, meta=object, axis=1).to_bag()
      # records with len greater than max tokens will be none so we filter for valid records
-     .filter(lambda js: js and js['code_tokens'])
-     .map(json.dumps).to_textfiles(cells_outdir + '/*.jsonl'))
+     .filter(lambda js: js and js['code_tokens']))
+
 
+def get_code_context_records(cells_indir, cells_outdir, nbs_indir, context_len, max_tokens):
+    '''Convert cells into the dataset format where each record will store the
+    context/code pairs.'''
+    logger.info('')
+    run_key = stage_cache.stage_key(get_code_context_records, [cells_indir, nbs_indir],
+                                    dict(context_len=context_len, max_tokens=max_tokens))
+
+    with ProgressBar(minimum=15):
+        # the join partitions are the same on a restart, so only the records of
+        # unfinished partitions are recomputed
+        bag = code_context_records(stage_io.read_records(cells_indir, columns=DATASET_CELL_COLUMNS),
+                                   nbs_indir, context_len, max_tokens)
+        stage_io.write_records(bag, cells_outdir, run_key, export=True)
+
+
+def get_filtered_code_context_records(cells_indir, cells_outdir, nbs_indir, isnbgrader_logic,
+                                      max_api_seq_len, min_api_seq_len, max_nl_distance, context_len, max_tokens):
+    '''filter_parseable_code_cells, one_func_max_api_seq, filter_cells_nl_above_dataframe
+    (nbgrader only) and get_code_context_records in one pass over the cells, without
+    writing the filtered cells in between.'''
+    logger.info('')
+    run_key = stage_cache.stage_key(get_filtered_code_context_records, [cells_indir, nbs_indir],
+                                    dict(isnbgrader_logic=isnbgrader_logic, max_api_seq_len=max_api_seq_len,
+                                         min_api_seq_len=min_api_seq_len, max_nl_distance=max_nl_distance,
+                                         context_len=context_len, max_tokens=max_tokens))
+
+    with ProgressBar(minimum=15):
+        cells = predicates.apply_filters('get_filtered_code_context_records',
+                                         filter.code_cell_predicates(isnbgrader_logic, max_api_seq_len, min_api_seq_len),
+                                         stage_io.read_records(cells_indir, columns=DATASET_CELL_COLUMNS))
+        if isnbgrader_logic:
+            cells = filter.cells_nl_above(cells, nbs_indir, max_nl_distance)
+        bag = code_context_records(cells, nbs_indir, context_len, max_tokens)
+        stage_io.write_records(bag, cells_outdir, run_key, export=True)
@@ -0,0 +1,85 @@
+''' The NLP models of the stages, loaded once per worker process.
+
+polyglot's language detector, NLTK's punkt tokenizer, markdown2 and BeautifulSoup
+each cost an import and a first call that loads their data. execution.context warms
+them up when a worker process starts, so all tasks and stages that run on the worker
+reuse them instead of every compute starting fresh processes that load them again.
+'''
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# short markdown with a code tag, so every model is used once
+WARMUP_TEXT = 'Load the `data` and print the *first* rows. It should be in English.'
+
+_local = threading.local()
+
+
+def markdown(text):
+    '''markdown2.markdown, with one converter per thread.'''
+    if not hasattr(_local, 'markdown'):
+        import markdown2
+        _local.markdown = markdown2.Markdown()
+    return _local.markdown.convert(text)
+
+
+def soup(html):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, "html.parser")
+
+
+def word_tokenize(text):
+    from nltk import word_tokenize
+    return word_tokenize(text)
+
+
+def detect_language(text):
+    '''Name of the language polyglot detects, 'failed' if it can't tell.'''
+    from polyglot.detect import Detector
+    logging.getLogger("polyglot").setLevel(logging.CRITICAL)
+    try:
+        d = Detector(text, quiet=True)
+        if d.reliable:
+            return d.language.name
+        else:
+            return d.languages[0].name
+    except:
+        # detector breaks on weird ascii chars, seems like
+        # they come from english
+        return 'failed'
+
+
+def warm_up():
+    '''Import and load all models in this process.
+
+    :return: the seconds it took, None if a model failed to load.
+    '''
+    start = time.time()
+    try:
+        detect_language(WARMUP_TEXT)
+        word_tokenize(str(soup(markdown(WARMUP_TEXT))))
+    except Exception:
+        # the stages that use the model fail with the same error
+        logger.exception('NLP model warm-up failed')
+        return None
+    return time.time() - start
+
+
+def log_saved(warmup_seconds, computes=None):
+    '''Log what warming up the workers once saved over fresh workers for every compute.
+
+    :param computes: the computes run on the workers, None if they weren't counted.
+    '''
+    warmup_seconds = [t for t in warmup_seconds if t is not None]
+    if not warmup_seconds:
+        return
+    mean = sum(warmup_seconds) / len(warmup_seconds)
+    if computes is None:
+        logger.info('NLP model warm-up took %.2fs per worker on %s workers', mean, len(warmup_seconds))
+        return
+    saved = mean * len(warmup_seconds) * max(computes - 1, 0)
+    logger.info('NLP model warm-up took %.2fs per worker on %s workers and was done once for %s computes, '
+                'saving about %.1f worker-seconds', mean, len(warmup_seconds), computes, saved)
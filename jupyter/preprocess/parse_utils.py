@@ -5,7 +5,6 @@ python -m jupyter.preprocess.parse_utils
 '''
 
 import ast
-import astor
 
 def does_code_parse(cell):
     source = cell['source']
@@ -26,6 +25,7 @@ def remove_last_variable(code):
     '''code cells tend to end with a single variable, or a variable
     attribute access. this is so the outputs can be examined. we
     this, since its hard predict whether to generate this.'''
+    import astor
     try:
         tree = ast.parse(code)
         if is_access(tree.body[-1]):
@@ -2,9 +2,6 @@
 '''
 
 import ast
-import astor
-
-from nbconvert.filters.strings import ipython2python
 
 class NormalizeStringOnly(ast.NodeTransformer):
     def visit_Str(self, node):
@@ -57,6 +54,7 @@ class NormalizeCodeTokens(NormalizeStringOnly):
 
 
 def normalize_code(code_str, only_strings=False):
+    import astor
     # code_str = ipython2python(code_str)
     expr_ast = ast.parse(code_str)
     visitor = NormalizeStringOnly() if only_strings else NormalizeCodeTokens()
@@ -71,6 +69,7 @@ y = 4
 '''
 
 if __name__ == '__main__':
+    import astor
     # expr = """import pandas as pd;x = pd.DataFrame([])"""
     expr = """x = set();x.add(4)"""
     expr_ast = ast.parse(expr)
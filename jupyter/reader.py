@@ -0,0 +1,157 @@
+''' Reading the json lines of the stage inputs ahead of the stage.
+
+A partition of a stage is a single task that reads its block of the input and then
+runs the stage on the records, so the worker waits for the disk, decompression and
+json decoding while it could be tokenizing. The partitions of stage_io.read_records
+and read_lines instead read on a background thread, up to -read_ahead chunks of
+CHUNK_LINES lines ahead of the record the stage is at (JUICE_READ_AHEAD, see
+execution.py). With 0 each chunk is read when the stage gets to it.
+
+The time the stage waited for the next chunk is the I/O wait of the partition.
+write_records stores it, and the time the reading itself took, in the markers and
+the manifest of its dir, and dag logs them for each stage.
+
+split_blocks and block_lines cut files into partitions of lines the way db.read_text
+does.
+'''
+
+import queue
+import threading
+import time
+
+import dask
+
+READ_AHEAD = 2
+CHUNK_LINES = 1000
+
+_local = threading.local()
+_DONE = object()
+
+
+def read_ahead():
+    '''Chunks the partitions read ahead, set by execution.context.'''
+    return dask.config.get('juice.read_ahead', READ_AHEAD)
+
+
+def split_blocks(files, blocksize=None):
+    '''(file, start, end) blocks of about blocksize bytes of the (file, size) files, like
+    db.read_text cuts them. Without blocksize, or size, each file is one block up to its
+    end (None).'''
+    blocks = []
+    for f, size in files:
+        if not blocksize or size is None:
+            blocks.append((f, 0, None))
+            continue
+        blocks += [(f, start, min(start + blocksize, size)) for start in range(0, max(size, 1), blocksize)]
+    return blocks
+
+
+def _skip(f, n):
+    if f.seekable():
+        f.seek(n)
+        return
+    while n:
+        n -= len(f.read(min(n, 2**20)))
+
+
+def block_lines(f, start, end):
+    '''The lines of the binary file f that start in bytes start to end, end None for all.'''
+    pos = 0
+    if start:
+        # the line around start belongs to the block before
+        _skip(f, start - 1)
+        pos = start - 1 + len(f.readline())
+    while end is None or pos < end:
+        line = f.readline()
+        if not line:
+            return
+        pos += len(line)
+        yield line.decode('utf8')
+
+
+def chunked(items, size=CHUNK_LINES):
+    '''Lists of up to size consecutive items.'''
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def io_stats():
+    '''Seconds the partitions consumed on this thread waited for their input, and
+    seconds their reads took, so far.'''
+    return {'io_wait_seconds': getattr(_local, 'wait', 0.0), 'read_seconds': getattr(_local, 'read', 0.0)}
+
+
+def _count(wait, read):
+    _local.wait = getattr(_local, 'wait', 0.0) + wait
+    _local.read = getattr(_local, 'read', 0.0) + read
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(chunks, q, stop, busy):
+    try:
+        start = time.perf_counter()
+        for chunk in chunks:
+            busy[0] += time.perf_counter() - start
+            if not _put(q, chunk, stop):
+                return
+            start = time.perf_counter()
+        _put(q, _DONE, stop)
+    except BaseException as e:
+        _put(q, _Failed(e), stop)
+
+
+def ahead(chunks, depth=READ_AHEAD):
+    '''The items of the lists chunks yields, with up to depth of the chunks produced
+    ahead on a thread while the caller works on the items before.'''
+    chunks = iter(chunks)
+    if not depth:
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, _DONE)
+            elapsed = time.perf_counter() - start
+            _count(elapsed, elapsed)
+            if chunk is _DONE:
+                return
+            yield from chunk
+
+    q = queue.Queue(depth)
+    stop = threading.Event()
+    busy = [0.0]
+    thread = threading.Thread(target=_produce, args=(chunks, q, stop, busy), daemon=True)
+    thread.start()
+    waited = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = q.get()
+            waited += time.perf_counter() - start
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, _Failed):
+                raise chunk.error
+            yield from chunk
+    finally:
+        # also when the caller stops early, e.g. take
+        stop.set()
+        thread.join()
+        _count(waited, busy[0])
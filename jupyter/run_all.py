@@ -0,0 +1,137 @@
+'''Builds the full dataset: the nbgrader, exercise and train pipelines run as one DAG,
+then their outputs are combined into {pipeline_dir}/final-dataset.
+
+usage:
+python -m jupyter.run_all -input_dir {downloaded notebooks directory} -pipeline_dir {pipeline directory}
+'''
+import argparse
+import logging
+import shlex
+import subprocess
+import time
+from argparse import Namespace
+from functools import partial
+from pathlib import Path
+
+from jupyter import dag
+from jupyter import execution
+from jupyter import sampling
+from jupyter.exercise import pipeline as pipeline_exercise
+from jupyter.nbgrader import pipeline_nbgrader
+from jupyter.new_pipeline import pipeline_train
+
+logger = logging.getLogger(__name__)
+
+PIPELINES = {'nbgrader': pipeline_nbgrader, 'exercise': pipeline_exercise, 'train': pipeline_train}
+
+
+def combine(infiles, outfile, seed=42):
+    '''Concatenate the files and shuffle the lines like combine_dataset.sh did: shuf with
+    an openssl stream seeded by seed as its random source, so the final files have the
+    line order of the earlier builds.'''
+    random_source = f'openssl enc -aes-256-ctr -pass pass:{seed} -nosalt </dev/zero 2>/dev/null'
+    subprocess.run(['bash', '-o', 'pipefail', '-c',
+                    f'cat {" ".join(map(shlex.quote, infiles))} | '
+                    f'shuf --random-source=<({random_source}) --output={shlex.quote(outfile)}'],
+                   check=True)
+    with open(outfile) as f:
+        logger.info('%s lines written to %s', sum(1 for _ in f), outfile)
+
+
+def pipeline_opts(opts, input_dir, pipeline_dir):
+    '''Options of each pipeline, reading {input_dir}/{pipeline} and writing {pipeline_dir}/{pipeline}.'''
+    # same settings as the pipelines were run with from run_all.sh
+    nbgrader_opts = Namespace(input_nbs_dir=f'{input_dir}/nbgrader',
+                              pipeline_outdir=f'{pipeline_dir}/nbgrader',
+                              max_nl_distance=3, max_api_seq_len=15, min_api_seq_len=0,
+                              context_len=1200, no_cache=opts.no_cache, sample=opts.sample,
+                              debug_intermediates=opts.debug_intermediates)
+    exercise_opts = Namespace(input_nbs_dir=f'{input_dir}/exercise',
+                              pipeline_dir=f'{pipeline_dir}/exercise', sample=opts.sample,
+                              debug_intermediates=opts.debug_intermediates)
+    train_opts = Namespace(input_nbs_dir=f'{input_dir}/train',
+                           pipeline_outdir=f'{pipeline_dir}/train',
+                           max_nl_distance=1, context_len=12, max_api_seq_len=15, min_api_seq_len=0,
+                           min_markdown_ratio=0.3, max_tokens=120, sample=opts.sample,
+                           no_cache=opts.no_cache, debug_intermediates=opts.debug_intermediates)
+    return {'nbgrader': nbgrader_opts, 'exercise': exercise_opts, 'train': train_opts}
+
+
+def combine_stages(opts):
+    target = f'{opts.pipeline_dir}/final-dataset'
+    Path(target).mkdir(parents=True, exist_ok=True)
+    nbgrader_dir = f'{opts.pipeline_dir}/nbgrader/dataset-evalonly'
+    solution_dir = f'{opts.pipeline_dir}/exercise/dataset'
+    noisy_train = f'{opts.pipeline_dir}/train/deduped-nl/deduped_nl.jsonl'
+
+    # combine dev/test from each pipeline and shuffle. train only needs the train
+    # pipeline, so it doesn't wait for the other two
+    return [
+        dag.Stage('combine/dev', partial(
+            combine, [f'{nbgrader_dir}/dev.jsonl', f'{solution_dir}/dev.jsonl'], f'{target}/dev.jsonl'),
+            deps=['nbgrader/split', 'exercise/split'], outputs=[f'{target}/dev.jsonl']),
+        dag.Stage('combine/test', partial(
+            combine, [f'{nbgrader_dir}/test.jsonl', f'{solution_dir}/test.jsonl'], f'{target}/test.jsonl'),
+            deps=['nbgrader/split', 'exercise/split'], outputs=[f'{target}/test.jsonl']),
+        dag.Stage('combine/train', partial(combine, [noisy_train], f'{target}/train.jsonl'),
+                  deps=['train/dedup_nl'], outputs=[f'{target}/train.jsonl']),
+    ]
+
+
+def stages(opts):
+    lst = []
+    p_opts = pipeline_opts(opts, opts.input_dir, opts.pipeline_dir)
+    for name, pipeline in PIPELINES.items():
+        lst += dag.prefixed(pipeline.stages(p_opts[name]), name)
+    return lst + combine_stages(opts)
+
+
+def main(opts):
+    # the dask computations of all the stages running at the same time share the
+    # scheduler's workers, so concurrent branches don't oversubscribe the machine
+    start = time.time()
+    with execution.from_opts(opts):
+        stats = dag.run_concurrent(stages(opts), max_parallel=opts.max_parallel_stages,
+                                   measure=opts.sample > 0)
+
+    logger.info('%-50s %9s %9s %9s %10s %10s', 'stage', 'seconds', 'io wait', 'reading', 'stripped', 'viz dedup')
+    for name, s in sorted(stats.items(), key=lambda t: -t[1]['seconds']):
+        if 'io_wait_seconds' in s or 'viz_deduped_bytes' in s:
+            # extract writes notebooks but doesn't measure its reads
+            logger.info('%-50s %8.1fs %8.1fs %8.1fs %8.1fMB %8.1fMB', name, s['seconds'], s.get('io_wait_seconds', 0),
+                        s.get('read_seconds', 0), s.get('stripped_bytes', 0) / 2**20,
+                        s.get('viz_deduped_bytes', 0) / 2**20)
+        else:
+            logger.info('%-50s %8.1fs', name, s['seconds'])
+    if opts.sample > 0:
+        sampling.project(stats, opts.sample, wall_seconds=time.time() - start)
+
+
+if __name__ == '__main__':
+    format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format=format,
+        handlers=[
+            logging.FileHandler("run_all.log", mode='w'),
+            logging.StreamHandler()
+        ])
+
+    parser = argparse.ArgumentParser(description='')
+    # should point to juice-notebooks
+    parser.add_argument('-input_dir', required=True)
+    # directory where pipeline is written out
+    parser.add_argument('-pipeline_dir', required=True)
+    parser.add_argument('-max_parallel_stages', type=int, default=3,
+                        help='stages from independent branches that may run at once')
+    parser.add_argument('-no_cache', action='store_true', help='rerun stages even if cached')
+    parser.add_argument('-debug_intermediates', action='store_true',
+                        help='write the output of every filter instead of filtering in one pass')
+    parser.add_argument('-sample', type=float, default=-1,
+                        help='dry run on this fraction of the notebooks and project the time, records '
+                             'and disk of a full run. use a separate -pipeline_dir')
+    execution.add_arguments(parser, default_scheduler='processes')
+    opts = parser.parse_args()
+
+    main(opts)
@@ -0,0 +1,74 @@
+''' Dry runs on a deterministic sample of the notebooks.
+
+A notebook is in the sample if the md5 of its key falls below the fraction, so the
+same notebooks are picked on every run and a larger fraction picks a superset of a
+smaller one. After a sampled run, project() scales the measured time, records and
+disk usage of each stage up to the full input.
+'''
+
+import hashlib
+import logging
+
+from jupyter import stage_cache
+from jupyter import stage_io
+
+logger = logging.getLogger(__name__)
+
+
+def nb_index_key(js):
+    return js['metadata']['nb_index']
+
+
+def repo_path_key(js):
+    '''exercise records are not notebooks yet and have no nb_index.'''
+    return js['repo'] + '/' + js['path']
+
+
+KEYS = {'nb_index': nb_index_key, 'repo_path': repo_path_key}
+
+
+def in_sample(key, fraction):
+    h = int(hashlib.md5(str(key).encode('utf8')).hexdigest(), 16)
+    return h < fraction * 16**32
+
+
+def sample_nbs(nbs_dir, outdir, fraction, key='nb_index'):
+    '''Write the notebooks (or exercise records) in the sample to outdir.'''
+    run_key = stage_cache.stage_key(sample_nbs, [nbs_dir], dict(fraction=fraction, key=key))
+    get_key = KEYS[key]
+
+    bag = (stage_io.read_records(nbs_dir)
+           .filter(lambda js: in_sample(get_key(js), fraction)))
+    # the notebook filters read the sample as jsonl lines
+    stage_io.write_records(bag, outdir, run_key, export=True)
+
+
+def _size(num_bytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if num_bytes < 1024:
+            return f'{num_bytes:.1f}{unit}'
+        num_bytes /= 1024
+    return f'{num_bytes:.1f}TB'
+
+
+def project(stats, fraction, wall_seconds=None):
+    '''Log the measured stats of a sampled run scaled to the full input.
+
+    Fixed costs such as worker startup are scaled up too, so for small samples the
+    projected time is an upper bound.
+
+    :param stats: as returned by dag.run_serial or dag.run_concurrent with measure=True.
+    :param wall_seconds: time the whole sampled run took, if stages ran concurrently.
+    '''
+    logger.info('Projection of a full run from a %s sample', fraction)
+    logger.info('%-50s %10s %12s %14s %10s', 'stage', 'seconds', 'proj. hours', 'proj. records', 'proj. disk')
+    for name, s in stats.items():
+        logger.info('%-50s %10.1f %12.2f %14d %10s', name, s['seconds'], s['seconds'] / fraction / 3600,
+                    s.get('records', 0) / fraction, _size(s.get('bytes', 0) / fraction))
+
+    total_seconds = sum(s['seconds'] for s in stats.values())
+    total_bytes = sum(s.get('bytes', 0) for s in stats.values())
+    logger.info('%-50s %10.1f %12.2f %14s %10s', 'total (stages run one after another)', total_seconds,
+                total_seconds / fraction / 3600, '', _size(total_bytes / fraction))
+    if wall_seconds is not None:
+        logger.info('%-50s %10.1f %12.2f', 'wall time', wall_seconds, wall_seconds / fraction / 3600)
@@ -0,0 +1,217 @@
+'''Builds the full dataset on several nodes that share a filesystem.
+
+The input jsonl files are split into shards of about the same size and written to a
+manifest. Each node runs the stages that handle notebooks on their own (up to
+cells6-dataset, or onefuncmax for the exercise pipeline) on its shard, and marks the
+shard as done. The merge step links the shard outputs into the usual pipeline
+directories and runs the stages that need all records at once (dedup, splits,
+combine) just like run_all.
+
+usage:
+python -m jupyter.sharding -step manifest -input_dir {notebooks dir} -pipeline_dir {pipeline dir} -num_shards 8
+python -m jupyter.sharding -step shard -pipeline_dir {pipeline dir} -shard {0..7}     # on each node
+python -m jupyter.sharding -step merge -pipeline_dir {pipeline dir}
+
+-step local does all of it with -num_shards local processes acting as nodes.
+'''
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from os.path import abspath, basename, exists, getsize, join
+from pathlib import Path
+
+from dask.utils import parse_bytes
+
+from jupyter import archive
+from jupyter import dag
+from jupyter import execution
+from jupyter import get_files_under_dir
+from jupyter import run_all
+from jupyter import stage_io
+
+logger = logging.getLogger(__name__)
+
+DONE_FILE = '_done.json'
+
+
+def shards_dir(pipeline_dir):
+    return f'{pipeline_dir}/shards'
+
+
+def manifest_path(pipeline_dir):
+    return f'{shards_dir(pipeline_dir)}/manifest.json'
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_manifest(input_dir, pipeline_dir, num_shards):
+    '''Assign the input files of all pipelines to num_shards shards of about equal size.'''
+    if archive.is_archive_path(input_dir):
+        # the shards link the input files
+        raise ValueError(f'unpack {input_dir} to shard it, sharding needs the input files on disk')
+    files = []
+    for name in run_all.PIPELINES:
+        for path in get_files_under_dir(f'{input_dir}/{name}', '.jsonl'):
+            files.append((getsize(path), name, basename(path)))
+
+    shards = [{'bytes': 0, 'files': {name: [] for name in run_all.PIPELINES}} for _ in range(num_shards)]
+    # largest files first, each to the shard with the fewest bytes so far
+    for size, name, filename in sorted(files, reverse=True):
+        shard = min(shards, key=lambda s: s['bytes'])
+        shard['bytes'] += size
+        shard['files'][name].append(filename)
+
+    Path(shards_dir(pipeline_dir)).mkdir(parents=True, exist_ok=True)
+    manifest = {'input_dir': abspath(input_dir), 'shards': shards}
+    with open(manifest_path(pipeline_dir), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    for i, shard in enumerate(shards):
+        logger.info('shard %s: %s files, %.1fMB', i, sum(map(len, shard['files'].values())), shard['bytes'] / 2**20)
+    return manifest
+
+
+def run_shard(opts, shard):
+    '''Run the per notebook stages of all pipelines on one shard.'''
+    manifest = _load(manifest_path(opts.pipeline_dir))
+    shard_dir = f'{shards_dir(opts.pipeline_dir)}/{shard}'
+    input_dir = f'{shard_dir}/input'
+    done_path = join(shard_dir, DONE_FILE)
+    if exists(done_path):
+        os.remove(done_path)
+
+    # the shard's input is a dir of links, so the pipelines read it like the full input
+    shutil.rmtree(input_dir, ignore_errors=True)
+    files = manifest['shards'][shard]['files']
+    for name, filenames in files.items():
+        Path(input_dir, name).mkdir(parents=True)
+        for filename in filenames:
+            os.symlink(join(manifest['input_dir'], name, filename), join(input_dir, name, filename))
+
+    lst = []
+    outputs = {}
+    p_opts = run_all.pipeline_opts(opts, input_dir, shard_dir)
+    for name, pipeline in run_all.PIPELINES.items():
+        if files[name]:
+            stages, outputs[name] = pipeline.notebook_stages(p_opts[name])
+            lst += dag.prefixed(stages, name)
+
+    stats = dag.run_concurrent(lst, max_parallel=opts.max_parallel_stages)
+    with open(done_path, 'w') as f:
+        json.dump({'outputs': outputs, 'stats': stats}, f)
+    logger.info('shard %s done', shard)
+
+
+def link_outputs(outdirs, merged_dir):
+    '''Link the shards of all outdirs into merged_dir, numbered in order.'''
+    shutil.rmtree(merged_dir, ignore_errors=True)
+    Path(merged_dir).mkdir(parents=True)
+    paths = [path for outdir in outdirs for path in stage_io.shard_paths(outdir)]
+    for num, path in enumerate(paths):
+        # the whole suffix, e.g. .jsonl.gz, and padded so the readers keep the order
+        suffix = '.' + basename(path).split('.', 1)[1]
+        os.symlink(abspath(path), join(merged_dir, stage_io.shard_name(num, len(paths)) + suffix))
+    return len(paths)
+
+
+def merge(opts):
+    '''Run the stages that need all records on the outputs of all shards.'''
+    manifest = _load(manifest_path(opts.pipeline_dir))
+    done = []
+    for shard in range(len(manifest['shards'])):
+        done_path = join(shards_dir(opts.pipeline_dir), str(shard), DONE_FILE)
+        assert exists(done_path), f'shard {shard} is not done'
+        done.append(_load(done_path))
+
+    lst = []
+    p_opts = run_all.pipeline_opts(opts, manifest['input_dir'], opts.pipeline_dir)
+    for name, pipeline in run_all.PIPELINES.items():
+        outdirs = [d['outputs'][name] for d in done if name in d['outputs']]
+        assert outdirs, f'no shard has input for the {name} pipeline'
+        # same dir name as an unsharded run, e.g. {pipeline_dir}/nbgrader/cells6-dataset
+        merged_dir = f'{opts.pipeline_dir}/{name}/{basename(outdirs[0])}'
+        num = link_outputs(outdirs, merged_dir)
+        logger.info('%s: linked %s files of %s shards into %s', name, num, len(outdirs), merged_dir)
+        lst += dag.prefixed(pipeline.global_stages(p_opts[name], merged_dir, deps=[]), name)
+
+    stats = dag.run_concurrent(lst + run_all.combine_stages(opts), max_parallel=opts.max_parallel_stages)
+    for name, s in sorted(stats.items(), key=lambda t: -t[1]['seconds']):
+        logger.info('%-50s %8.1fs', name, s['seconds'])
+
+
+def run_local(opts):
+    '''Run every shard in its own process, as if each was a node, then merge.'''
+    make_manifest(opts.input_dir, opts.pipeline_dir, opts.num_shards)
+    workers = max(1, opts.num_workers // opts.num_shards)
+    procs = []
+    for shard in range(opts.num_shards):
+        cmd = [sys.executable, '-m', 'jupyter.sharding', '-step', 'shard',
+               '-pipeline_dir', opts.pipeline_dir, '-shard', str(shard),
+               '-num_workers', str(workers),
+               '-max_parallel_stages', str(opts.max_parallel_stages)]
+        if opts.scheduler:
+            cmd += ['-scheduler', opts.scheduler]
+        if opts.memory_limit:
+            # the shards run at the same time and share the memory
+            cmd += ['-memory_limit', str(parse_bytes(opts.memory_limit) // opts.num_shards)]
+        if opts.spill_dir:
+            cmd += ['-spill_dir', opts.spill_dir]
+        cmd += ['-intermediate_format', opts.intermediate_format, '-compression', opts.compression,
+                '-read_ahead', str(opts.read_ahead)]
+        if opts.no_cache:
+            cmd.append('-no_cache')
+        if opts.debug_intermediates:
+            cmd.append('-debug_intermediates')
+        procs.append(subprocess.Popen(cmd))
+
+    failed = [shard for shard, proc in enumerate(procs) if proc.wait() != 0]
+    assert not failed, f'shards {failed} failed, see sharding.log'
+    with execution.from_opts(opts):
+        merge(opts)
+
+
+if __name__ == '__main__':
+    format = '%(asctime)s[%(filename)25s:%(lineno)4s - %(funcName)30s()] - %(message)s'
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%I:%M:%S %p',
+        format=format,
+        handlers=[
+            # appended to, since every node logs here
+            logging.FileHandler("sharding.log", mode='a'),
+            logging.StreamHandler()
+        ])
+
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-step', required=True, choices=['manifest', 'shard', 'merge', 'local'])
+    # should point to juice-notebooks, only needed to make the manifest
+    parser.add_argument('-input_dir')
+    parser.add_argument('-pipeline_dir', required=True)
+    parser.add_argument('-num_shards', type=int, help='for -step manifest and local')
+    parser.add_argument('-shard', type=int, help='for -step shard')
+    parser.add_argument('-max_parallel_stages', type=int, default=3,
+                        help='stages from independent branches that may run at once')
+    parser.add_argument('-no_cache', action='store_true', help='rerun stages even if cached')
+    parser.add_argument('-debug_intermediates', action='store_true',
+                        help='write the output of every filter instead of filtering in one pass')
+    execution.add_arguments(parser, default_scheduler='processes')
+    opts = parser.parse_args()
+    # sampling is done by run_all, shards always take all of their notebooks
+    opts.sample = -1
+
+    if opts.step == 'manifest':
+        make_manifest(opts.input_dir, opts.pipeline_dir, opts.num_shards)
+    elif opts.step == 'local':
+        run_local(opts)
+    else:
+        with execution.from_opts(opts):
+            if opts.step == 'shard':
+                run_shard(opts, opts.shard)
+            else:
+                merge(opts)
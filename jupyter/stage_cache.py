@@ -0,0 +1,140 @@
+''' Content addressed cache for pipeline stages.
+
+Each stage is keyed by a hash of its input directories, its parameters and the
+source of the jupyter modules it depends on. When a stage finishes, the key is
+written next to its outputs, so a later run with the same key skips the stage.
+Inputs produced by another cached stage are fingerprinted by that stage's key,
+so unchanged upstream stages never invalidate downstream ones.
+'''
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from os.path import exists, isdir, join
+
+from jupyter import archive
+from jupyter import line_index
+
+logger = logging.getLogger(__name__)
+
+STAGE_FILE = '_stage.json'
+
+
+def _hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+def read_stage_key(outdir):
+    path = join(outdir, STAGE_FILE)
+    if not exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['key']
+
+
+def fingerprint_dir(path):
+    '''Key of the stage that produced the dir, otherwise a hash of the file names,
+    sizes and modification times under it.'''
+    stage_key = read_stage_key(path) if isdir(path) else None
+    if stage_key:
+        return stage_key
+
+    stats = []
+    in_archive = archive.split_path(path)
+    if in_archive:
+        # the dir isn't on disk, the archive stands for it
+        st = os.stat(in_archive[0])
+        stats.append((path, st.st_size, st.st_mtime_ns))
+    elif isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(line_index.SUFFIX):
+                # built on demand next to the files, doesn't change their content
+                continue
+            st = os.stat(join(path, name))
+            stats.append((name, st.st_size, st.st_mtime_ns))
+    elif exists(path):
+        st = os.stat(path)
+        stats.append((path, st.st_size, st.st_mtime_ns))
+    return _hash(stats)
+
+
+def _jupyter_modules(module):
+    '''All jupyter modules the given module references, including itself.'''
+    seen = {}
+    todo = [module]
+    while todo:
+        mod = todo.pop()
+        if mod.__name__ in seen:
+            continue
+        seen[mod.__name__] = mod
+        for val in vars(mod).values():
+            name = val.__name__ if inspect.ismodule(val) else getattr(val, '__module__', None)
+            if isinstance(name, str) and name.startswith('jupyter') and name in sys.modules:
+                todo.append(sys.modules[name])
+    return [seen[name] for name in sorted(seen)]
+
+
+def code_version(func):
+    '''Hash of the source of the module defining func and the jupyter modules it uses.'''
+    m = hashlib.sha1()
+    for mod in _jupyter_modules(sys.modules[func.__module__]):
+        try:
+            m.update(inspect.getsource(mod).encode('utf8'))
+        except (OSError, TypeError):
+            m.update(mod.__name__.encode('utf8'))
+    return m.hexdigest()
+
+
+def stage_key(func, inputs, params):
+    return _hash({
+        'stage': func.__module__ + '.' + func.__name__,
+        'code': code_version(func),
+        'inputs': [fingerprint_dir(path) for path in inputs],
+        'params': params,
+    })
+
+
+def is_cached(outdirs, key):
+    return all(read_stage_key(outdir) == key for outdir in outdirs)
+
+
+def mark_cached(outdirs, key, seconds=None):
+    for outdir in outdirs:
+        with open(join(outdir, STAGE_FILE), 'w') as f:
+            json.dump({'key': key, 'seconds': seconds}, f)
+
+
+def clear(outdirs):
+    for outdir in outdirs:
+        path = join(outdir, STAGE_FILE)
+        if exists(path):
+            os.remove(path)
+
+
+def run_stage(func, inputs, outputs, use_cache=True, **params):
+    '''Run func(**params) unless the outputs already hold a result with the same key.
+
+    :param inputs: dirs (or files) the stage reads.
+    :param outputs: dirs the stage writes, the key is stored in each of them.
+    :return: True if the stage was run, False if it was skipped.
+    '''
+    key = stage_key(func, inputs, params)
+    if not use_cache:
+        # also drops partially written outputs a stage would otherwise resume from
+        for outdir in outputs:
+            shutil.rmtree(outdir, ignore_errors=True)
+    elif is_cached(outputs, key):
+        logger.info('Skipping %s, outputs are cached under key %s', func.__name__, key[:12])
+        return False
+
+    # an interrupted run must not leave a stale key behind
+    clear([o for o in outputs if isdir(o)])
+    start = time.time()
+    func(**params)
+    mark_cached(outputs, key, seconds=time.time() - start)
+    return True
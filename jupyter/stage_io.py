@@ -0,0 +1,586 @@
+''' Reading and writing of stage directories.
+
+Stages write one shard per bag partition, ``{outdir}/{i}.jsonl``. A shard is first
+written to a temporary name and renamed once complete, then a marker is written to
+``{outdir}/_partitions/{i}``. The manifest ``{outdir}/_manifest.json`` stores the key
+of the run that owns the directory, so a restarted run with the same key only
+computes the partitions without a marker, while a run with a different key starts
+from an empty directory.
+
+Filters leave many nearly empty shards, so once all partitions are written the
+shards are compacted into shards of about SHARD_BYTES, keeping the order of the
+records. Readers cut the shards into partitions of about BLOCKSIZE bytes, so a few
+huge notebook files don't dominate a stage.
+
+While writing, write_records counts the records that reach it ('in'), the ones it
+writes ('out') and the ones it drops, if the stage passes its filter as select or a
+category function with the kept categories. The category counts give the histogram
+a stage logs without a second pass over the input. The counts of each partition are
+stored in its marker and their sum in the manifest, where count_records reads them
+instead of reading the whole dir again.
+
+Intermediate dirs can be written in the columnar format of jupyter.columnar instead
+of jsonl (-intermediate_format columnar, see execution.py), with ``{i}.cols``
+shards. Readers tell the format from the shards of a dir, and read_records can leave
+out the keys a stage doesn't need. The dataset dirs that are read as files by later
+stages or exported are always jsonl.
+
+The intermediate dirs can also be compressed (-compression, see jupyter.compression),
+e.g. ``{i}.jsonl.zst`` shards. Compressed jsonl shards are read one partition per
+shard, so they are compacted by the size of their records before compression.
+
+The notebook input dirs can also be dirs inside the downloaded archive, e.g.
+juice_notebooks.zip/nbgrader, read_lines and read_records then stream the members out
+of the archive (see jupyter.archive).
+
+read_lines and read_records read each partition ahead on a thread while the stage
+works on its first records, see jupyter.reader.
+'''
+
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import Counter
+from os.path import basename, exists, getsize, isdir, join
+from pathlib import Path
+
+import dask
+import dask.bag as db
+from dask.bag.core import reify
+from dask.base import tokenize
+from dask.highlevelgraph import HighLevelGraph
+from dask.utils import parse_bytes
+
+from jupyter import archive
+from jupyter import codec
+from jupyter import columnar
+from jupyter import line_index
+from jupyter import num_lines_in_file
+from jupyter import reader
+from jupyter.compression import codec_of, open_file, suffix
+
+logger = logging.getLogger(__name__)
+
+_partition = threading.local()
+
+MANIFEST = '_manifest.json'
+PARTITIONS_DIR = '_partitions'
+COMPACT_DIR = '_compact'
+
+BLOCKSIZE = 64 * 2**20
+SHARD_BYTES = 64 * 2**20
+
+FORMATS = ['jsonl', 'columnar']
+SUFFIXES = {'jsonl': '.jsonl', 'columnar': columnar.SUFFIX}
+# columnar shards compress inside the file
+SHARD_SUFFIXES = ('.jsonl', '.jsonl.gz', '.jsonl.zst', '.jsonl.lz4', columnar.SUFFIX)
+
+
+def intermediate_format():
+    '''Format of the intermediate dirs, set by execution.context.'''
+    return dask.config.get('juice.intermediate_format', 'jsonl')
+
+
+def intermediate_compression():
+    '''Codec of the intermediate dirs set by execution.context, None if uncompressed.'''
+    codec = dask.config.get('juice.compression', None)
+    return None if codec == 'none' else codec
+
+
+def dir_format(indir):
+    '''Format of the shards in indir.'''
+    if archive.is_archive_path(indir):
+        return 'jsonl'
+    if any(name.endswith(columnar.SUFFIX) for name in os.listdir(indir)):
+        return 'columnar'
+    return 'jsonl'
+
+
+def _project(js, columns):
+    return {k: v for k, v in js.items() if k in columns}
+
+
+def _parse(lines, columns):
+    records = [codec.loads(line) for line in lines]
+    return records if columns is None else [_project(js, columns) for js in records]
+
+
+def _open_block(f):
+    if isinstance(f, tuple):
+        return archive.open_member(*f)
+    return open_file(f, 'rb')
+
+
+def _jsonl_chunks(blocks, columns, parse):
+    for f, start, end in blocks:
+        with _open_block(f) as lines:
+            for chunk in reader.chunked(reader.block_lines(lines, start, end)):
+                yield _parse(chunk, columns) if parse else chunk
+
+
+def _columnar_chunks(chunks, columns):
+    for path, groups in chunks:
+        for group in groups:
+            yield columnar.read(path, [group], columns)
+
+
+def _read_partition(chunks, depth):
+    return reader.ahead(chunks, depth)
+
+
+def _bag(name, partitions, read, *args):
+    '''A bag with a partition read by read(partition, *args) for each of partitions.'''
+    if not partitions:
+        return db.from_sequence([], npartitions=1)
+    # the partition stays a lazy iterator if the next task fuses with it, so the
+    # stage works on the first records while the rest are read
+    name = name + '-' + tokenize(partitions, read, *args)
+    dsk = {(name, i): (reify, (_read_partition, (read, part) + args, reader.read_ahead()))
+           for i, part in enumerate(partitions)}
+    return db.Bag(HighLevelGraph.from_collections(name, dsk), name, len(partitions))
+
+
+def _jsonl_blocks(indir, blocksize):
+    '''[(file, start, end)] partitions of the jsonl shards in indir, in the order of db.read_text:
+    by name, which is the order they were written in since shard_name pads the numbers.'''
+    if isinstance(blocksize, str):
+        blocksize = parse_bytes(blocksize)
+    if archive.is_archive_path(indir):
+        archive_path, _ = archive.split_path(indir)
+        # the members that can't be read from an offset are one block each
+        files = [((archive_path, name), size if archive.splittable(archive_path, name) else None)
+                 for name, size in archive.members(indir)]
+    else:
+        files = sorted((join(indir, name), None) for name in os.listdir(indir)
+                       if name.endswith(SHARD_SUFFIXES) and codec_of(name))
+        if files:
+            # compressed files can't be split
+            blocksize = None
+        else:
+            paths = sorted(join(indir, name) for name in os.listdir(indir) if name.endswith('.jsonl'))
+            files = [(path, getsize(path)) for path in paths]
+    return [[block] for block in reader.split_blocks(files, blocksize)]
+
+
+def read_lines(indir, blocksize=None):
+    '''The json lines of the shards in indir like db.read_text(indir+'/*.jsonl'), read
+    ahead by a thread. indir can be a dir in an archive.'''
+    return _bag('read-lines', _jsonl_blocks(indir, blocksize), _jsonl_chunks, None, False)
+
+
+def _read(indir, blocksize, columns):
+    if dir_format(indir) == 'jsonl':
+        return _bag('read-records', _jsonl_blocks(indir, blocksize), _jsonl_chunks, columns and set(columns), True)
+
+    if isinstance(blocksize, str):
+        blocksize = parse_bytes(blocksize)
+    # consecutive row groups of a shard up to blocksize bytes make a partition, the
+    # shards in the order db.read_text reads jsonl shards
+    chunks = []
+    for path in sorted(join(indir, name) for name in os.listdir(indir) if name.endswith(columnar.SUFFIX)):
+        size = 0
+        for group in columnar.row_groups(path):
+            if not size or (blocksize and size + group[1] > blocksize):
+                chunks.append((path, []))
+                size = 0
+            chunks[-1][1].append(group)
+            size += group[1]
+    return _bag('read-records', [[chunk] for chunk in chunks], _columnar_chunks, columns)
+
+
+def read_blocksize():
+    '''Size of the partitions of read_records, smaller under a memory limit.'''
+    return dask.config.get('juice.blocksize', BLOCKSIZE)
+
+
+def read_records(indir, blocksize=None, columns=None):
+    '''The records of all shards in indir, in partitions of about blocksize bytes.
+
+    The default is BLOCKSIZE, or smaller if execution.context runs under a memory limit.
+
+    :param columns: if given, the records only have these keys. Columnar shards then
+    don't even read the others.
+    '''
+    if blocksize is None:
+        blocksize = read_blocksize()
+    return _read(indir, blocksize, columns)
+
+
+def read_shards(indir, columns=None):
+    '''read_records with one partition per shard, like db.read_text without a
+    blocksize, for stages whose output depends on the partitioning.'''
+    return _read(indir, None, columns)
+
+
+def read_manifest(outdir):
+    path = join(outdir, MANIFEST)
+    if not exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(outdir, manifest):
+    tmp_path = join(outdir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, join(outdir, MANIFEST))
+
+
+def _reset(outdir, key):
+    shutil.rmtree(outdir, ignore_errors=True)
+    Path(outdir, PARTITIONS_DIR).mkdir(parents=True)
+    write_manifest(outdir, {'key': key, 'complete': False})
+
+
+def prepare_outdir(outdir, key):
+    '''Make outdir ready for a run with the given key. Output of a previous run is
+    kept only if it has the same key.
+
+    :return: True if the dir was (re)created empty.
+    '''
+    if read_manifest(outdir).get('key') == key:
+        return False
+    _reset(outdir, key)
+    return True
+
+
+def done_partitions(outdir):
+    parts_dir = join(outdir, PARTITIONS_DIR)
+    if not exists(parts_dir):
+        return set()
+    return set(int(name) for name in os.listdir(parts_dir) if name.isdigit())
+
+
+def shard_name(i, num):
+    '''Name of shard i of num, zero padded like bag.to_textfiles names them, so the
+    shards sort by name in the order they were written.'''
+    return str(i).zfill(len(str(max(num - 1, 0))))
+
+
+def write_shard(records, outdir, name, fmt='jsonl', compression=None):
+    '''Write the records to the shard {outdir}/{name} in the given format, compressed
+    with the given codec.
+
+    :return: the file name of the shard and the bytes of the records before compression.
+    '''
+    if fmt == 'columnar':
+        shard = name + SUFFIXES[fmt]
+        tmp_path = join(outdir, shard + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            raw_bytes = columnar.write(records, f, compression)
+    else:
+        shard = name + SUFFIXES[fmt] + suffix(compression)
+        tmp_path = join(outdir, shard + '.tmp')
+        raw_bytes = 0
+        with open_file(tmp_path, 'wt', compression) as f:
+            for js in records:
+                # characters, close enough to bytes for sizing shards
+                raw_bytes += f.write(codec.dumps(js) + '\n')
+    os.replace(tmp_path, join(outdir, shard))
+    return shard, raw_bytes
+
+
+def add_to_counter(name, n):
+    '''Add n to the counter name of the partition write_records is writing on this
+    thread. The counters of all partitions are summed in its counts.'''
+    counters = getattr(_partition, 'counters', None)
+    if counters is not None:
+        counters[name] += n
+
+
+def _write_partition(records, outdir, i, num, select=None, category=None, kept=None, fmt='jsonl', compression=None):
+    before = reader.io_stats()
+    # the records are computed while they are written, on this thread
+    _partition.counters = Counter()
+    categories = Counter()
+    num_in = num_out = 0
+
+    def counted_in():
+        nonlocal num_in
+        for js in records:
+            num_in += 1
+            if category is not None:
+                c = category(js)
+                categories[c] += 1
+                if c not in kept:
+                    continue
+            yield js
+
+    def counted_out(records):
+        nonlocal num_out
+        for js in records:
+            num_out += 1
+            yield js
+
+    selected = counted_in() if select is None else select(counted_in())
+    try:
+        shard, raw_bytes = write_shard(counted_out(selected), outdir, shard_name(i, num), fmt, compression)
+        counters = _partition.counters
+    finally:
+        _partition.counters = None
+    marker = {'shard': shard, 'in': num_in, 'out': num_out, 'categories': categories, 'raw_bytes': raw_bytes,
+              'counters': counters}
+    # the partition's reads ran on this thread
+    marker.update({k: v - before[k] for k, v in reader.io_stats().items()})
+    with open(join(outdir, PARTITIONS_DIR, str(i)), 'w') as f:
+        json.dump(marker, f)
+    return [shard]
+
+
+def partition_counts(outdir):
+    '''Sum of the counts in the markers of the written partitions.'''
+    counts = {'in': 0, 'out': 0, 'dropped': 0, 'categories': Counter(), 'counters': Counter(),
+              'io_wait_seconds': 0.0, 'read_seconds': 0.0}
+    for i in done_partitions(outdir):
+        with open(join(outdir, PARTITIONS_DIR, str(i))) as f:
+            marker = json.load(f)
+        counts['in'] += marker['in']
+        counts['out'] += marker['out']
+        counts['categories'].update(marker['categories'])
+        counts['counters'].update(marker.get('counters', {}))
+        counts['io_wait_seconds'] += marker.get('io_wait_seconds', 0.0)
+        counts['read_seconds'] += marker.get('read_seconds', 0.0)
+    counts['dropped'] = counts['in'] - counts['out']
+    return counts
+
+
+def read_counts(outdir):
+    '''The counts stored in the manifest of outdir, None if they weren't counted.'''
+    counts = read_manifest(outdir).get('counts')
+    if counts is not None:
+        counts['categories'] = Counter(counts.get('categories', {}))
+        counts['counters'] = Counter(counts.get('counters', {}))
+    return counts
+
+
+def count_records(indir):
+    '''Records in the shards of indir, from its manifest if the writer counted them.'''
+    counts = read_counts(indir)
+    if counts is not None:
+        return counts['out']
+    if archive.is_archive_path(indir):
+        return read_lines(indir).count().compute()
+    if dir_format(indir) == 'columnar':
+        return sum(columnar.count(path) for path in shard_paths(indir))
+    num = 0
+    for path in [join(indir, name) for name in os.listdir(indir) if name.endswith(SHARD_SUFFIXES)]:
+        if codec_of(path):
+            with open_file(path, 'rb') as f:
+                num += sum(1 for _ in f)
+        else:
+            num += num_lines_in_file(path)
+    return num
+
+
+def write_textfiles(bag, outdir, source=None):
+    '''bag.map(codec.dumps).to_textfiles(outdir) for stages that don't use write_records,
+    or columnar or compressed shards if that is the intermediate format. The records written, and
+    those of source (a bag bag is computed from), are counted in the same pass and
+    stored in the manifest of outdir.
+
+    :return: the counts.
+    '''
+    fmt = intermediate_format()
+    compression = intermediate_compression()
+    if fmt == 'jsonl' and not compression:
+        write = bag.map(codec.dumps).to_textfiles(outdir+'/*.jsonl', compute=False)
+    else:
+        Path(outdir).mkdir(parents=True, exist_ok=True)
+        write = [dask.delayed(write_shard)(part, outdir, shard_name(i, bag.npartitions), fmt, compression)
+                 for i, part in enumerate(bag.to_delayed())]
+    source = bag if source is None else source
+    num_in, num_out, _ = dask.compute(source.count(), bag.count(), write)
+    counts = {'in': num_in, 'out': num_out, 'dropped': num_in - num_out}
+    write_manifest(outdir, {'counts': counts, 'format': fmt, 'compression': compression})
+    return counts
+
+
+def shard_paths(outdir):
+    '''The shards of outdir in order.'''
+    names = [name for name in os.listdir(outdir) if name.endswith(SHARD_SUFFIXES)]
+    return [join(outdir, name) for name in sorted(names, key=lambda name: int(name.split('.')[0]))]
+
+
+def _group_by_size(paths, target_bytes, sizes=None):
+    '''Split paths into runs of consecutive paths of about target_bytes each, by their
+    size in sizes (by file name) or on disk.'''
+    sizes = sizes or {}
+    groups = [[]]
+    size = 0
+    for path in paths:
+        path_size = sizes.get(basename(path)) or getsize(path)
+        if groups[-1] and size + path_size > target_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(path)
+        size += path_size
+    return groups
+
+
+def _concat(numbered_group, compact_dir, num_groups):
+    num, paths = numbered_group
+    # row groups of columnar shards are self contained and compressed files can be
+    # concatenated, so they concatenate like lines
+    out_path = join(compact_dir, shard_name(num, num_groups) + '.' + basename(paths[0]).split('.', 1)[1])
+    with open(out_path + '.tmp', 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, out)
+    os.replace(out_path + '.tmp', out_path)
+
+
+def _finish_compaction(outdir, manifest):
+    '''Move the compacted shards in place. Safe to rerun if interrupted.'''
+    compact_dir = join(outdir, COMPACT_DIR)
+    if exists(compact_dir):
+        for name in os.listdir(compact_dir):
+            os.replace(join(compact_dir, name), join(outdir, name))
+        os.rmdir(compact_dir)
+    num = manifest['compacted_shards']
+    for path in shard_paths(outdir):
+        stem = basename(path).split('.')[0]
+        # the partitions' shards the compacted ones didn't replace, they can be padded wider
+        if int(stem) >= num or stem != shard_name(int(stem), num):
+            os.remove(path)
+            if exists(line_index.index_path(path)):
+                os.remove(line_index.index_path(path))
+    shutil.rmtree(join(outdir, PARTITIONS_DIR), ignore_errors=True)
+    manifest['compacted'] = True
+    write_manifest(outdir, manifest)
+
+
+def compact(outdir, target_bytes=SHARD_BYTES):
+    '''Rewrite the shards of outdir into fewer shards of about target_bytes.'''
+    manifest = read_manifest(outdir)
+    paths = shard_paths(outdir)
+    # by the size before compression, which is what reading a shard takes
+    sizes = {}
+    for i in done_partitions(outdir):
+        with open(join(outdir, PARTITIONS_DIR, str(i))) as f:
+            marker = json.load(f)
+        sizes[marker['shard']] = marker.get('raw_bytes')
+    groups = _group_by_size(paths, target_bytes, sizes)
+    if len(groups) >= len(paths):
+        return
+
+    compact_dir = join(outdir, COMPACT_DIR)
+    shutil.rmtree(compact_dir, ignore_errors=True)
+    Path(compact_dir).mkdir()
+    (db.from_sequence(list(enumerate(groups)), npartitions=len(groups))
+     .map(_concat, compact_dir=compact_dir, num_groups=len(groups)).compute())
+
+    # from here on the partitions are gone, a restart only finishes the compaction
+    manifest['compacted_shards'] = len(groups)
+    write_manifest(outdir, manifest)
+    _finish_compaction(outdir, manifest)
+    logger.info('Compacted %s shards of %s into %s', len(paths), outdir, len(groups))
+
+
+def write_records(bag, outdir, key, shard_bytes=SHARD_BYTES, select=None, category=None, kept=(), export=False):
+    '''Dump each record of the bag as a json line into outdir, one shard per partition,
+    then compact the shards into shards of about shard_bytes (None to keep them).
+    Partitions finished by an earlier run with the same key are not recomputed.
+
+    :param select: if given, called with the records of each partition and returns
+    the ones to write, e.g. predicates.plan_filter.
+    :param category: if given, only the records whose category(record) is in kept are
+    written.
+    :param export: write uncompressed jsonl whatever the intermediate format, for dirs
+    that are read as files.
+    :return: the counts of the records: 'in', 'out', 'dropped' and a Counter of the
+    'categories' of all records, empty without category. Also the seconds the
+    partitions waited for their input ('io_wait_seconds') and spent reading it
+    ('read_seconds'), see jupyter.reader, and the 'counters' the stage added to
+    with add_to_counter.
+    '''
+    # the workers don't see the dask config of this process
+    fmt = 'jsonl' if export else intermediate_format()
+    compression = None if export else intermediate_compression()
+    prepare_outdir(outdir, key)
+
+    manifest = read_manifest(outdir)
+    if 'compacted_shards' in manifest:
+        # an earlier run with the same key already wrote everything
+        if not manifest.get('compacted'):
+            _finish_compaction(outdir, manifest)
+        return read_counts(outdir)
+
+    if 'npartitions' in manifest and (manifest['npartitions'], manifest.get('format', 'jsonl'),
+                                      manifest.get('compression')) != (bag.npartitions, fmt, compression):
+        # the partitioning or format changed so the markers don't line up anymore
+        _reset(outdir, key)
+        manifest = read_manifest(outdir)
+    manifest['npartitions'] = bag.npartitions
+    manifest['format'] = fmt
+    manifest['compression'] = compression
+    write_manifest(outdir, manifest)
+
+    done = done_partitions(outdir)
+    todo = [i for i in range(bag.npartitions) if i not in done]
+    if done:
+        logger.info('Resuming %s, %s of %s partitions already written',
+                    outdir, len(done), bag.npartitions)
+
+    if todo:
+        # same construction as bag.to_textfiles, so the write fuses into the
+        # partition's task, but only for the partitions still missing
+        name = 'write-records-' + tokenize(bag, outdir, todo)
+        dsk = {(name, j): (_write_partition, (bag.name, i), outdir, i, bag.npartitions, select, category,
+                           set(kept), fmt, compression)
+               for j, i in enumerate(todo)}
+        graph = HighLevelGraph.from_collections(name, dsk, dependencies=[bag])
+        db.Bag(graph, name, len(todo)).compute()
+
+    # counted from the markers, so partitions of an interrupted run are included
+    counts = partition_counts(outdir)
+    manifest['complete'] = True
+    manifest['counts'] = counts
+    write_manifest(outdir, manifest)
+    if shard_bytes:
+        compact(outdir, shard_bytes)
+    return counts
+
+
+def stage_stats(paths):
+    '''Seconds the partitions that wrote the given dirs waited for their input and
+    spent reading it, and the sums of their counters. None if none of them measured it.'''
+    stats = None
+    for path in paths:
+        counts = read_counts(path) if isdir(path) else None
+        if counts is not None and 'io_wait_seconds' in counts:
+            stats = stats or {'io_wait_seconds': 0.0, 'read_seconds': 0.0, 'counters': Counter()}
+            stats['io_wait_seconds'] += counts['io_wait_seconds']
+            stats['read_seconds'] += counts['read_seconds']
+            stats['counters'].update(counts['counters'])
+    return stats
+
+
+def output_stats(paths):
+    '''Number of jsonl records and bytes on disk under the given dirs or files. Hard
+    links to the same file, see viz_store, count once.'''
+    records = 0
+    size = 0
+    seen = set()
+    for path in paths:
+        if isdir(path):
+            files = [join(root, name) for root, _, names in os.walk(path) for name in names]
+        elif exists(path):
+            files = [path]
+        else:
+            files = []
+        counts = read_counts(path) if isdir(path) else None
+        if counts is not None:
+            records += counts['out']
+        for f in files:
+            st = os.stat(f)
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+            size += st.st_size
+            if counts is None and f.endswith('.jsonl'):
+                records += num_lines_in_file(f)
+    return records, size
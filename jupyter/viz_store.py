@@ -0,0 +1,84 @@
+''' The notebooks dumped for visualization, each stored once.
+
+dump_cells writes the whole notebook for each of its nbgrader cells, so the extension
+can scroll to the cell named in the file (nb_{nb_index}_cell_{cell_index}.ipynb, see
+jupyter_utils.get_url), and exercise extraction writes a solution and a submission
+notebook for each cell they differ in. Most of these files are copies.
+
+write stores the text of a notebook once under {vizdir}/.objects, named by its sha1,
+and makes the file at the path asked for a hard link to it. The paths and urls stay
+the same and the jupyter server serves the links like any file, while the copies
+take no space. Where the filesystem refuses the link, e.g. at its limit of links to
+a file, the text is written to the path as before.
+
+deduped_bytes tells from the link counts of the stored notebooks how many bytes the
+copies would have taken, so it covers every stage writing to a viz dir whatever
+process wrote which file. dag logs it for each stage with a viz dir in its outputs.
+'''
+
+import hashlib
+import os
+import tempfile
+from os.path import dirname, exists, isdir, join
+from pathlib import Path
+
+OBJECTS = '.objects'
+
+
+def object_path(vizdir, text):
+    '''Where the text is stored in vizdir.'''
+    digest = hashlib.sha1(text.encode('utf8')).hexdigest()
+    return join(vizdir, OBJECTS, digest[:2], digest + '.ipynb')
+
+
+def _replace_with(path, make):
+    '''Create path by make(tmp) and a rename, so readers and other workers writing the
+    same file never see it half written.'''
+    fd, tmp = tempfile.mkstemp(dir=dirname(path), prefix='.tmp')
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        make(tmp)
+        os.replace(tmp, path)
+    finally:
+        if exists(tmp):
+            os.remove(tmp)
+
+
+def _write_text(text):
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            f.write(text)
+    return write
+
+
+def write(vizdir, path, text):
+    '''Write text to path, a file under vizdir, as a link to its one copy in vizdir.
+
+    :return: path
+    '''
+    obj = object_path(vizdir, text)
+    if not exists(obj):
+        Path(dirname(obj)).mkdir(parents=True, exist_ok=True)
+        _replace_with(obj, _write_text(text))
+    try:
+        _replace_with(path, lambda tmp: os.link(obj, tmp))
+    except OSError:
+        _replace_with(path, _write_text(text))
+    return path
+
+
+def is_store(vizdir):
+    return isdir(join(vizdir, OBJECTS))
+
+
+def deduped_bytes(vizdir):
+    '''Bytes the files linked to the notebooks stored in vizdir would take beyond one
+    copy of each, if they were written out.'''
+    saved = 0
+    for root, _, names in os.walk(join(vizdir, OBJECTS)):
+        for name in names:
+            st = os.stat(join(root, name))
+            # the stored copy and one of its links would be written anyway
+            saved += max(st.st_nlink - 2, 0) * st.st_size
+    return saved
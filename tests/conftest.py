@@ -0,0 +1,15 @@
+import sys
+from os.path import dirname, abspath
+
+import dask
+import pytest
+
+# the tests import the jupyter package from the checkout
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def sync_scheduler():
+    '''Run the bags on this thread, with the default intermediate format.'''
+    with dask.config.set(scheduler='sync'):
+        yield
@@ -0,0 +1,47 @@
+import json
+import tarfile
+import zipfile
+
+import dask.bag as db
+
+from jupyter import archive
+from jupyter import stage_io
+
+
+def write_nbs(root):
+    nbs = root / 'nbs'
+    nbs.mkdir()
+    for f in range(3):
+        with open(nbs / f'{f}.jsonl', 'w') as out:
+            for i in range(200):
+                out.write(json.dumps({'nb_index': f * 1000 + i, 'source': 'x' * (i % 13)}) + '\n')
+    return nbs
+
+
+def make_zip(nbs, path, compression):
+    with zipfile.ZipFile(path, 'w', compression) as z:
+        for p in sorted(nbs.iterdir()):
+            z.write(p, f'nbs/{p.name}')
+
+
+def test_only_stored_zip_members_are_split(tmp_path):
+    nbs = write_nbs(tmp_path)
+    stored, deflated, tar = tmp_path / 's.zip', tmp_path / 'd.zip', tmp_path / 'a.tar'
+    make_zip(nbs, stored, zipfile.ZIP_STORED)
+    make_zip(nbs, deflated, zipfile.ZIP_DEFLATED)
+    with tarfile.open(tar, 'w') as t:
+        t.add(nbs, 'nbs')
+
+    assert archive.splittable(str(stored), 'nbs/0.jsonl')
+    assert not archive.splittable(str(deflated), 'nbs/0.jsonl')
+    assert archive.splittable(str(tar), 'nbs/0.jsonl')
+
+    expected = db.read_text(str(nbs / '*.jsonl'), blocksize=1000).compute()
+    for path in [stored, deflated, tar]:
+        bag = stage_io.read_lines(f'{path}/nbs', 1000)
+        assert bag.compute() == expected
+        # a deflated member is one partition, the others are cut into blocks
+        if path == deflated:
+            assert bag.npartitions == 3
+        else:
+            assert bag.npartitions > 3
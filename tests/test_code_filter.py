@@ -0,0 +1,56 @@
+import dask
+
+from jupyter import stage_io
+from jupyter.exercise import code_filter
+
+CODES = ['def f():\n    return 1', 'x = (', 'class A: pass', 'a = 1\nb = a + 1',
+         'def f():\n    pass\ndef g():\n    pass', 'import os\nos.path.join("a", "b")']
+
+
+def write_cells(indir, n=60):
+    cells = [{'code': CODES[i % len(CODES)], 'metadata': {'i': i}} for i in range(n)]
+    # two shards, like the parseable cells of two partitions
+    stage_io.write_shard(cells[:n // 2], indir, '0')
+    stage_io.write_shard(cells[n // 2:], indir, '1')
+    return cells
+
+
+def test_one_func_max_api_seq_counts_and_filters_in_one_pass(tmp_path):
+    indir, outdir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    (tmp_path / 'in').mkdir()
+    cells = write_cells(indir)
+
+    code_filter.one_func_max_api_seq(indir, outdir, 15, 0, 'code')
+
+    types = [code_filter.logic_type(c, 15, 0, 'code') for c in cells]
+    expected = [c for c, t in zip(cells, types) if t in ['1 function', 'pure logic', 'boilerplate']]
+    assert stage_io.read_records(outdir).compute() == expected
+    counts = stage_io.read_counts(outdir)
+    assert (counts['in'], counts['out']) == (len(cells), len(expected))
+    assert counts['categories'] == {t: types.count(t) for t in set(types)}
+    assert len(stage_io.shard_paths(outdir)) == 2
+
+
+def test_one_func_max_api_seq_writes_the_intermediate_format(tmp_path):
+    indir, outdir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    (tmp_path / 'in').mkdir()
+    cells = write_cells(indir)
+
+    with dask.config.set({'juice.intermediate_format': 'jsonl', 'juice.compression': 'gzip'}):
+        code_filter.one_func_max_api_seq(indir, outdir, 15, 0, 'code')
+
+    assert all(p.endswith('.jsonl.gz') for p in stage_io.shard_paths(outdir))
+    assert len(stage_io.read_records(outdir).compute()) == stage_io.read_counts(outdir)['out'] < len(cells)
+
+
+def test_filter_code_cells_is_the_two_filters_in_one_pass(tmp_path):
+    indir = str(tmp_path / 'in')
+    (tmp_path / 'in').mkdir()
+    write_cells(indir)
+    parseable, onefuncmax, fused = [str(tmp_path / name) for name in ['parseable', 'onefuncmax', 'fused']]
+
+    code_filter.filter_parseable_code_cells(indir, parseable, code_key='code')
+    code_filter.one_func_max_api_seq(parseable, onefuncmax, 15, 0, 'code')
+    code_filter.filter_code_cells(indir, fused, 15, 0, 'code')
+
+    assert stage_io.read_records(fused).compute() == stage_io.read_records(onefuncmax).compute()
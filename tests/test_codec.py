@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from jupyter import codec
+from jupyter import stage_io
+
+RECORDS = codec.PROBES[:3] + [
+    {'source': 'x = 18446744073709551616  # 2**64 in a string', 'ints': [2**63 - 1, 2**64 - 1, -2**63]},
+    {'big': [2**64, -2**63 - 1, 10**30], 'floats': [1e19, 1.8446744073709552e19, 0.1 + 0.2]},
+    {'unicode': 'héllo wörld \U0001F600', 'escapes': '\\ " / \n \t \x00', 'empty': [{}, [], '']},
+    {'nested': {'metadata': {'nb_index': 7, 'tags': ['a'] * 30}}, 'none': None, 'bools': [True, False]},
+]
+
+
+def installed():
+    names = []
+    for name in codec.BACKENDS:
+        try:
+            codec._loader(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+@pytest.fixture
+def shard(tmp_path):
+    name, _ = stage_io.write_shard(RECORDS, str(tmp_path), '0')
+    with open(tmp_path / name) as f:
+        return f.read().splitlines()
+
+
+@pytest.mark.parametrize('name', installed())
+def test_backend_round_trips_a_shard_like_the_json_module(name, shard):
+    _, loads, dumps = codec._select(name, check=False)
+    for line in shard + [line.encode('utf8') for line in shard]:
+        expected = json.loads(line)
+        decoded = loads(line)
+        assert codec._same(decoded, expected)
+        assert dumps(decoded) == json.dumps(expected)
+
+
+def test_orjson_is_used_despite_integers_beyond_64_bits():
+    pytest.importorskip('orjson')
+    backend, loads, _ = codec._select('orjson', check=False)
+    assert backend == 'orjson'
+    assert loads('{"a": 18446744073709551616}') == {'a': 2**64}
+    assert type(loads('[-9223372036854775809]')[0]) is int
+
+
+def test_auto_picks_an_installed_fast_backend():
+    fast = [name for name in installed() if name != 'stdlib']
+    if not fast:
+        pytest.skip('no json backend besides the json module is installed')
+    assert codec._select('auto', check=False)[0] == fast[0]
@@ -0,0 +1,62 @@
+import json
+
+import dask
+import dask.bag as db
+
+from jupyter import columnar
+from jupyter import stage_io
+
+
+def records(n):
+    out = []
+    for i in range(n):
+        js = {'metadata': {'nb_index': i // 4, 'cell_index': i % 4}, 'source': f'x = {i}  # é\n'}
+        if i % 3 == 0:
+            js['outputs'] = [{'text': ['out'] * (i % 5)}]
+        if i % 5 == 0:
+            # another key order
+            js = {'cell_type': 'markdown', **js, 'ok': None, 'score': i / 3, 'flag': i % 2 == 0}
+        out.append(js)
+    return out
+
+
+def dumped(recs):
+    # the key order is part of what has to come back
+    return [json.dumps(js) for js in recs]
+
+
+def test_shards_round_trip_and_read_only_the_columns_asked_for(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, 'ROW_GROUP_ROWS', 7)
+    recs = records(50)
+    path = str(tmp_path / '0.cols')
+    with open(path, 'wb') as f:
+        columnar.write(recs, f)
+
+    assert len(columnar.row_groups(path)) == 8
+    assert columnar.count(path) == len(recs)
+    assert dumped(columnar.read(path)) == dumped(recs)
+    assert columnar.read(path, columns=['source', 'ok']) == [
+        {k: v for k, v in js.items() if k in ('source', 'ok')} for js in recs]
+    # a row group is read on its own
+    assert dumped(columnar.read(path, groups=columnar.row_groups(path)[2:3])) == dumped(recs[14:21])
+
+
+def test_columnar_stage_dirs_read_like_jsonl(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, 'ROW_GROUP_ROWS', 7)
+    recs = records(120)
+    jsonl, cols = str(tmp_path / 'jsonl'), str(tmp_path / 'cols')
+    bag = db.from_sequence(recs, npartitions=6)
+    stage_io.write_records(bag, jsonl, 'key', shard_bytes=None)
+    with dask.config.set({'juice.intermediate_format': 'columnar'}):
+        # compacted into fewer shards by concatenating their row groups
+        stage_io.write_records(bag, cols, 'key', shard_bytes=4000)
+
+    assert stage_io.dir_format(cols) == 'columnar'
+    assert 1 < len(stage_io.shard_paths(cols)) < 6
+    assert dumped(stage_io.read_records(cols).compute()) == dumped(recs)
+    # partitions of a few row groups each, in order
+    assert stage_io.read_records(cols, blocksize=2000).npartitions > len(stage_io.shard_paths(cols))
+    assert dumped(stage_io.read_records(cols, blocksize=2000).compute()) == dumped(recs)
+    columns = ['metadata', 'outputs']
+    assert (stage_io.read_records(cols, columns=columns).compute()
+            == stage_io.read_records(jsonl, columns=columns).compute())
@@ -0,0 +1,59 @@
+import json
+
+import dask
+import dask.bag as db
+import pytest
+
+from jupyter import compression
+from jupyter import stage_io
+
+
+def installed(codec):
+    try:
+        compression.check_installed(codec)
+        return True
+    except ImportError:
+        return False
+
+
+CODECS = [pytest.param(codec, marks=pytest.mark.skipif(not installed(codec), reason=f'{codec} not installed'))
+          for codec in ['gzip', 'zstd', 'lz4']]
+
+
+def records(n):
+    return [{'i': i, 'source': 'print("é")\n' * (i % 4), 'metadata': {'n': i // 3}} for i in range(n)]
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_concatenated_files_read_as_one(tmp_path, codec):
+    path = str(tmp_path / ('a.jsonl' + compression.suffix(codec)))
+    parts = [''.join(f'{json.dumps(js)}\n' for js in records(30)[i:i + 10]) for i in range(0, 30, 10)]
+    # how compaction joins shards
+    with open(path, 'wb') as f:
+        for part in parts:
+            f.write(compression.compress(part.encode('utf8'), codec))
+
+    assert compression.codec_of(path) == codec
+    with compression.open_file(path, 'rt') as f:
+        assert f.read() == ''.join(parts)
+    assert compression.decompress(compression.compress(b'abc' * 100, codec), codec) == b'abc' * 100
+
+
+@pytest.mark.parametrize('fmt', stage_io.FORMATS)
+@pytest.mark.parametrize('codec', CODECS)
+def test_compressed_stage_dirs_round_trip(tmp_path, codec, fmt):
+    recs = records(200)
+    outdir = str(tmp_path / 'out')
+    with dask.config.set({'juice.intermediate_format': fmt, 'juice.compression': codec}):
+        counts = stage_io.write_records(db.from_sequence(recs, npartitions=8), outdir, 'key', shard_bytes=6000)
+
+    paths = stage_io.shard_paths(outdir)
+    # compacted by concatenating the compressed shards
+    assert len(paths) < 8
+    # columnar shards compress their blobs, not the file
+    suffix = stage_io.SUFFIXES[fmt] + (compression.suffix(codec) if fmt == 'jsonl' else '')
+    assert all(p.endswith(suffix) for p in paths)
+    assert counts['out'] == stage_io.count_records(outdir) == len(recs)
+    assert stage_io.read_records(outdir).compute() == recs
+    if fmt == 'jsonl':
+        assert stage_io.read_lines(outdir).map(json.loads).compute() == recs
@@ -0,0 +1,73 @@
+import copy
+import json
+
+from dotmap import DotMap
+
+from jupyter.nbgrader import dedup_get_solution as dedup
+from jupyter.nbgrader.checksum_util import compute_checksum
+
+BOILER = 'def f_{i}(x):\n    # YOUR CODE HERE\n    raise NotImplementedError()'
+SOLUTION = 'def f_{i}(x):\n    y = x * {k}\n    return y + {i}'
+INSTRUCTOR = 'def f_{i}(x):\n    ### BEGIN SOLUTION\n    return x - {i}\n    ### END SOLUTION'
+
+
+def cell(i, code, is_boilerplate, checksum=None, passed=True, instructor=False):
+    nbgrader = {'grade_id': f'q{i}', 'solution': True, 'is_boilerplate': is_boilerplate}
+    if checksum:
+        nbgrader['checksum'] = checksum
+    tokens = code.replace('\n', ' ').split()
+    return {
+        'code': code,
+        'code_tokens': tokens,
+        'nl': ['compute', 'f', str(i)],
+        'context': [{'cell_type': 'code', 'distance_target': 1}, {'cell_type': 'markdown', 'distance_target': 2}],
+        'is_instructor_answer': instructor,
+        'metadata': {'nbgrader': nbgrader, 'test_below_passed': passed, 'from_output_nb': i % 2 == 0},
+    }
+
+
+def synthetic_cells():
+    cells = []
+    for i in range(40):
+        boiler = BOILER.format(i=i)
+        kind = i % 5
+        if kind == 0:
+            # the boilerplate is in the dataset
+            cells.append(cell(i, boiler, True))
+            cells += [cell(i, SOLUTION.format(i=i, k=k), False, passed=k != 1) for k in range(3)]
+        elif kind == 1:
+            # only found through its checksum
+            checksum = compute_checksum(DotMap({'source': boiler, 'cell_type': 'code',
+                                                'metadata': {'nbgrader': {'grade_id': f'q{i}', 'solution': True}}}))
+            cells += [cell(i, SOLUTION.format(i=i, k=k), False, checksum=checksum) for k in range(2)]
+            # the boiler set is shared by all the groups
+            cells.append(cell(i + 1000, boiler, True))
+        elif kind == 2:
+            code = INSTRUCTOR.format(i=i)
+            cells += [cell(i, code, False, instructor=True) for _ in range(2)]
+        elif kind == 3:
+            cells += [cell(i, SOLUTION.format(i=i, k=k), False, passed=False) for k in range(2)]
+        else:
+            cells.append(cell(i, boiler, True))
+    return cells
+
+
+def test_spilled_groups_like_groupem(tmp_path):
+    cells = synthetic_cells()
+    paths = []
+    for shard in range(3):
+        path = tmp_path / f'{shard}.jsonl'
+        path.write_text(''.join(json.dumps(c) + '\n' for c in cells[shard::3]))
+        paths.append(str(path))
+
+    # main reads the shards in this order in both modes, it picks a group's solution
+    in_read_order = [json.loads(line) for path in paths for line in open(path)]
+    expected = dedup.groupem(list(map(dedup.add_keys, in_read_order)))
+    assert any('boilerplate_code_tokens' in c for c in expected)
+    for num_buckets in [1, 4, 7]:
+        assert dedup.groupem_spilled(paths, num_buckets, str(tmp_path)) == expected
+
+
+def test_group_key_is_add_keys_key():
+    for c in synthetic_cells():
+        assert dedup.group_key(c) == dedup.add_keys(copy.deepcopy(c))['groupbykey']
@@ -0,0 +1,43 @@
+import io
+import threading
+import time
+
+import dask.bag as db
+
+from jupyter import dag
+from jupyter import execution
+
+
+class RecordingBar(execution.ProgressBar):
+    def __init__(self):
+        super().__init__(out=io.StringIO())
+        self.computes = []
+
+    def _start(self, dsk):
+        self.computes.append(len(dsk))
+        super()._start(dsk)
+
+
+def slow(x):
+    time.sleep(0.01)
+    return x
+
+
+def test_concurrent_stages_each_show_their_own_computes():
+    bars = {}
+    both_started = threading.Barrier(2)
+
+    def stage(name, npartitions):
+        def run():
+            with RecordingBar() as bar:
+                bars[name] = bar
+                both_started.wait()
+                assert db.from_sequence(range(20), npartitions=npartitions).map(slow).sum().compute() == 190
+        return dag.Stage(name, run, deps=[])
+
+    with execution.context('threads', 4):
+        dag.run_concurrent([stage('small', 2), stage('large', 10)], max_parallel=2)
+
+    assert len(bars['small'].computes) == 1 and len(bars['large'].computes) == 1
+    assert bars['small'].computes[0] < bars['large'].computes[0]
+    assert '100%' in bars['small']._file.getvalue()
@@ -0,0 +1,68 @@
+import json
+import random
+
+import pytest
+
+from jupyter import stage_io
+from jupyter.dag import run_serial
+from jupyter.new_pipeline import fanout, shared_pipeline
+
+CODES = ['x = np.array([1,2,3])\ny = x.sum()', 'def f(a):\n    return a.mean()',
+         "import pandas as pd\ndf = pd.read_csv('a.csv')\ndf.head()", 'class A:\n    pass',
+         'def g():\n    pass\ndef h():\n    pass', 'plt.plot(x, y)\nplt.show()',
+         "z = df.groupby('a').agg('sum').reset_index().sort_values('b').head(10).tail(3).copy().fillna(0).mean()",
+         "print('hi')", 'a = 1']
+MARKDOWNS = ['Compute the sum of the array', 'Plot the data', 'Load the csv file', '# Section header',
+             'Now we compute the mean value']
+
+CONFIGS = [dict(name='a', max_api_seq_len=15, min_api_seq_len=0, max_nl_distance=1, context_len=12, max_tokens=120),
+           dict(name='b', max_api_seq_len=6, min_api_seq_len=1, max_nl_distance=2, context_len=2, max_tokens=30)]
+
+
+def write_nbs(nbs_dir, nbgrader):
+    rand = random.Random(0)
+    nbs_dir.mkdir()
+    nb_index = 0
+    for shard in range(2):
+        with open(nbs_dir / f'{shard}.jsonl', 'w') as f:
+            for _ in range(15):
+                cells = []
+                for k in range(rand.randint(3, 12)):
+                    if rand.random() < .45:
+                        cells.append({'cell_type': 'markdown', 'metadata': {}, 'source': rand.choice(MARKDOWNS)})
+                        continue
+                    metadata = {}
+                    if nbgrader and rand.random() < .5:
+                        metadata['nbgrader'] = {'solution': True, 'grade': False, 'grade_id': f'g{k}'}
+                    cells.append({'cell_type': 'code', 'metadata': metadata, 'source': rand.choice(CODES),
+                                  'outputs': [], 'execution_count': 1})
+                nb = {'cells': cells, 'metadata': {'nb_index': nb_index, 'repo': 'r', 'path': f'p{nb_index}.ipynb'},
+                      'nbformat': 4, 'nbformat_minor': 2}
+                f.write(json.dumps(nb) + '\n')
+                nb_index += 1
+
+
+def records(outdir):
+    out = stage_io.read_records(outdir).compute()
+    for js in out:
+        # the url names the pipeline dir the cell was dumped to
+        js['metadata'].pop('nb_orig_url', None)
+    return sorted(out, key=lambda js: (js['metadata']['nb_index'], js['metadata']['cell_index']))
+
+
+@pytest.mark.parametrize('nbgrader', [False, True])
+def test_fanout_gives_each_config_its_single_config_dataset(tmp_path, nbgrader):
+    nbs_dir = tmp_path / 'nbs'
+    write_nbs(nbs_dir, nbgrader)
+
+    stages, dataset_dirs = fanout.stages(str(nbs_dir), str(tmp_path / 'fanout'), CONFIGS, is_nbgrader=nbgrader)
+    run_serial(stages)
+
+    for config in CONFIGS:
+        single = shared_pipeline.main(str(nbs_dir), str(tmp_path / f'single-{config["name"]}'),
+                                      config['max_nl_distance'], config['context_len'], config['max_api_seq_len'],
+                                      config['min_api_seq_len'], is_nbgrader=nbgrader,
+                                      max_tokens=config['max_tokens'])
+        expected = records(single)
+        assert expected
+        assert records(dataset_dirs[config['name']]) == expected
@@ -0,0 +1,45 @@
+import pytest
+from dotmap import DotMap
+
+from jupyter import predicates
+from jupyter import stage_io
+from jupyter.nbgrader.checksum_util import compute_checksum
+from jupyter.new_pipeline import filter
+
+SOURCES = ['def f():\n    return 1', 'x = (', '%matplotlib inline\nclass A: pass', 'a = 1\nb = a + 1',
+           'def f():\n    pass\ndef g():\n    pass', 'print "py2"', '# YOUR CODE HERE\nraise NotImplementedError()']
+
+
+def cells(nbgrader, n=70):
+    out = []
+    for i in range(n):
+        metadata = {'nb_index': i // 5, 'cell_index': i % 5, 'nb_orig_url': 'u'}
+        if nbgrader:
+            metadata['nbgrader'] = {'grade_id': f'q{i}', 'solution': True}
+        cell = {'cell_type': 'markdown' if i % 9 == 0 else 'code', 'source': SOURCES[i % len(SOURCES)],
+                'execution_count': 0, 'outputs': [], 'metadata': metadata}
+        if nbgrader and i % 4 == 0:
+            # boilerplate, kept even if it doesn't parse
+            metadata['nbgrader']['checksum'] = compute_checksum(DotMap(cell)) if i % 8 == 0 else 'not the checksum'
+        out.append(cell)
+    return out
+
+
+@pytest.mark.parametrize('isnbgrader_logic', [False, True])
+def test_code_cell_predicates_are_the_two_stages_in_one_pass(tmp_path, isnbgrader_logic):
+    indir, parseable, onefuncmax = [str(tmp_path / name) for name in ['in', 'parseable', 'onefuncmax']]
+    (tmp_path / 'in').mkdir()
+    written = cells(isnbgrader_logic)
+    stage_io.write_shard(written[:35], indir, '0')
+    stage_io.write_shard(written[35:], indir, '1')
+
+    filter.filter_parseable_code_cells(indir, parseable, isnbgrader_logic)
+    filter.one_func_max_api_seq(parseable, onefuncmax, 15, 0)
+    fused = predicates.apply_filters('test', filter.code_cell_predicates(isnbgrader_logic, 15, 0),
+                                     stage_io.read_records(indir), sample_size=10).compute()
+
+    separate = stage_io.read_records(onefuncmax).compute()
+    assert 0 < len(separate) < len(written)
+    if isnbgrader_logic:
+        assert any(c['source'] == 'x = (' for c in separate)
+    assert fused == separate
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+import jupyter
+from jupyter import line_index
+
+RECORDS = [{'i': i, 'source': 'x' * (i % 5) + 'é'} for i in range(25)]
+
+
+def write(path, records, newline=True):
+    text = '\n'.join(json.dumps(js) for js in records)
+    with open(path, 'w') as f:
+        f.write(text + '\n' if newline and records else text)
+    return str(path)
+
+
+def test_build_and_random_access(tmp_path):
+    path = write(tmp_path / 'a.jsonl', RECORDS)
+    assert line_index.build(path) == 25
+    assert os.path.exists(line_index.index_path(path))
+    assert line_index.count(path) == 25
+    assert line_index.line(path, 3) == json.dumps(RECORDS[3])
+    assert line_index.record(path, 24) == RECORDS[24]
+    with pytest.raises(IndexError):
+        line_index.line(path, 25)
+    assert list(line_index.jsoniter(path, 10, 14)) == RECORDS[10:14]
+    assert list(line_index.jsoniter(path, 20)) == RECORDS[20:]
+    assert list(line_index.jsoniter(path, 20, 100)) == RECORDS[20:]
+    assert list(line_index.jsoniter(path, 14, 10)) == []
+
+
+def test_count_builds_the_index_unless_told_not_to(tmp_path):
+    path = write(tmp_path / 'a.jsonl', RECORDS)
+    assert line_index.count(path, write=False) == 25
+    assert not os.path.exists(line_index.index_path(path))
+    assert line_index.count(path) == 25
+    assert os.path.exists(line_index.index_path(path))
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    path = write(tmp_path / 'a.jsonl', RECORDS)
+    line_index.build(path)
+    write(path, RECORDS[:7])
+    assert line_index.count(path) == 7
+    assert line_index.record(path, 6) == RECORDS[6]
+
+    # same size, only the modification time tells the content changed
+    changed = RECORDS[:7][::-1]
+    size = os.path.getsize(path)
+    write(path, changed)
+    assert os.path.getsize(path) == size
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert [line_index.record(path, k) for k in range(7)] == changed
+
+
+def test_last_line_without_newline(tmp_path):
+    path = write(tmp_path / 'a.jsonl', RECORDS, newline=False)
+    assert line_index.count(path, write=False) == 25
+    assert line_index.count(path) == 25
+    assert line_index.record(path, 24) == RECORDS[24]
+    assert list(line_index.jsoniter(path, 23)) == RECORDS[23:]
+
+
+def test_empty_file(tmp_path):
+    path = write(tmp_path / 'a.jsonl', [])
+    assert line_index.count(path, write=False) == 0
+    assert line_index.count(path) == 0
+    assert list(line_index.jsoniter(path)) == []
+    with pytest.raises(IndexError):
+        line_index.line(path, 0)
+
+
+def test_package_jsoniter_seeks_with_start_and_stop(tmp_path):
+    path = write(tmp_path / 'a.jsonl', RECORDS)
+    assert list(jupyter.jsoniter(path)) == RECORDS
+    assert list(jupyter.jsoniter(path, lines=3)) == RECORDS[:3]
+    assert list(jupyter.jsoniter(path, start=5, stop=9)) == RECORDS[5:9]
+    assert list(jupyter.jsoniter(path, start=5)) == RECORDS[5:]
+    assert list(jupyter.jsoniter(path, lines=2, start=5, stop=9)) == RECORDS[5:7]
+    assert list(jupyter.jsoniter(path, stop=4)) == RECORDS[:4]
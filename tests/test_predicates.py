@@ -0,0 +1,64 @@
+import time
+
+import dask.bag as db
+
+from jupyter import predicates
+
+
+def slow_even(r):
+    time.sleep(0.0005)
+    return r % 2 == 0
+
+
+def test_plan_runs_the_cheap_selective_predicate_first():
+    chain = [predicates.Predicate('slow_even', slow_even),
+             predicates.Predicate('below_10', lambda r: r < 10)]
+    keep = predicates.plan_keep('test', chain, sample_size=50)
+    assert [r for r in range(200) if keep(r)] == [0, 2, 4, 6, 8]
+    assert [p.name for p in keep.ordered] == ['below_10', 'slow_even']
+
+
+def test_after_runs_on_what_it_depends_on():
+    def mark(r):
+        r['marked'] = True
+        return r['i'] % 3 != 0
+
+    chain = [predicates.Predicate('needs_mark', lambda r: r['marked'], after=('mark',)),
+             predicates.Predicate('mark', mark)]
+    records = [{'i': i, 'marked': False} for i in range(30)]
+    keep = predicates.plan_keep('test', chain, sample_size=10)
+    assert [r['i'] for r in records if keep(r)] == [i for i in range(30) if i % 3]
+    assert [p.name for p in keep.ordered] == ['mark', 'needs_mark']
+
+
+def test_each_record_is_read_and_parsed_once():
+    read, parsed = [], []
+
+    def parse(item):
+        parsed.append(item)
+        return {'n': int(item)}
+
+    def raw_even(item):
+        return None if item.endswith('7') else int(item) % 2 == 0
+
+    chain = [predicates.Predicate('even', lambda r: r['n'] % 2 == 0, raw=raw_even),
+             predicates.Predicate('small', lambda r: r['n'] < 100)]
+    items = db.from_sequence([str(i) for i in range(300)], npartitions=3).map(lambda i: read.append(i) or i)
+    kept = predicates.pushdown('test', chain, items, parse, sample_size=20).compute()
+
+    assert [r['n'] for r in kept] == [i for i in range(100) if i % 2 == 0]
+    assert sorted(read, key=int) == [str(i) for i in range(300)]
+    # only the items raw keeps or can't decide on are parsed
+    assert sorted(parsed, key=int) == [str(i) for i in range(300) if i % 2 == 0 or i % 10 == 7]
+
+
+def test_partitions_on_threads_plan_on_their_own_records(monkeypatch):
+    finished = []
+    finish = predicates.Plan.finish
+    monkeypatch.setattr(predicates.Plan, 'finish', lambda plan: finished.append(plan.records) or finish(plan))
+    chain = [predicates.Predicate('slow_even', slow_even),
+             predicates.Predicate('below_10', lambda r: r < 10)]
+    bag = db.from_sequence(range(400), npartitions=8)
+    kept = predicates.apply_filters('test', chain, bag, sample_size=20).compute(scheduler='threads')
+    assert kept == [0, 2, 4, 6, 8]
+    assert finished == [20] * 8
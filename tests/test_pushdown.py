@@ -0,0 +1,82 @@
+import json
+
+import dask.bag as db
+import pytest
+
+from jupyter import nb_scan
+from jupyter import predicates
+from jupyter.exercise import filters
+
+CELLS = [
+    {'cell_type': 'markdown', 'metadata': {'kernelspec': {'language': 'R'}},
+     'source': 'a "metadata": {"kernelspec": {"language": "R"}} string, \\"metadata\\" and é中\U0001F600'},
+    {'cell_type': 'code', 'metadata': {'metadata': {'language': 'R'}}, 'outputs': [], 'execution_count': 1,
+     'source': 'x = "\\u0041"  # \\ backslash'},
+]
+
+KERNELSPECS = {
+    'python': {'kernelspec': {'language': 'python', 'name': 'python3'}},
+    'python2': {'kernelspec': {'language': 'python2'}},
+    'R': {'kernelspec': {'language': 'R', 'name': 'ir'}},
+    'no kernelspec': {'language_info': {'name': 'python'}},
+    'no language': {'kernelspec': {'name': 'python3', 'display_name': 'Python 3'}},
+    # written as "pyth\u006fn" in the text, see escaped
+    'escaped language': {'kernelspec': {'language': 'python'}},
+    'nested metadata': {'kernelspec': {'language': 'python'}, 'extra': {'metadata': {'kernelspec': {}}}},
+    'metadata strings': {'kernelspec': {'language': 'python'}, 'tags': ['metadata', '"metadata": {}']},
+}
+
+
+def layouts(md):
+    '''The json texts of a notebook with metadata md, laid out in the ways notebooks come.'''
+    nbformat4 = {'cells': CELLS, 'metadata': md, 'nbformat': 4, 'nbformat_minor': 2}
+    return {
+        'nbformat 4': json.dumps(nbformat4),
+        'nbformat 4, indented': json.dumps(nbformat4, indent=1) + '\n',
+        'nbformat 4, ascii escapes': json.dumps(nbformat4, ensure_ascii=True),
+        'nbformat 4, unicode': json.dumps(nbformat4, ensure_ascii=False),
+        'metadata first': json.dumps({'metadata': md, 'cells': CELLS, 'nbformat': 4, 'nbformat_minor': 2}),
+        'sorted keys': json.dumps(nbformat4, sort_keys=True),
+        'nbformat 3': json.dumps({'metadata': md, 'nbformat': 3, 'nbformat_minor': 0,
+                                  'worksheets': [{'cells': CELLS, 'metadata': {}}]}),
+        'no metadata': json.dumps({'cells': CELLS, 'nbformat': 4, 'nbformat_minor': 2}),
+    }
+
+
+def escaped(kernel, text):
+    return text.replace('"python"', '"pyth\\u006fn"') if kernel == 'escaped language' else text
+
+
+CASES = [(kernel, layout, escaped(kernel, text))
+         for kernel, md in KERNELSPECS.items() for layout, text in layouts(md).items()]
+
+
+@pytest.mark.parametrize('kernel,layout,text', CASES, ids=[f'{k}-{l}' for k, l, _ in CASES])
+def test_raw_decision_agrees_with_full_parse(kernel, layout, text):
+    nb = json.loads(text)
+    decided = filters.is_python_text(text)
+    if decided is not None:
+        assert decided == filters.is_python(nb)
+        assert nb_scan.metadata(text) == nb['metadata']
+
+
+def test_nbformat4_layouts_are_decided():
+    for kernel, md in KERNELSPECS.items():
+        texts = {layout: escaped(kernel, text) for layout, text in layouts(md).items()}
+        for layout in ['nbformat 4', 'nbformat 4, indented', 'nbformat 4, ascii escapes', 'nbformat 4, unicode']:
+            if kernel != 'nested metadata':
+                assert filters.is_python_text(texts[layout]) is not None, (kernel, layout)
+        # the cells would have to be parsed to find the metadata
+        assert filters.is_python_text(texts['metadata first']) is None
+        assert filters.is_python_text(texts['nbformat 3']) is None
+
+
+def test_pushdown_keeps_what_the_full_parse_filters_keep():
+    texts = [text for _, _, text in CASES]
+    python = predicates.Predicate('is_python', filters.is_python, raw=filters.is_python_text)
+    has_cells = predicates.Predicate('has_cells', lambda nb: bool(nb.get('cells')))
+    lines = db.from_sequence(texts, npartitions=4)
+
+    pushed = predicates.pushdown('test', [python, has_cells], lines, json.loads).compute()
+    full = predicates.apply_filters('test', [python, has_cells], lines.map(json.loads)).compute()
+    assert pushed == full
@@ -0,0 +1,23 @@
+import os
+
+import dask
+import dask.bag as db
+
+from jupyter import sharding
+from jupyter import stage_io
+
+
+def test_link_outputs_keeps_compressed_shards_in_order(tmp_path):
+    recs = [{'i': i} for i in range(120)]
+    outdirs = []
+    with dask.config.set({'juice.compression': 'gzip'}):
+        for shard in range(2):
+            outdir = str(tmp_path / str(shard))
+            part = recs[shard * 60:(shard + 1) * 60]
+            stage_io.write_records(db.from_sequence(part, npartitions=6), outdir, 'key', shard_bytes=None)
+            outdirs.append(outdir)
+
+    merged = str(tmp_path / 'merged')
+    assert sharding.link_outputs(outdirs, merged) == 12
+    assert sorted(os.listdir(merged))[:2] == ['00.jsonl.gz', '01.jsonl.gz']
+    assert stage_io.read_records(merged).compute() == recs
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from jupyter import stage_cache
+
+calls = []
+
+
+def write_stage(outdir, value, fail=False):
+    calls.append(value)
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, 'out.txt'), 'w') as f:
+        f.write(str(value))
+    if fail:
+        raise RuntimeError('interrupted')
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    calls.clear()
+    indir = tmp_path / 'in'
+    indir.mkdir()
+    (indir / '0.jsonl').write_text('{}\n')
+    return str(indir), str(tmp_path / 'out')
+
+
+def run(indir, outdir, value, **kwargs):
+    return stage_cache.run_stage(write_stage, inputs=[indir], outputs=[outdir], outdir=outdir, value=value, **kwargs)
+
+
+def test_skips_a_stage_with_the_same_key(dirs):
+    indir, outdir = dirs
+    assert run(indir, outdir, 1)
+    assert not run(indir, outdir, 1)
+    assert calls == [1]
+
+
+def test_reruns_when_a_param_changes(dirs):
+    indir, outdir = dirs
+    assert run(indir, outdir, 1)
+    assert run(indir, outdir, 2)
+    assert calls == [1, 2]
+
+
+def test_reruns_when_the_upstream_key_changes(dirs):
+    indir, outdir = dirs
+    stage_cache.mark_cached([indir], 'upstream-1')
+    assert run(indir, outdir, 1)
+    assert not run(indir, outdir, 1)
+    stage_cache.mark_cached([indir], 'upstream-2')
+    assert run(indir, outdir, 1)
+    assert calls == [1, 1]
+
+
+def test_reruns_after_an_interrupted_run(dirs):
+    indir, outdir = dirs
+    assert run(indir, outdir, 1)
+    with pytest.raises(RuntimeError):
+        run(indir, outdir, 2, fail=True)
+    # the outputs were partly overwritten, so the key of the first run is gone
+    assert stage_cache.read_stage_key(outdir) is None
+    assert run(indir, outdir, 1)
+    assert calls == [1, 2, 1]
+
+
+def test_without_cache_drops_partial_outputs(dirs):
+    indir, outdir = dirs
+    os.makedirs(outdir)
+    with open(os.path.join(outdir, 'partial.jsonl'), 'w') as f:
+        f.write('{}\n')
+    assert run(indir, outdir, 1, use_cache=False)
+    assert sorted(os.listdir(outdir)) == ['_stage.json', 'out.txt']
+    assert run(indir, outdir, 1, use_cache=False)
+    assert calls == [1, 1]
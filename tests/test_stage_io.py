@@ -0,0 +1,53 @@
+import os
+
+import dask.bag as db
+
+from jupyter import stage_io
+
+
+def records(n):
+    return [{'i': i, 'source': 'x' * (i % 7)} for i in range(n)]
+
+
+def read_back(outdir):
+    return stage_io.read_records(outdir).compute()
+
+
+def test_write_records_keeps_order_over_ten_shards(tmp_path):
+    outdir = str(tmp_path / 'out')
+    recs = records(180)
+    stage_io.write_records(db.from_sequence(recs, npartitions=18), outdir, 'key', shard_bytes=None)
+
+    assert sorted(os.listdir(outdir))[:3] == ['00.jsonl', '01.jsonl', '02.jsonl']
+    assert read_back(outdir) == recs
+
+
+def test_write_records_resumes_missing_partitions(tmp_path):
+    outdir = str(tmp_path / 'out')
+    recs = records(120)
+    bag = db.from_sequence(recs, npartitions=12)
+    stage_io.write_records(bag, outdir, 'key', shard_bytes=None)
+
+    # an interrupted run: partition 3 never finished
+    os.remove(os.path.join(outdir, '03.jsonl'))
+    os.remove(os.path.join(outdir, stage_io.PARTITIONS_DIR, '3'))
+    written = []
+    counts = stage_io.write_records(bag.map(lambda js: written.append(js['i']) or js), outdir, 'key',
+                                    shard_bytes=None)
+
+    assert written == list(range(30, 40))
+    assert counts['out'] == len(recs)
+    assert read_back(outdir) == recs
+
+
+def test_compaction_keeps_order_over_ten_shards(tmp_path):
+    outdir = str(tmp_path / 'out')
+    recs = records(1200)
+    # 120 partitions of about 200 bytes compacted into about 20 shards
+    counts = stage_io.write_records(db.from_sequence(recs, npartitions=120), outdir, 'key', shard_bytes=2000)
+
+    shards = stage_io.shard_paths(outdir)
+    assert 11 <= len(shards) < 120
+    assert [os.path.basename(p) for p in shards[:2]] == ['00.jsonl', '01.jsonl']
+    assert counts['out'] == len(recs)
+    assert read_back(outdir) == recs
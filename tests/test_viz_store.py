@@ -0,0 +1,38 @@
+import collections
+import os
+
+from jupyter import dag
+from jupyter import viz_store
+from jupyter.exercise.extraction import dump_nb
+
+Row = collections.namedtuple('Row', ['path', 'contents'])
+
+
+def test_each_notebook_is_stored_once_at_every_path(tmp_path):
+    vizdir = str(tmp_path)
+    nbs = ['{"cells": [1]}', '{"cells": [2]}']
+    paths = []
+    for i, text in enumerate(nbs):
+        for cell in range(3):
+            paths.append(viz_store.write(vizdir, os.path.join(vizdir, f'nb_{i}_cell_{cell}.ipynb'), text))
+    # written again by a rerun of the partition
+    viz_store.write(vizdir, paths[0], nbs[0])
+
+    assert [open(p).read() for p in paths] == [nbs[0]] * 3 + [nbs[1]] * 3
+    assert len(os.listdir(os.path.join(vizdir, viz_store.OBJECTS))) == 2
+    assert not [name for name in os.listdir(vizdir) if name.startswith('.tmp')]
+    # 2 of the 3 files of each notebook would be copies
+    assert viz_store.deduped_bytes(vizdir) == 2 * len(nbs[0]) + 2 * len(nbs[1])
+
+
+def test_dag_reports_the_savings_of_the_exercise_dumps(tmp_path):
+    vizdir = str(tmp_path / 'nbviz')
+    os.mkdir(vizdir)
+    row = Row('/repo/ex/solution_1.ipynb', '{"cells": []}\n')
+
+    def extract():
+        for cell in range(4):
+            dump_nb(vizdir, row, cell)
+
+    stats = dag.run_serial([dag.Stage('extract', extract, deps=[], outputs=[vizdir])])
+    assert stats['extract']['viz_deduped_bytes'] == 3 * len(row.contents.strip())